@@ -1,32 +1,1855 @@
 import os
+import queue
+import io
+import csv
+import base64
+import bisect
+import calendar
+import hashlib
+import math
+import re
 import sqlite3
-from flask import Flask, request, jsonify, send_from_directory
+import time
+import threading
+import weakref
+import functools
+import gzip
+from collections import OrderedDict
+from concurrent.futures import Future
+import click
+from flask import (
+    Flask, Response, request, jsonify, g, has_app_context, stream_with_context
+)
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from datetime import datetime, date
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from datetime import datetime, date, timedelta
 import json
 
+try:
+    import orjson
+except ImportError:  # opcional: sem ele as respostas usam o json da biblioteca padrão
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # opcional: sem ele os assets são servidos só com gzip
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem lock entre processos para backup e manutenção
+    fcntl = None
+
+# Números que o orjson formata diferente do json padrão (1e-05 vs 0.00001, 1e+16 vs 1e16)
+_ORJSON_NUMERO_DIVERGENTE = re.compile(rb'(?:^|[:,\[])-?(?:\d[\d.]*e|0\.0000)')
+_ORJSON_NAO_ASCII = re.compile(rb'[\x7f-\xff]')
+_CARACTERE_NAO_ASCII = re.compile('[\x7f-\U0010ffff]')
+
+def _escape_ascii(match):
+    """Escape \\uXXXX igual ao do json com ensure_ascii (pares substitutos acima do BMP)"""
+    codigo = ord(match.group())
+    if codigo > 0xffff:
+        codigo -= 0x10000
+        return '\\u%04x\\u%04x' % (0xd800 | (codigo >> 10), 0xdc00 | (codigo & 0x3ff))
+    return '\\u%04x' % codigo
+
+def _tem_float_nao_finito(obj):
+    """Se há NaN/Infinity em `obj` (o orjson grava null; o json padrão, NaN e Infinity)"""
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(map(_tem_float_nao_finito, obj.values()))
+    if isinstance(obj, (list, tuple)):
+        return any(map(_tem_float_nao_finito, obj))
+    return False
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Serializa as respostas com orjson quando disponível.
+
+    O corpo gerado é idêntico byte a byte ao do provider padrão (chaves
+    ordenadas, separadores compactos, escapes ASCII). Quando o orjson não
+    consegue reproduzir a saída (tipos não suportados, floats em notação
+    científica, NaN e Infinity) a resposta é gerada pelo json padrão.
+    tests/test_json_saida.py e benchmark/json_saida.py conferem a equivalência.
+    """
+    
+    def dumps_fast(self, obj):
+        """JSON compacto em bytes ou None se o caminho padrão for necessário"""
+        if orjson is None or not (self.sort_keys and self.ensure_ascii):
+            return None
+        try:
+            corpo = orjson.dumps(
+                obj, default=self.default,
+                option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+            )
+        except TypeError:  # orjson.JSONEncodeError é subclasse de TypeError
+            return None
+        if _ORJSON_NUMERO_DIVERGENTE.search(corpo):
+            return None
+        if b'null' in corpo and _tem_float_nao_finito(obj):
+            return None
+        if _ORJSON_NAO_ASCII.search(corpo):
+            corpo = _CARACTERE_NAO_ASCII.sub(_escape_ascii, corpo.decode()).encode()
+        return corpo
+    
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        corpo = self.dumps_fast(self._prepare_response_obj(args, kwargs))
+        if corpo is None:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(corpo + b'\n', mimetype=self.mimetype)
+
 app = Flask(__name__, static_folder='static')
-CORS(app)
-app.config['SECRET_KEY'] = 'sistema-comissoes-objetiva-2024'
+app.json = FastJSONProvider(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'ETag'])
+app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'sistema-comissoes-objetiva-2024')
 
 # Configuração do banco de dados SQLite
-DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'database', 'comissoes.db')
+DATABASE_PATH = os.environ.get(
+    'DATABASE_PATH', os.path.join(os.path.dirname(__file__), 'database', 'comissoes.db')
+)
+
+# Ajustes de conexão (cache_size negativo = KiB; mmap_size em bytes; busy_timeout em ms)
+SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -16000))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 128 * 1024 * 1024))
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+# Reutiliza uma conexão por thread/worker; com 0 cada request abre e fecha a sua
+SQLITE_REUSE_CONNECTIONS = os.environ.get('SQLITE_REUSE_CONNECTIONS', '1') == '1'
+
+# Fila de escrita (opcional): com WRITE_QUEUE_ENABLED=1 as escritas dos requests
+# são aplicadas por uma thread única, até WRITE_QUEUE_MAX_BATCH operações por
+# transação. WRITE_QUEUE_MAX_WAIT (ms) espera mais operações antes do commit;
+# com 0 o lote é o que se acumulou enquanto o anterior era gravado
+WRITE_QUEUE_ENABLED = os.environ.get('WRITE_QUEUE_ENABLED', '0') == '1'
+WRITE_QUEUE_MAX_BATCH = int(os.environ.get('WRITE_QUEUE_MAX_BATCH', 64))
+WRITE_QUEUE_MAX_WAIT = float(os.environ.get('WRITE_QUEUE_MAX_WAIT', 0))
+WRITE_QUEUE_TIMEOUT = 30
+
+# Backups online (API de backup do SQLite) e manutenção do banco. Os intervalos
+# são em horas; 0 (padrão) desliga o agendamento, que o render.yaml liga.
+# Backup e manutenção continuam disponíveis pela CLI e pela API
+BACKUP_DIR = os.environ.get('BACKUP_DIR', os.path.join(os.path.dirname(DATABASE_PATH), 'backups'))
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 7))
+BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', 1024))
+BACKUP_STEP_PAUSE = float(os.environ.get('BACKUP_STEP_PAUSE', 2))  # ms entre passos
+BACKUP_INTERVAL_HOURS = float(os.environ.get('BACKUP_INTERVAL_HOURS', 0))
+MAINTENANCE_INTERVAL_HOURS = float(os.environ.get('MAINTENANCE_INTERVAL_HOURS', 0))
+# Páginas liberadas por execução do VACUUM incremental (0 = todas)
+MAINTENANCE_VACUUM_PAGES = int(os.environ.get('MAINTENANCE_VACUUM_PAGES', 2000))
+
+# Arquivamento: parcelas recebidas e com comissão paga, com vencimento e
+# pagamento da comissão há mais de ARCHIVE_AFTER_DAYS dias, vão para o banco
+# anexado como `arquivo` (ARCHIVE_DATABASE_PATH), ARCHIVE_BATCH_SIZE por transação
+ARCHIVE_DATABASE_PATH = os.environ.get(
+    'ARCHIVE_DATABASE_PATH', os.path.splitext(DATABASE_PATH)[0] + '-arquivo.db'
+)
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 1000))
+ARCHIVE_INTERVAL_HOURS = float(os.environ.get('ARCHIVE_INTERVAL_HOURS', 0))
+
+# Paginação das listagens (keyset)
+PAGE_SIZE_PADRAO = 500
+PAGE_SIZE_MAXIMO = 1000
+
+# Importação em lote: linhas por executemany e limite de erros no relatório
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_ERROS = 1000
+
+# Regra de comissão usada quando nenhuma regra cadastrada se aplica (pontos-base)
+DESCONTO_PADRAO_BP = 1500
+COMISSAO_PADRAO_BP = 1000
+# Linhas por transação no recálculo de comissões (o app segue gravando entre lotes)
+RECALCULO_CHUNK_SIZE = 5000
+# Faixa de ids por UPDATE no preenchimento de vendedor_id pelo nome
+VINCULO_CHUNK_SIZE = 20000
+
+# Limite de parcelas geradas por cronograma
+PARCELAMENTO_MAXIMO = 360
+
+# Exportação: linhas lidas do cursor por vez (memória constante)
+EXPORT_FETCH_SIZE = 1000
+
+# Feed de alterações (SSE): intervalo de consulta ao changelog, heartbeat e
+# duração máxima de cada conexão (o EventSource reconecta com Last-Event-ID)
+SSE_POLL_INTERVAL = float(os.environ.get('SSE_POLL_INTERVAL', 1.0))
+SSE_HEARTBEAT = 15
+SSE_MAX_DURATION = int(os.environ.get('SSE_MAX_DURATION', 300))
+SSE_BATCH_SIZE = 500
+# Cada conexão ocupa uma thread do worker enquanto dura: acima de SSE_MAX_STREAMS
+# conexões simultâneas por processo /api/events responde 503 com Retry-After,
+# para sobrarem threads às demais requisições (veja --threads no render.yaml)
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', 16))
+SSE_RETRY_AFTER = 30
+
+# Respostas GET guardadas em memória por (rota, filtros, versão dos dados); 0 desativa
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 256))
+
+# Respostas JSON a partir deste tamanho (bytes) vão com gzip se o cliente aceitar
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_LEVEL = 6
+
+# Métricas Prometheus em /metrics e instrumentação do SQL; METRICS_ENABLED=0 desliga tudo
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+# Comandos SQL mais lentos que isso (ms) vão para o log com o EXPLAIN QUERY PLAN
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+
+# Métricas (formato de exposição do Prometheus).
+# Os valores são por processo: cada worker do gunicorn expõe os seus.
+class Counter:
+    """Contador por combinação de labels"""
+
+    def __init__(self, nome, ajuda, labels):
+        self.nome, self.ajuda, self.labels = nome, ajuda, labels
+        self.series = {}
+
+    def inc(self, valores, quantidade=1):
+        self.series[valores] = self.series.get(valores, 0) + quantidade
+
+    def render(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} counter']
+        for valores, total in sorted(self.series.items()):
+            linhas.append(f'{self.nome}{format_labels(self.labels, valores)} {total}')
+        return linhas
+
+class Histogram:
+    """Histograma por combinação de labels; guarda contagens por faixa e acumula na exportação"""
+
+    def __init__(self, nome, ajuda, labels, buckets):
+        self.nome, self.ajuda, self.labels = nome, ajuda, labels
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, valores, valor):
+        serie = self.series.get(valores)
+        if serie is None:
+            serie = self.series[valores] = [[0] * (len(self.buckets) + 1), 0.0]
+        serie[0][bisect.bisect_left(self.buckets, valor)] += 1
+        serie[1] += valor
+
+    def render(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} histogram']
+        for valores, (contagens, soma) in sorted(self.series.items()):
+            acumulado = 0
+            for limite, contagem in zip(self.buckets + ('+Inf',), contagens):
+                acumulado += contagem
+                rotulos = format_labels(self.labels + ('le',), valores + (str(limite),))
+                linhas.append(f'{self.nome}_bucket{rotulos} {acumulado}')
+            rotulos = format_labels(self.labels, valores)
+            linhas.append(f'{self.nome}_sum{rotulos} {soma}')
+            linhas.append(f'{self.nome}_count{rotulos} {acumulado}')
+        return linhas
+
+def format_labels(nomes, valores):
+    """{nome="valor",...} com os escapes do formato de exposição"""
+    if not nomes:
+        return ''
+    pares = []
+    for nome, valor in zip(nomes, valores):
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pares.append(f'{nome}="{valor}"')
+    return '{' + ','.join(pares) + '}'
+
+LATENCIA_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+TAMANHO_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+CONSULTAS_BUCKETS = (0, 1, 2, 5, 10, 25, 50, 100, 250, 1000)
+
+_metrics_lock = threading.Lock()
+# Estado da requisição atual: início, consultas, tempo de SQL e cursores com comando pendente
+_metrics_local = threading.local()
+
+HTTP_DURACAO = Histogram(
+    'http_request_duration_seconds', 'Latência das requisições por rota', ('method', 'route'), LATENCIA_BUCKETS
+)
+HTTP_TAMANHO = Histogram(
+    'http_response_size_bytes', 'Tamanho do corpo das respostas por rota', ('method', 'route'), TAMANHO_BUCKETS
+)
+HTTP_STATUS = Counter('http_requests_total', 'Requisições por rota e status', ('method', 'route', 'status'))
+DB_CONSULTAS = Histogram(
+    'db_queries_per_request', 'Comandos SQL executados por requisição', ('method', 'route'), CONSULTAS_BUCKETS
+)
+DB_TEMPO_REQUISICAO = Histogram(
+    'db_time_per_request_seconds', 'Tempo em SQL por requisição', ('method', 'route'), LATENCIA_BUCKETS
+)
+DB_DURACAO = Histogram(
+    'db_query_duration_seconds', 'Duração de cada comando SQL (execute + fetch)', (), LATENCIA_BUCKETS
+)
+DB_LENTAS = Counter('db_slow_queries_total', f'Comandos SQL acima de {SLOW_QUERY_MS:g} ms', ())
+METRICAS = (HTTP_DURACAO, HTTP_TAMANHO, HTTP_STATUS, DB_CONSULTAS, DB_TEMPO_REQUISICAO, DB_DURACAO, DB_LENTAS)
+
+def log_slow_query(conn, sql, params, duracao):
+    """Registra no log um comando lento com o plano de execução"""
+    plano = ''
+    if params is not None and sql.lstrip()[:6].upper() in ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT'):
+        try:
+            linhas = conn.cursor(sqlite3.Cursor).execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+            plano = '\n'.join(f'  {linha[3]}' for linha in linhas)
+        except sqlite3.Error as e:
+            plano = f'  (EXPLAIN indisponível: {e})'
+    app.logger.warning(
+        'Consulta lenta (%.1f ms): %s | params=%.200r\n%s', duracao * 1000, ' '.join(sql.split()), params, plano
+    )
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor que mede o tempo de cada comando (execute + fetch até esgotar ou até o próximo execute)"""
+    _sql = None
+    _params = None
+    _tempo = 0.0
+
+    def _iniciar(self, sql, params, inicio):
+        self._sql, self._params = sql, params
+        self._tempo = time.perf_counter() - inicio
+        pendentes = getattr(_metrics_local, 'pendentes', None)
+        if pendentes is not None:
+            pendentes.add(self)
+
+    def _finalizar(self, coletado=False):
+        """Contabiliza o comando pendente.
+
+        Com coletado=True (chamado pelo coletor de lixo, talvez em outra thread)
+        só atualiza as métricas do processo: sem os contadores da requisição da
+        thread atual e sem o EXPLAIN numa conexão que pode ser de outra thread.
+        """
+        if self._sql is None:
+            return
+        sql, duracao = self._sql, self._tempo
+        self._sql = None
+        if not coletado and getattr(_metrics_local, 'pendentes', None) is not None:
+            _metrics_local.consultas += 1
+            _metrics_local.tempo_sql += duracao
+        with _metrics_lock:
+            DB_DURACAO.observe((), duracao)
+            lenta = duracao * 1000 >= SLOW_QUERY_MS
+            if lenta:
+                DB_LENTAS.inc(())
+        if lenta and not coletado:
+            log_slow_query(self.connection, sql, self._params, duracao)
+
+    def execute(self, sql, parameters=()):
+        self._finalizar()
+        inicio = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._iniciar(sql, parameters, inicio)
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finalizar()
+        inicio = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._iniciar(sql, None, inicio)
+
+    def __del__(self):
+        # Cursor descartado sem esgotar o resultado (ex.: conn.execute(...).fetchone())
+        self._finalizar(coletado=True)
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        row = super().fetchone()
+        self._tempo += time.perf_counter() - inicio
+        if row is None:
+            self._finalizar()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        inicio = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._tempo += time.perf_counter() - inicio
+        if len(rows) < size:
+            self._finalizar()
+        return rows
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        rows = super().fetchall()
+        self._tempo += time.perf_counter() - inicio
+        self._finalizar()
+        return rows
+
+class InstrumentedConnection(sqlite3.Connection):
+    """Conexão cujos cursores (inclusive os de conn.execute) são instrumentados"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+if METRICS_ENABLED:
+    @app.before_request
+    def start_request_metrics():
+        _metrics_local.inicio = time.perf_counter()
+        _metrics_local.consultas = 0
+        _metrics_local.tempo_sql = 0.0
+        # WeakSet: manter o cursor vivo impediria o reset do comando e o commit
+        _metrics_local.pendentes = weakref.WeakSet()
+
+    @app.after_request
+    def record_request_metrics(response):
+        inicio = getattr(_metrics_local, 'inicio', None)
+        if inicio is None:
+            return response
+        for cursor in list(_metrics_local.pendentes):
+            cursor._finalizar()
+        duracao = time.perf_counter() - inicio
+        _metrics_local.inicio = _metrics_local.pendentes = None
+        
+        rota = (request.url_rule.rule if request.url_rule else 'desconhecida',)
+        chave = (request.method,) + rota
+        # Resposta em stream (SSE, exportações) não tem tamanho: medir consumiria o stream inteiro
+        tamanho = None if response.is_streamed else response.calculate_content_length()
+        with _metrics_lock:
+            HTTP_DURACAO.observe(chave, duracao)
+            HTTP_STATUS.inc(chave + (str(response.status_code),))
+            if tamanho is not None:
+                HTTP_TAMANHO.observe(chave, tamanho)
+            DB_CONSULTAS.observe(chave, _metrics_local.consultas)
+            DB_TEMPO_REQUISICAO.observe(chave, _metrics_local.tempo_sql)
+        return response
+
+# Conexões reutilizadas por thread (gunicorn sync = uma por worker)
+_db_local = threading.local()
+
+def connect_db():
+    """Abre uma nova conexão SQLite com os PRAGMAs de desempenho"""
+    conn = sqlite3.connect(
+        DATABASE_PATH, timeout=SQLITE_BUSY_TIMEOUT / 1000,
+        factory=InstrumentedConnection if METRICS_ENABLED else sqlite3.Connection
+    )
+    conn.row_factory = sqlite3.Row
+    # Parcelas arquivadas (veja archive_parcelas); journal_mode vale para os dois bancos
+    conn.execute('ATTACH DATABASE ? AS arquivo', (ARCHIVE_DATABASE_PATH,))
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA arquivo.synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = {SQLITE_CACHE_SIZE}')
+    conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+    conn.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT}')
+    conn.execute('PRAGMA foreign_keys = ON')
+    return conn
 
 def get_db_connection():
-    """Conecta ao banco SQLite"""
+    """Conexão SQLite da thread atual, liberada no teardown do app context"""
     try:
-        os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
-        conn = sqlite3.connect(DATABASE_PATH)
-        conn.row_factory = sqlite3.Row
+        conn = getattr(_db_local, 'conn', None) if SQLITE_REUSE_CONNECTIONS else None
+        # Após um fork (gunicorn --preload) a conexão herdada não pode ser usada
+        if conn is None or _db_local.pid != os.getpid():
+            conn = connect_db()
+            if SQLITE_REUSE_CONNECTIONS:
+                _db_local.conn = conn
+                _db_local.pid = os.getpid()
+        if has_app_context():
+            g.db = conn
         return conn
     except Exception as e:
         print(f"Erro ao conectar ao banco: {e}")
         return None
 
-def init_db():
-    """Inicializa as tabelas do banco de dados"""
+@app.teardown_appcontext
+def release_db_connection(exception):
+    """Devolve a conexão da thread (ou fecha, sem reutilização) ao fim do request"""
+    conn = g.pop('db', None)
+    if conn is None:
+        return
+    if conn.in_transaction:
+        conn.rollback()
+    if not SQLITE_REUSE_CONNECTIONS:
+        conn.close()
+
+class WriteQueue:
+    """Escritor único do processo: aplica as operações enfileiradas em lotes (group commit).
+
+    Cada operação é uma função que recebe o cursor e roda em um SAVEPOINT
+    próprio dentro da transação do lote: se falhar, só ela é desfeita e a
+    exceção volta para quem a enviou. Resultados só são entregues após o COMMIT.
+    """
+
+    def __init__(self, max_lote, espera):
+        self.max_lote = max_lote
+        self.espera = espera
+        self.fila = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def submit(self, operacao, timeout=WRITE_QUEUE_TIMEOUT):
+        """Enfileira operacao(cur) e espera o commit do lote; devolve o resultado ou levanta o erro"""
+        self._iniciar()
+        futuro = Future()
+        self.fila.put((operacao, futuro))
+        try:
+            return futuro.result(timeout)
+        except TimeoutError:
+            # Ainda na fila: cancela para não ser gravada depois do 503. Se já
+            # está no lote em andamento, o commit vem a seguir: espera por ele.
+            if futuro.cancel():
+                raise
+            return futuro.result()
+
+    def _iniciar(self):
+        if self.pid == os.getpid() and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                # Após um fork (gunicorn --preload) a thread do processo pai não existe aqui
+                self.fila = queue.SimpleQueue()
+            elif self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self._executar, name='escritor-sqlite', daemon=True)
+            self.pid = os.getpid()
+            self.thread.start()
+
+    def _proximo_lote(self):
+        """Espera a primeira operação e junta as que chegarem em até `espera` segundos"""
+        lote = [self.fila.get()]
+        limite = time.monotonic() + self.espera
+        while len(lote) < self.max_lote:
+            restante = limite - time.monotonic()
+            try:
+                lote.append(self.fila.get(timeout=restante) if restante > 0 else self.fila.get_nowait())
+            except queue.Empty:
+                break
+        return lote
+
+    def _executar(self):
+        conn = connect_db()
+        conn.isolation_level = None  # BEGIN/COMMIT explícitos
+        cur = conn.cursor()
+        while True:
+            self._aplicar(conn, cur, self._proximo_lote())
+
+    def _aplicar(self, conn, cur, lote):
+        # Operações canceladas por timeout em submit não entram no lote
+        lote = [(operacao, futuro) for operacao, futuro in lote if futuro.set_running_or_notify_cancel()]
+        if not lote:
+            return
+        resultados = []
+        try:
+            cur.execute('BEGIN IMMEDIATE')
+            for operacao, futuro in lote:
+                cur.execute('SAVEPOINT operacao')
+                try:
+                    resultados.append((futuro, operacao(cur), None))
+                except Exception as e:
+                    cur.execute('ROLLBACK TO operacao')
+                    resultados.append((futuro, None, e))
+                cur.execute('RELEASE operacao')
+            cur.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for _, futuro in lote:
+                futuro.set_exception(e)
+            return
+
+        for futuro, resultado, erro in resultados:
+            if erro is not None:
+                futuro.set_exception(erro)
+            else:
+                futuro.set_result(resultado)
+
+write_queue = WriteQueue(WRITE_QUEUE_MAX_BATCH, WRITE_QUEUE_MAX_WAIT / 1000) if WRITE_QUEUE_ENABLED else None
+
+def run_write(operacao):
+    """Executa operacao(cur) e faz commit: pela fila de escrita, se ativa, ou na conexão do request"""
+    if write_queue is not None:
+        return write_queue.submit(operacao)
     conn = get_db_connection()
     if not conn:
+        raise RuntimeError('Erro de conexão com banco')
+    cur = conn.cursor()
+    try:
+        resultado = operacao(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return resultado
+
+def write_error_response(e):
+    """503 com Retry-After se o banco estiver ocupado (lock ou fila sem resposta); 409 se a parcela
+    já foi fechada (alteração ou exclusão); 500 nos demais"""
+    if isinstance(e, sqlite3.IntegrityError):
+        for erro in (PARCELA_FECHADA_ERRO, PARCELA_FECHADA_EXCLUSAO_ERRO):
+            if erro in str(e):
+                return jsonify({'error': erro}), 409
+    if isinstance(e, TimeoutError) or (
+        isinstance(e, sqlite3.OperationalError) and ('locked' in str(e) or 'busy' in str(e))
+    ):
+        response = jsonify({'error': 'Banco de dados ocupado, tente novamente'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+    return jsonify({'error': str(e)}), 500
+
+# Vendedor nos agregados por vendedor (dashboard, relatório e seus pares do
+# arquivo): até a migração 12 era o nome; agora é o vendedor_id, com 0 nas linhas
+# sem cadastro, que continuam separadas pelo nome em vendedor_sem_cadastro
+CHAVE_VENDEDOR_NOME = ('vendedor',)
+CHAVE_VENDEDOR_ID = ('vendedor_id', 'vendedor_sem_cadastro')
+
+def _chave_vendedor_sql(p, chave=CHAVE_VENDEDOR_ID):
+    """Expressões das colunas de `chave` para a parcela `p` (NEW, OLD ou alias)"""
+    if chave == CHAVE_VENDEDOR_NOME:
+        return [f'{p}.vendedor']
+    return [f'COALESCE({p}.vendedor_id, 0)', f"CASE WHEN {p}.vendedor_id IS NULL THEN {p}.vendedor ELSE '' END"]
+
+def _chave_vendedor_where(p, chave=CHAVE_VENDEDOR_ID):
+    """Condição que seleciona o agregado do vendedor da parcela `p`"""
+    return ' AND '.join(f'{coluna} = {expr}' for coluna, expr in zip(chave, _chave_vendedor_sql(p, chave)))
+
+# SQL de relatorio_mensal (migração 8 e recálculo). Cada parcela contribui com
+# duas linhas: comissão no mês de pagamento_comissao e valor no de vencimento.
+def _relatorio_upsert_sql(chave=CHAVE_VENDEDOR_ID):
+    return f'''
+    ON CONFLICT (mes, {', '.join(chave)}, tipo_conta) DO UPDATE SET
+        comissao_paga_centavos = comissao_paga_centavos + excluded.comissao_paga_centavos,
+        comissao_pendente_centavos = comissao_pendente_centavos + excluded.comissao_pendente_centavos,
+        valor_recebido_centavos = valor_recebido_centavos + excluded.valor_recebido_centavos,
+        valor_pendente_centavos = valor_pendente_centavos + excluded.valor_pendente_centavos;
+'''
+
+RELATORIO_UPSERT_SQL = _relatorio_upsert_sql()
+
+def _relatorio_limpeza_sql(filtro):
+    """Remove as células zeradas restritas a `filtro` (evita varrer a tabela)"""
+    return f'''
+        DELETE FROM relatorio_mensal
+        WHERE {filtro}
+          AND comissao_paga_centavos = 0 AND comissao_pendente_centavos = 0
+          AND valor_recebido_centavos = 0 AND valor_pendente_centavos = 0;
+    '''
+
+def _relatorio_limpeza_parcela_sql(chave=CHAVE_VENDEDOR_ID):
+    return _relatorio_limpeza_sql(
+        'mes IN (substr(OLD.pagamento_comissao, 1, 7), substr(OLD.vencimento, 1, 7)) AND '
+        + _chave_vendedor_where('OLD', chave)
+    )
+
+def _relatorio_valores_sql(p, origem='', chave=CHAVE_VENDEDOR_ID):
+    """Contribuições da parcela `p` (NEW, OLD ou alias de `origem`) em centavos"""
+    vendedor = _chave_vendedor_sql(p, chave)
+    return f'''
+        SELECT NULLIF(substr({p}.pagamento_comissao, 1, 7), '') AS mes,
+               {', '.join(f'{expr} AS {coluna}' for coluna, expr in zip(chave, vendedor))},
+               {p}.oportunidade_id AS oportunidade_id,
+               CASE WHEN {p}.comissao_paga = 1 THEN CAST(ROUND({p}.comissao * 100) AS INTEGER) ELSE 0 END
+                   AS comissao_paga,
+               CASE WHEN {p}.comissao_paga = 1 THEN 0 ELSE CAST(ROUND({p}.comissao * 100) AS INTEGER) END
+                   AS comissao_pendente,
+               0 AS valor_recebido, 0 AS valor_pendente
+        {origem}
+        UNION ALL
+        SELECT NULLIF(substr({p}.vencimento, 1, 7), ''), {', '.join(vendedor)}, {p}.oportunidade_id, 0, 0,
+               CASE WHEN {p}.recebida_pelo_cliente = 1 THEN CAST(ROUND({p}.valor * 100) AS INTEGER) ELSE 0 END,
+               CASE WHEN {p}.recebida_pelo_cliente = 1 THEN 0 ELSE CAST(ROUND({p}.valor * 100) AS INTEGER) END
+        {origem}
+    '''
+
+def _relatorio_parcela_sql(linha, sinal, chave=CHAVE_VENDEDOR_ID):
+    """Soma (sinal '') ou subtrai (sinal '-') a parcela NEW/OLD do relatório"""
+    colunas = ', '.join(chave)
+    return f'''
+        INSERT INTO relatorio_mensal (
+            mes, {colunas}, tipo_conta, comissao_paga_centavos, comissao_pendente_centavos,
+            valor_recebido_centavos, valor_pendente_centavos
+        )
+        SELECT v.mes, {', '.join('v.' + c for c in chave)}, COALESCE(o.tipo_conta, ''),
+               {sinal}v.comissao_paga, {sinal}v.comissao_pendente, {sinal}v.valor_recebido, {sinal}v.valor_pendente
+        FROM ({_relatorio_valores_sql(linha, chave=chave)}) AS v
+        LEFT JOIN oportunidades o ON o.id = v.oportunidade_id
+        WHERE v.mes IS NOT NULL
+          AND (v.comissao_paga != 0 OR v.comissao_pendente != 0 OR v.valor_recebido != 0 OR v.valor_pendente != 0)
+        {_relatorio_upsert_sql(chave)}
+    '''
+
+def _relatorio_oportunidade_sql(linha, sinal, chave=CHAVE_VENDEDOR_ID):
+    """Soma ou subtrai as parcelas da oportunidade no tipo de conta OLD/NEW"""
+    colunas = ', '.join('v.' + c for c in chave)
+    return f'''
+        INSERT INTO relatorio_mensal (
+            mes, {', '.join(chave)}, tipo_conta, comissao_paga_centavos, comissao_pendente_centavos,
+            valor_recebido_centavos, valor_pendente_centavos
+        )
+        SELECT v.mes, {colunas}, {linha}.tipo_conta, {sinal}SUM(v.comissao_paga), {sinal}SUM(v.comissao_pendente),
+               {sinal}SUM(v.valor_recebido), {sinal}SUM(v.valor_pendente)
+        FROM ({_relatorio_valores_sql('p', 'FROM parcelas p WHERE p.oportunidade_id = NEW.id', chave)}) AS v
+        WHERE v.mes IS NOT NULL
+        GROUP BY v.mes, {colunas}
+        HAVING SUM(v.comissao_paga) != 0 OR SUM(v.comissao_pendente) != 0
+            OR SUM(v.valor_recebido) != 0 OR SUM(v.valor_pendente) != 0
+        {_relatorio_upsert_sql(chave)}
+    '''
+
+def _vendedor_mes_sql(tabela, origem, sinal='', chave=CHAVE_VENDEDOR_ID):
+    """Soma (sinal '') ou subtrai (sinal '-') em `tabela` as parcelas de `origem` (alias p) por vendedor e mês"""
+    vendedor = ', '.join(_chave_vendedor_sql('p', chave))
+    return f'''
+        INSERT INTO {tabela}
+            ({', '.join(chave)}, mes, total_parcelas, parcelas_pagas, total_comissoes_centavos, comissoes_pagas_centavos)
+        SELECT {vendedor}, substr(p.pagamento_comissao, 1, 7), {sinal}COUNT(*),
+               {sinal}SUM(CASE WHEN p.comissao_paga = 1 THEN 1 ELSE 0 END),
+               {sinal}SUM(CAST(ROUND(p.comissao * 100) AS INTEGER)),
+               {sinal}SUM(CASE WHEN p.comissao_paga = 1 THEN CAST(ROUND(p.comissao * 100) AS INTEGER) ELSE 0 END)
+        {origem}
+        GROUP BY {vendedor}, substr(p.pagamento_comissao, 1, 7)
+        ON CONFLICT ({', '.join(chave)}, mes) DO UPDATE SET
+            total_parcelas = total_parcelas + excluded.total_parcelas,
+            parcelas_pagas = parcelas_pagas + excluded.parcelas_pagas,
+            total_comissoes_centavos = total_comissoes_centavos + excluded.total_comissoes_centavos,
+            comissoes_pagas_centavos = comissoes_pagas_centavos + excluded.comissoes_pagas_centavos
+    '''
+
+def _vendedor_mes_parcela_sql(linha, sinal):
+    """Soma (sinal '') ou subtrai (sinal '-') a parcela NEW/OLD de dashboard_vendedor_mes (migração 12)"""
+    return f'''
+        INSERT INTO dashboard_vendedor_mes
+            (vendedor_id, vendedor_sem_cadastro, mes, total_parcelas, parcelas_pagas,
+             total_comissoes_centavos, comissoes_pagas_centavos)
+        VALUES (
+            {', '.join(_chave_vendedor_sql(linha))}, substr({linha}.pagamento_comissao, 1, 7), {sinal}1,
+            {sinal}(CASE WHEN {linha}.comissao_paga = 1 THEN 1 ELSE 0 END),
+            {sinal}CAST(ROUND({linha}.comissao * 100) AS INTEGER),
+            {sinal}(CASE WHEN {linha}.comissao_paga = 1 THEN CAST(ROUND({linha}.comissao * 100) AS INTEGER) ELSE 0 END)
+        )
+        ON CONFLICT (vendedor_id, vendedor_sem_cadastro, mes) DO UPDATE SET
+            total_parcelas = total_parcelas + excluded.total_parcelas,
+            parcelas_pagas = parcelas_pagas + excluded.parcelas_pagas,
+            total_comissoes_centavos = total_comissoes_centavos + excluded.total_comissoes_centavos,
+            comissoes_pagas_centavos = comissoes_pagas_centavos + excluded.comissoes_pagas_centavos;
+    '''
+
+# Colunas de valores dos agregados por vendedor e mês e do relatório
+VENDEDOR_MES_VALORES = 'total_parcelas, parcelas_pagas, total_comissoes_centavos, comissoes_pagas_centavos'
+RELATORIO_VALORES = (
+    'comissao_paga_centavos, comissao_pendente_centavos, valor_recebido_centavos, valor_pendente_centavos'
+)
+
+# Célula de OLD zerada em dashboard_vendedor_mes
+VENDEDOR_MES_LIMPEZA_PARCELA = f'''
+    DELETE FROM dashboard_vendedor_mes
+    WHERE {_chave_vendedor_where('OLD')} AND mes = substr(OLD.pagamento_comissao, 1, 7)
+      AND total_parcelas <= 0;
+'''
+
+def _relatorio_agrupado_sql(tabela, origem, sinal='', chave=CHAVE_VENDEDOR_ID):
+    """Soma ou subtrai em `tabela` as parcelas de `origem` (alias p) agrupadas como em relatorio_mensal"""
+    colunas = ', '.join('v.' + c for c in chave)
+    return f'''
+        INSERT INTO {tabela} (
+            mes, {', '.join(chave)}, tipo_conta, comissao_paga_centavos, comissao_pendente_centavos,
+            valor_recebido_centavos, valor_pendente_centavos
+        )
+        SELECT v.mes, {colunas}, COALESCE(o.tipo_conta, ''), {sinal}SUM(v.comissao_paga),
+               {sinal}SUM(v.comissao_pendente), {sinal}SUM(v.valor_recebido), {sinal}SUM(v.valor_pendente)
+        FROM ({_relatorio_valores_sql('p', origem, chave)}) AS v
+        LEFT JOIN oportunidades o ON o.id = v.oportunidade_id
+        WHERE v.mes IS NOT NULL
+        GROUP BY v.mes, {colunas}, COALESCE(o.tipo_conta, '')
+        HAVING SUM(v.comissao_paga) != 0 OR SUM(v.comissao_pendente) != 0
+            OR SUM(v.valor_recebido) != 0 OR SUM(v.valor_pendente) != 0
+        {_relatorio_upsert_sql(chave)}
+    '''
+
+def _arquivo_agregados_sql(origem, sinal):
+    """Passos que somam/subtraem as parcelas de `origem` nos agregados do arquivo (migração 9)"""
+    return [
+        _vendedor_mes_sql('arquivo_vendedor_mes', origem, sinal),
+        'DELETE FROM arquivo_vendedor_mes WHERE total_parcelas <= 0',
+        _relatorio_agrupado_sql('arquivo_relatorio_mensal', origem, sinal),
+        '''
+            DELETE FROM arquivo_relatorio_mensal
+            WHERE comissao_paga_centavos = 0 AND comissao_pendente_centavos = 0
+              AND valor_recebido_centavos = 0 AND valor_pendente_centavos = 0
+        ''',
+    ]
+
+# Erros dos triggers que protegem as parcelas já incluídas em um fechamento (migrações 11 e 13)
+PARCELA_FECHADA_ERRO = 'Parcela incluída em fechamento de comissão não pode ser alterada'
+PARCELA_FECHADA_EXCLUSAO_ERRO = 'Parcela incluída em fechamento de comissão não pode ser excluída'
+
+# Migrações de schema, aplicadas em ordem conforme PRAGMA user_version.
+# Cada passo é um SQL ou uma função que recebe o cursor; os passos devem ser
+# idempotentes. Nunca altere uma migração já publicada: acrescente uma nova.
+MIGRATIONS = [
+    (1, 'Índices das consultas de listagem, filtros e exclusões', [
+        # Listagem geral e por vendedor ordenadas por (vencimento, id)
+        'CREATE INDEX IF NOT EXISTS idx_parcelas_vencimento ON parcelas (vencimento)',
+        'CREATE INDEX IF NOT EXISTS idx_parcelas_vendedor_vencimento ON parcelas (vendedor, vencimento)',
+        # DELETE FROM parcelas WHERE oportunidade_id = ? e filtro oportunidadeId
+        'CREATE INDEX IF NOT EXISTS idx_parcelas_oportunidade ON parcelas (oportunidade_id)',
+        # Comissões pagas/pendentes por período
+        'CREATE INDEX IF NOT EXISTS idx_parcelas_comissao_paga_pagamento '
+        'ON parcelas (comissao_paga, pagamento_comissao)',
+        # Listagens de oportunidades (data_cadastro DESC) e vendedores (nome)
+        'CREATE INDEX IF NOT EXISTS idx_oportunidades_data_cadastro ON oportunidades (data_cadastro)',
+        'CREATE INDEX IF NOT EXISTS idx_oportunidades_vendedor_data_cadastro '
+        'ON oportunidades (vendedor, data_cadastro)',
+        'CREATE INDEX IF NOT EXISTS idx_vendedores_nome ON vendedores (nome)',
+        'ANALYZE',
+    ]),
+    (2, 'Agregados do dashboard mantidos por triggers', [
+        '''
+            CREATE TABLE IF NOT EXISTS dashboard_totais (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total_oportunidades INTEGER NOT NULL DEFAULT 0,
+                total_vendedores INTEGER NOT NULL DEFAULT 0,
+                total_parcelas INTEGER NOT NULL DEFAULT 0,
+                parcelas_pagas INTEGER NOT NULL DEFAULT 0,
+                total_comissoes REAL NOT NULL DEFAULT 0,
+                comissoes_pagas REAL NOT NULL DEFAULT 0
+            )
+        ''',
+        # Parcelas por vendedor e mês de pagamento da comissão (YYYY-MM)
+        '''
+            CREATE TABLE IF NOT EXISTS dashboard_vendedor_mes (
+                vendedor TEXT NOT NULL,
+                mes TEXT NOT NULL,
+                total_parcelas INTEGER NOT NULL DEFAULT 0,
+                parcelas_pagas INTEGER NOT NULL DEFAULT 0,
+                total_comissoes REAL NOT NULL DEFAULT 0,
+                comissoes_pagas REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (vendedor, mes)
+            ) WITHOUT ROWID
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_oportunidades_agregados_insert
+            AFTER INSERT ON oportunidades BEGIN
+                UPDATE dashboard_totais SET total_oportunidades = total_oportunidades + 1 WHERE id = 1;
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_oportunidades_agregados_delete
+            AFTER DELETE ON oportunidades BEGIN
+                UPDATE dashboard_totais SET total_oportunidades = total_oportunidades - 1 WHERE id = 1;
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_vendedores_agregados_insert
+            AFTER INSERT ON vendedores BEGIN
+                UPDATE dashboard_totais SET total_vendedores = total_vendedores + 1 WHERE id = 1;
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_vendedores_agregados_delete
+            AFTER DELETE ON vendedores BEGIN
+                UPDATE dashboard_totais SET total_vendedores = total_vendedores - 1 WHERE id = 1;
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_parcelas_agregados_insert
+            AFTER INSERT ON parcelas BEGIN
+                UPDATE dashboard_totais SET
+                    total_parcelas = total_parcelas + 1,
+                    parcelas_pagas = parcelas_pagas + (CASE WHEN NEW.comissao_paga = 1 THEN 1 ELSE 0 END),
+                    total_comissoes = total_comissoes + NEW.comissao,
+                    comissoes_pagas = comissoes_pagas + (CASE WHEN NEW.comissao_paga = 1 THEN NEW.comissao ELSE 0 END)
+                WHERE id = 1;
+                INSERT INTO dashboard_vendedor_mes
+                    (vendedor, mes, total_parcelas, parcelas_pagas, total_comissoes, comissoes_pagas)
+                VALUES (
+                    NEW.vendedor, substr(NEW.pagamento_comissao, 1, 7), 1,
+                    CASE WHEN NEW.comissao_paga = 1 THEN 1 ELSE 0 END,
+                    NEW.comissao,
+                    CASE WHEN NEW.comissao_paga = 1 THEN NEW.comissao ELSE 0 END
+                )
+                ON CONFLICT (vendedor, mes) DO UPDATE SET
+                    total_parcelas = total_parcelas + excluded.total_parcelas,
+                    parcelas_pagas = parcelas_pagas + excluded.parcelas_pagas,
+                    total_comissoes = total_comissoes + excluded.total_comissoes,
+                    comissoes_pagas = comissoes_pagas + excluded.comissoes_pagas;
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_parcelas_agregados_delete
+            AFTER DELETE ON parcelas BEGIN
+                UPDATE dashboard_totais SET
+                    total_parcelas = total_parcelas - 1,
+                    parcelas_pagas = parcelas_pagas - (CASE WHEN OLD.comissao_paga = 1 THEN 1 ELSE 0 END),
+                    total_comissoes = total_comissoes - OLD.comissao,
+                    comissoes_pagas = comissoes_pagas - (CASE WHEN OLD.comissao_paga = 1 THEN OLD.comissao ELSE 0 END)
+                WHERE id = 1;
+                UPDATE dashboard_vendedor_mes SET
+                    total_parcelas = total_parcelas - 1,
+                    parcelas_pagas = parcelas_pagas - (CASE WHEN OLD.comissao_paga = 1 THEN 1 ELSE 0 END),
+                    total_comissoes = total_comissoes - OLD.comissao,
+                    comissoes_pagas = comissoes_pagas - (CASE WHEN OLD.comissao_paga = 1 THEN OLD.comissao ELSE 0 END)
+                WHERE vendedor = OLD.vendedor AND mes = substr(OLD.pagamento_comissao, 1, 7);
+                DELETE FROM dashboard_vendedor_mes
+                WHERE vendedor = OLD.vendedor AND mes = substr(OLD.pagamento_comissao, 1, 7)
+                  AND total_parcelas <= 0;
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_parcelas_agregados_update
+            AFTER UPDATE OF vendedor, pagamento_comissao, comissao, comissao_paga ON parcelas BEGIN
+                UPDATE dashboard_totais SET
+                    parcelas_pagas = parcelas_pagas
+                        - (CASE WHEN OLD.comissao_paga = 1 THEN 1 ELSE 0 END)
+                        + (CASE WHEN NEW.comissao_paga = 1 THEN 1 ELSE 0 END),
+                    total_comissoes = total_comissoes - OLD.comissao + NEW.comissao,
+                    comissoes_pagas = comissoes_pagas
+                        - (CASE WHEN OLD.comissao_paga = 1 THEN OLD.comissao ELSE 0 END)
+                        + (CASE WHEN NEW.comissao_paga = 1 THEN NEW.comissao ELSE 0 END)
+                WHERE id = 1;
+                UPDATE dashboard_vendedor_mes SET
+                    total_parcelas = total_parcelas - 1,
+                    parcelas_pagas = parcelas_pagas - (CASE WHEN OLD.comissao_paga = 1 THEN 1 ELSE 0 END),
+                    total_comissoes = total_comissoes - OLD.comissao,
+                    comissoes_pagas = comissoes_pagas - (CASE WHEN OLD.comissao_paga = 1 THEN OLD.comissao ELSE 0 END)
+                WHERE vendedor = OLD.vendedor AND mes = substr(OLD.pagamento_comissao, 1, 7);
+                DELETE FROM dashboard_vendedor_mes
+                WHERE vendedor = OLD.vendedor AND mes = substr(OLD.pagamento_comissao, 1, 7)
+                  AND total_parcelas <= 0;
+                INSERT INTO dashboard_vendedor_mes
+                    (vendedor, mes, total_parcelas, parcelas_pagas, total_comissoes, comissoes_pagas)
+                VALUES (
+                    NEW.vendedor, substr(NEW.pagamento_comissao, 1, 7), 1,
+                    CASE WHEN NEW.comissao_paga = 1 THEN 1 ELSE 0 END,
+                    NEW.comissao,
+                    CASE WHEN NEW.comissao_paga = 1 THEN NEW.comissao ELSE 0 END
+                )
+                ON CONFLICT (vendedor, mes) DO UPDATE SET
+                    total_parcelas = total_parcelas + excluded.total_parcelas,
+                    parcelas_pagas = parcelas_pagas + excluded.parcelas_pagas,
+                    total_comissoes = total_comissoes + excluded.total_comissoes,
+                    comissoes_pagas = comissoes_pagas + excluded.comissoes_pagas;
+            END
+        ''',
+        '''
+            INSERT INTO dashboard_vendedor_mes
+                (vendedor, mes, total_parcelas, parcelas_pagas, total_comissoes, comissoes_pagas)
+            SELECT vendedor, substr(pagamento_comissao, 1, 7), COUNT(*),
+                   SUM(CASE WHEN comissao_paga = 1 THEN 1 ELSE 0 END),
+                   SUM(comissao),
+                   SUM(CASE WHEN comissao_paga = 1 THEN comissao ELSE 0 END)
+            FROM parcelas
+            GROUP BY vendedor, substr(pagamento_comissao, 1, 7)
+        ''',
+        '''
+            INSERT OR REPLACE INTO dashboard_totais
+                (id, total_oportunidades, total_vendedores, total_parcelas, parcelas_pagas,
+                 total_comissoes, comissoes_pagas)
+            SELECT 1,
+                   (SELECT COUNT(*) FROM oportunidades),
+                   (SELECT COUNT(*) FROM vendedores),
+                   COUNT(*),
+                   COALESCE(SUM(CASE WHEN comissao_paga = 1 THEN 1 ELSE 0 END), 0),
+                   COALESCE(SUM(comissao), 0),
+                   COALESCE(SUM(CASE WHEN comissao_paga = 1 THEN comissao ELSE 0 END), 0)
+            FROM parcelas
+        ''',
+    ]),
+    (3, 'Versão dos dados por tabela (ETag)', [
+        '''
+            CREATE TABLE IF NOT EXISTS versoes_dados (
+                tabela TEXT PRIMARY KEY,
+                versao INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        ''',
+        "INSERT OR IGNORE INTO versoes_dados (tabela) VALUES ('vendedores'), ('oportunidades'), ('parcelas')",
+    ] + [
+        f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{tabela}_versao_{operacao.lower()}
+            AFTER {operacao} ON {tabela} BEGIN
+                UPDATE versoes_dados SET versao = versao + 1 WHERE tabela = '{tabela}';
+            END
+        '''
+        for tabela in ('vendedores', 'oportunidades', 'parcelas')
+        for operacao in ('INSERT', 'UPDATE', 'DELETE')
+    ]),
+    (4, 'Agregados do dashboard em centavos inteiros', [
+        'DROP TRIGGER IF EXISTS trg_parcelas_agregados_insert',
+        'DROP TRIGGER IF EXISTS trg_parcelas_agregados_delete',
+        'DROP TRIGGER IF EXISTS trg_parcelas_agregados_update',
+        'DROP TABLE IF EXISTS dashboard_totais',
+        'DROP TABLE IF EXISTS dashboard_vendedor_mes',
+        '''
+            CREATE TABLE dashboard_totais (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                total_oportunidades INTEGER NOT NULL DEFAULT 0,
+                total_vendedores INTEGER NOT NULL DEFAULT 0,
+                total_parcelas INTEGER NOT NULL DEFAULT 0,
+                parcelas_pagas INTEGER NOT NULL DEFAULT 0,
+                total_comissoes_centavos INTEGER NOT NULL DEFAULT 0,
+                comissoes_pagas_centavos INTEGER NOT NULL DEFAULT 0
+            )
+        ''',
+        '''
+            CREATE TABLE dashboard_vendedor_mes (
+                vendedor TEXT NOT NULL,
+                mes TEXT NOT NULL,
+                total_parcelas INTEGER NOT NULL DEFAULT 0,
+                parcelas_pagas INTEGER NOT NULL DEFAULT 0,
+                total_comissoes_centavos INTEGER NOT NULL DEFAULT 0,
+                comissoes_pagas_centavos INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (vendedor, mes)
+            ) WITHOUT ROWID
+        ''',
+        '''
+            CREATE TRIGGER trg_parcelas_agregados_insert
+            AFTER INSERT ON parcelas BEGIN
+                UPDATE dashboard_totais SET
+                    total_parcelas = total_parcelas + 1,
+                    parcelas_pagas = parcelas_pagas + (CASE WHEN NEW.comissao_paga = 1 THEN 1 ELSE 0 END),
+                    total_comissoes_centavos = total_comissoes_centavos + CAST(ROUND(NEW.comissao * 100) AS INTEGER),
+                    comissoes_pagas_centavos = comissoes_pagas_centavos
+                        + (CASE WHEN NEW.comissao_paga = 1 THEN CAST(ROUND(NEW.comissao * 100) AS INTEGER) ELSE 0 END)
+                WHERE id = 1;
+                INSERT INTO dashboard_vendedor_mes
+                    (vendedor, mes, total_parcelas, parcelas_pagas, total_comissoes_centavos, comissoes_pagas_centavos)
+                VALUES (
+                    NEW.vendedor, substr(NEW.pagamento_comissao, 1, 7), 1,
+                    CASE WHEN NEW.comissao_paga = 1 THEN 1 ELSE 0 END,
+                    CAST(ROUND(NEW.comissao * 100) AS INTEGER),
+                    CASE WHEN NEW.comissao_paga = 1 THEN CAST(ROUND(NEW.comissao * 100) AS INTEGER) ELSE 0 END
+                )
+                ON CONFLICT (vendedor, mes) DO UPDATE SET
+                    total_parcelas = total_parcelas + excluded.total_parcelas,
+                    parcelas_pagas = parcelas_pagas + excluded.parcelas_pagas,
+                    total_comissoes_centavos = total_comissoes_centavos + excluded.total_comissoes_centavos,
+                    comissoes_pagas_centavos = comissoes_pagas_centavos + excluded.comissoes_pagas_centavos;
+            END
+        ''',
+        '''
+            CREATE TRIGGER trg_parcelas_agregados_delete
+            AFTER DELETE ON parcelas BEGIN
+                UPDATE dashboard_totais SET
+                    total_parcelas = total_parcelas - 1,
+                    parcelas_pagas = parcelas_pagas - (CASE WHEN OLD.comissao_paga = 1 THEN 1 ELSE 0 END),
+                    total_comissoes_centavos = total_comissoes_centavos - CAST(ROUND(OLD.comissao * 100) AS INTEGER),
+                    comissoes_pagas_centavos = comissoes_pagas_centavos
+                        - (CASE WHEN OLD.comissao_paga = 1 THEN CAST(ROUND(OLD.comissao * 100) AS INTEGER) ELSE 0 END)
+                WHERE id = 1;
+                UPDATE dashboard_vendedor_mes SET
+                    total_parcelas = total_parcelas - 1,
+                    parcelas_pagas = parcelas_pagas - (CASE WHEN OLD.comissao_paga = 1 THEN 1 ELSE 0 END),
+                    total_comissoes_centavos = total_comissoes_centavos - CAST(ROUND(OLD.comissao * 100) AS INTEGER),
+                    comissoes_pagas_centavos = comissoes_pagas_centavos
+                        - (CASE WHEN OLD.comissao_paga = 1 THEN CAST(ROUND(OLD.comissao * 100) AS INTEGER) ELSE 0 END)
+                WHERE vendedor = OLD.vendedor AND mes = substr(OLD.pagamento_comissao, 1, 7);
+                DELETE FROM dashboard_vendedor_mes
+                WHERE vendedor = OLD.vendedor AND mes = substr(OLD.pagamento_comissao, 1, 7)
+                  AND total_parcelas <= 0;
+            END
+        ''',
+        '''
+            CREATE TRIGGER trg_parcelas_agregados_update
+            AFTER UPDATE OF vendedor, pagamento_comissao, comissao, comissao_paga ON parcelas BEGIN
+                UPDATE dashboard_totais SET
+                    parcelas_pagas = parcelas_pagas
+                        - (CASE WHEN OLD.comissao_paga = 1 THEN 1 ELSE 0 END)
+                        + (CASE WHEN NEW.comissao_paga = 1 THEN 1 ELSE 0 END),
+                    total_comissoes_centavos = total_comissoes_centavos
+                        - CAST(ROUND(OLD.comissao * 100) AS INTEGER)
+                        + CAST(ROUND(NEW.comissao * 100) AS INTEGER),
+                    comissoes_pagas_centavos = comissoes_pagas_centavos
+                        - (CASE WHEN OLD.comissao_paga = 1 THEN CAST(ROUND(OLD.comissao * 100) AS INTEGER) ELSE 0 END)
+                        + (CASE WHEN NEW.comissao_paga = 1 THEN CAST(ROUND(NEW.comissao * 100) AS INTEGER) ELSE 0 END)
+                WHERE id = 1;
+                UPDATE dashboard_vendedor_mes SET
+                    total_parcelas = total_parcelas - 1,
+                    parcelas_pagas = parcelas_pagas - (CASE WHEN OLD.comissao_paga = 1 THEN 1 ELSE 0 END),
+                    total_comissoes_centavos = total_comissoes_centavos - CAST(ROUND(OLD.comissao * 100) AS INTEGER),
+                    comissoes_pagas_centavos = comissoes_pagas_centavos
+                        - (CASE WHEN OLD.comissao_paga = 1 THEN CAST(ROUND(OLD.comissao * 100) AS INTEGER) ELSE 0 END)
+                WHERE vendedor = OLD.vendedor AND mes = substr(OLD.pagamento_comissao, 1, 7);
+                DELETE FROM dashboard_vendedor_mes
+                WHERE vendedor = OLD.vendedor AND mes = substr(OLD.pagamento_comissao, 1, 7)
+                  AND total_parcelas <= 0;
+                INSERT INTO dashboard_vendedor_mes
+                    (vendedor, mes, total_parcelas, parcelas_pagas, total_comissoes_centavos, comissoes_pagas_centavos)
+                VALUES (
+                    NEW.vendedor, substr(NEW.pagamento_comissao, 1, 7), 1,
+                    CASE WHEN NEW.comissao_paga = 1 THEN 1 ELSE 0 END,
+                    CAST(ROUND(NEW.comissao * 100) AS INTEGER),
+                    CASE WHEN NEW.comissao_paga = 1 THEN CAST(ROUND(NEW.comissao * 100) AS INTEGER) ELSE 0 END
+                )
+                ON CONFLICT (vendedor, mes) DO UPDATE SET
+                    total_parcelas = total_parcelas + excluded.total_parcelas,
+                    parcelas_pagas = parcelas_pagas + excluded.parcelas_pagas,
+                    total_comissoes_centavos = total_comissoes_centavos + excluded.total_comissoes_centavos,
+                    comissoes_pagas_centavos = comissoes_pagas_centavos + excluded.comissoes_pagas_centavos;
+            END
+        ''',
+        lambda cur: rebuild_dashboard_aggregates(cur, CHAVE_VENDEDOR_NOME),
+    ]),
+    (5, 'Regras de comissão por vendedor, tipo de conta e vigência', [
+        # Percentuais em pontos-base (1500 = 15%); vendedor/tipo_conta NULL valem para todos
+        '''
+            CREATE TABLE IF NOT EXISTS regras_comissao (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                vendedor TEXT,
+                tipo_conta TEXT,
+                vigencia_inicio DATE NOT NULL,
+                desconto_bp INTEGER NOT NULL,
+                comissao_bp INTEGER NOT NULL,
+                data_cadastro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''',
+        # Regra geral equivalente ao cálculo fixo anterior
+        '''
+            INSERT INTO regras_comissao (vendedor, tipo_conta, vigencia_inicio, desconto_bp, comissao_bp)
+            SELECT NULL, NULL, '2000-01-01', 1500, 1000
+            WHERE NOT EXISTS (SELECT 1 FROM regras_comissao)
+        ''',
+        "INSERT OR IGNORE INTO versoes_dados (tabela) VALUES ('regras_comissao')",
+    ] + [
+        f'''
+            CREATE TRIGGER IF NOT EXISTS trg_regras_comissao_versao_{operacao.lower()}
+            AFTER {operacao} ON regras_comissao BEGIN
+                UPDATE versoes_dados SET versao = versao + 1 WHERE tabela = 'regras_comissao';
+            END
+        '''
+        for operacao in ('INSERT', 'UPDATE', 'DELETE')
+    ]),
+    (6, 'Changelog limitado para o feed de alterações (SSE)', [
+        '''
+            CREATE TABLE IF NOT EXISTS alteracoes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tabela TEXT NOT NULL,
+                operacao TEXT NOT NULL,
+                registro_id INTEGER NOT NULL,
+                criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''',
+        # Mantém apenas as últimas 10000 alterações
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_alteracoes_limite
+            AFTER INSERT ON alteracoes BEGIN
+                DELETE FROM alteracoes WHERE id <= NEW.id - 10000;
+            END
+        ''',
+    ] + [
+        f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{tabela}_alteracoes_{operacao.lower()}
+            AFTER {operacao} ON {tabela} BEGIN
+                INSERT INTO alteracoes (tabela, operacao, registro_id)
+                VALUES ('{tabela}', '{operacao.lower()}', {'OLD' if operacao == 'DELETE' else 'NEW'}.id);
+            END
+        '''
+        for tabela in ('vendedores', 'oportunidades', 'parcelas')
+        for operacao in ('INSERT', 'UPDATE', 'DELETE')
+    ]),
+    (7, 'Busca textual (FTS5) em vendedores, oportunidades e parcelas', [
+        passo
+        for tabela, colunas in (
+            ('vendedores', ('nome', 'email', 'observacoes')),
+            ('oportunidades', ('cliente', 'descricao')),
+            ('parcelas', ('cliente', 'observacoes')),
+        )
+        for passo in (
+            # Índice externo: o texto fica só na tabela original
+            f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS busca_{tabela} USING fts5(
+                    {', '.join(colunas)},
+                    content='{tabela}', content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+                )
+            ''',
+            f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{tabela}_busca_insert
+                AFTER INSERT ON {tabela} BEGIN
+                    INSERT INTO busca_{tabela} (rowid, {', '.join(colunas)})
+                    VALUES (NEW.id, {', '.join('NEW.' + c for c in colunas)});
+                END
+            ''',
+            f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{tabela}_busca_delete
+                AFTER DELETE ON {tabela} BEGIN
+                    INSERT INTO busca_{tabela} (busca_{tabela}, rowid, {', '.join(colunas)})
+                    VALUES ('delete', OLD.id, {', '.join('OLD.' + c for c in colunas)});
+                END
+            ''',
+            f'''
+                CREATE TRIGGER IF NOT EXISTS trg_{tabela}_busca_update
+                AFTER UPDATE OF {', '.join(colunas)} ON {tabela} BEGIN
+                    INSERT INTO busca_{tabela} (busca_{tabela}, rowid, {', '.join(colunas)})
+                    VALUES ('delete', OLD.id, {', '.join('OLD.' + c for c in colunas)});
+                    INSERT INTO busca_{tabela} (rowid, {', '.join(colunas)})
+                    VALUES (NEW.id, {', '.join('NEW.' + c for c in colunas)});
+                END
+            ''',
+            f"INSERT INTO busca_{tabela} (busca_{tabela}) VALUES ('rebuild')",
+        )
+    ]),
+    (8, 'Relatório mensal: comissões por mês de pagamento e valores por mês de vencimento', [
+        # Comissão entra no mês de pagamento_comissao e valor no mês de vencimento;
+        # tipo_conta vem da oportunidade ('' para parcelas avulsas)
+        '''
+            CREATE TABLE IF NOT EXISTS relatorio_mensal (
+                mes TEXT NOT NULL,
+                vendedor TEXT NOT NULL,
+                tipo_conta TEXT NOT NULL,
+                comissao_paga_centavos INTEGER NOT NULL DEFAULT 0,
+                comissao_pendente_centavos INTEGER NOT NULL DEFAULT 0,
+                valor_recebido_centavos INTEGER NOT NULL DEFAULT 0,
+                valor_pendente_centavos INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (mes, vendedor, tipo_conta)
+            ) WITHOUT ROWID
+        ''',
+        f'''
+            CREATE TRIGGER IF NOT EXISTS trg_parcelas_relatorio_insert
+            AFTER INSERT ON parcelas BEGIN
+                {_relatorio_parcela_sql('NEW', '', CHAVE_VENDEDOR_NOME)}
+            END
+        ''',
+        f'''
+            CREATE TRIGGER IF NOT EXISTS trg_parcelas_relatorio_delete
+            AFTER DELETE ON parcelas BEGIN
+                {_relatorio_parcela_sql('OLD', '-', CHAVE_VENDEDOR_NOME)}
+                {_relatorio_limpeza_parcela_sql(CHAVE_VENDEDOR_NOME)}
+            END
+        ''',
+        f'''
+            CREATE TRIGGER IF NOT EXISTS trg_parcelas_relatorio_update
+            AFTER UPDATE OF vendedor, oportunidade_id, vencimento, pagamento_comissao, valor, comissao,
+                comissao_paga, recebida_pelo_cliente ON parcelas BEGIN
+                {_relatorio_parcela_sql('OLD', '-', CHAVE_VENDEDOR_NOME)}
+                {_relatorio_parcela_sql('NEW', '', CHAVE_VENDEDOR_NOME)}
+                {_relatorio_limpeza_parcela_sql(CHAVE_VENDEDOR_NOME)}
+            END
+        ''',
+        # Mudança de tipo de conta move as parcelas da oportunidade entre os grupos
+        f'''
+            CREATE TRIGGER IF NOT EXISTS trg_oportunidades_relatorio_tipo_conta
+            AFTER UPDATE OF tipo_conta ON oportunidades BEGIN
+                {_relatorio_oportunidade_sql('OLD', '-', CHAVE_VENDEDOR_NOME)}
+                {_relatorio_oportunidade_sql('NEW', '', CHAVE_VENDEDOR_NOME)}
+                {_relatorio_limpeza_sql('tipo_conta = OLD.tipo_conta')}
+            END
+        ''',
+        lambda cur: rebuild_monthly_report(cur, CHAVE_VENDEDOR_NOME),
+    ]),
+    (9, 'Agregados carregados das parcelas arquivadas', [
+        # Depois do arquivamento pagas/recebidas ficam raras na tabela quente: sem
+        # estes índices a listagem filtrada percorreria todo o índice de vencimento
+        'CREATE INDEX IF NOT EXISTS idx_parcelas_comissao_paga_vencimento ON parcelas (comissao_paga, vencimento)',
+        'CREATE INDEX IF NOT EXISTS idx_parcelas_recebida_vencimento ON parcelas (recebida_pelo_cliente, vencimento)',
+        # Contribuição das parcelas movidas para arquivo.parcelas: os triggers
+        # tiram a parcela dos agregados quentes e o arquivamento a soma aqui
+        '''
+            CREATE TABLE IF NOT EXISTS arquivo_vendedor_mes (
+                vendedor TEXT NOT NULL,
+                mes TEXT NOT NULL,
+                total_parcelas INTEGER NOT NULL DEFAULT 0,
+                parcelas_pagas INTEGER NOT NULL DEFAULT 0,
+                total_comissoes_centavos INTEGER NOT NULL DEFAULT 0,
+                comissoes_pagas_centavos INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (vendedor, mes)
+            ) WITHOUT ROWID
+        ''',
+        '''
+            CREATE TABLE IF NOT EXISTS arquivo_relatorio_mensal (
+                mes TEXT NOT NULL,
+                vendedor TEXT NOT NULL,
+                tipo_conta TEXT NOT NULL,
+                comissao_paga_centavos INTEGER NOT NULL DEFAULT 0,
+                comissao_pendente_centavos INTEGER NOT NULL DEFAULT 0,
+                valor_recebido_centavos INTEGER NOT NULL DEFAULT 0,
+                valor_pendente_centavos INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (mes, vendedor, tipo_conta)
+            ) WITHOUT ROWID
+        ''',
+        # Agregados quentes + arquivados, lidos pelo dashboard
+        '''
+            CREATE VIEW IF NOT EXISTS dashboard_vendedor_mes_total AS
+            SELECT vendedor, mes, total_parcelas, parcelas_pagas, total_comissoes_centavos, comissoes_pagas_centavos
+            FROM dashboard_vendedor_mes
+            UNION ALL
+            SELECT vendedor, mes, total_parcelas, parcelas_pagas, total_comissoes_centavos, comissoes_pagas_centavos
+            FROM arquivo_vendedor_mes
+        ''',
+        '''
+            CREATE VIEW IF NOT EXISTS relatorio_mensal_total AS
+            SELECT mes, vendedor, tipo_conta, comissao_paga_centavos, comissao_pendente_centavos,
+                   valor_recebido_centavos, valor_pendente_centavos
+            FROM relatorio_mensal
+            UNION ALL
+            SELECT mes, vendedor, tipo_conta, comissao_paga_centavos, comissao_pendente_centavos,
+                   valor_recebido_centavos, valor_pendente_centavos
+            FROM arquivo_relatorio_mensal
+        ''',
+    ]),
+    (10, 'vendedor_id (FOREIGN KEY) em oportunidades e parcelas, preenchido pelo nome', [
+        # O nome continua gravado (exibição, agregados e regras); o id é o vínculo com o cadastro
+        'ALTER TABLE oportunidades ADD COLUMN vendedor_id INTEGER REFERENCES vendedores (id)',
+        'ALTER TABLE parcelas ADD COLUMN vendedor_id INTEGER REFERENCES vendedores (id)',
+        lambda cur: _migrar_vendedor_id(cur),
+        # Índices depois do preenchimento: montá-los no fim é ~8x mais rápido que atualizá-los a cada lote
+        'CREATE INDEX IF NOT EXISTS idx_oportunidades_vendedor_id_data_cadastro '
+        'ON oportunidades (vendedor_id, data_cadastro)',
+        'CREATE INDEX IF NOT EXISTS idx_parcelas_vendedor_id_vencimento ON parcelas (vendedor_id, vencimento)',
+    ]),
+    (11, 'Fechamentos de comissão: extratos por vendedor congelados', [
+        '''
+            CREATE TABLE IF NOT EXISTS fechamentos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                periodo_inicio DATE NOT NULL,
+                periodo_fim DATE NOT NULL,
+                criado_por TEXT,
+                criado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''',
+        'CREATE INDEX IF NOT EXISTS idx_fechamentos_periodo ON fechamentos (periodo_inicio, periodo_fim)',
+        # Cópia das parcelas pagas em cada fechamento, com os valores em centavos
+        '''
+            CREATE TABLE IF NOT EXISTS fechamento_parcelas (
+                fechamento_id INTEGER NOT NULL REFERENCES fechamentos (id),
+                vendedor TEXT NOT NULL,
+                parcela_id INTEGER NOT NULL,
+                vendedor_id INTEGER,
+                oportunidade_id INTEGER,
+                cliente TEXT NOT NULL,
+                numero TEXT NOT NULL,
+                vencimento DATE NOT NULL,
+                pagamento_comissao DATE NOT NULL,
+                valor_centavos INTEGER NOT NULL,
+                valor_liquido_centavos INTEGER NOT NULL,
+                comissao_centavos INTEGER NOT NULL,
+                PRIMARY KEY (fechamento_id, vendedor, parcela_id)
+            ) WITHOUT ROWID
+        ''',
+        # Cada parcela entra em um único fechamento: repetir o fechamento não paga de novo
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_fechamento_parcelas_parcela ON fechamento_parcelas (parcela_id)',
+        # Extrato de cada vendedor: somas das parcelas do fechamento
+        '''
+            CREATE TABLE IF NOT EXISTS fechamento_vendedores (
+                id INTEGER PRIMARY KEY,
+                fechamento_id INTEGER NOT NULL REFERENCES fechamentos (id),
+                vendedor TEXT NOT NULL,
+                vendedor_id INTEGER,
+                total_parcelas INTEGER NOT NULL,
+                valor_centavos INTEGER NOT NULL,
+                valor_liquido_centavos INTEGER NOT NULL,
+                comissao_centavos INTEGER NOT NULL,
+                UNIQUE (fechamento_id, vendedor, vendedor_id)
+            )
+        ''',
+        # Tem linha só dentro da transação de um fechamento, que aplica os agregados em grupo
+        'CREATE TABLE IF NOT EXISTS fechamento_em_curso (fechamento_id INTEGER PRIMARY KEY)',
+        lambda cur: _pular_triggers_no_fechamento(cur),
+        "INSERT OR IGNORE INTO versoes_dados (tabela) VALUES ('fechamentos')",
+        '''
+            CREATE TRIGGER IF NOT EXISTS trg_fechamentos_versao_insert
+            AFTER INSERT ON fechamentos BEGIN
+                UPDATE versoes_dados SET versao = versao + 1 WHERE tabela = 'fechamentos';
+            END
+        ''',
+    ] + [
+        # Fechamentos são imutáveis
+        f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{tabela}_imutavel_{operacao.lower()}
+            BEFORE {operacao} ON {tabela} BEGIN
+                SELECT RAISE(ABORT, 'Fechamentos de comissão não podem ser alterados');
+            END
+        '''
+        for tabela in ('fechamentos', 'fechamento_parcelas', 'fechamento_vendedores')
+        for operacao in ('UPDATE', 'DELETE')
+    ] + [
+        # Parcela já fechada não volta a pendente nem muda de valor (o próprio
+        # fechamento, com linha em fechamento_em_curso, é quem a marca como paga)
+        f'''
+            CREATE TRIGGER IF NOT EXISTS trg_parcelas_fechada_update
+            BEFORE UPDATE OF comissao_paga, comissao, valor ON parcelas
+            WHEN (NEW.comissao_paga IS NOT OLD.comissao_paga OR NEW.comissao IS NOT OLD.comissao
+                  OR NEW.valor IS NOT OLD.valor)
+                AND EXISTS (SELECT 1 FROM fechamento_parcelas WHERE parcela_id = OLD.id)
+                AND NOT EXISTS (SELECT 1 FROM fechamento_em_curso)
+            BEGIN
+                SELECT RAISE(ABORT, '{PARCELA_FECHADA_ERRO}');
+            END
+        '''
+    ]),
+    (12, 'Agregados por vendedor_id: dashboard, relatório mensal e arquivo', [
+        # Nomes repetidos no cadastro deixam de se misturar e os filtros por
+        # vendedor usam o índice inteiro; o nome só é lido para exibição
+        'DROP TRIGGER IF EXISTS trg_parcelas_agregados_insert',
+        'DROP TRIGGER IF EXISTS trg_parcelas_agregados_delete',
+        'DROP TRIGGER IF EXISTS trg_parcelas_agregados_update',
+        'DROP TRIGGER IF EXISTS trg_parcelas_relatorio_insert',
+        'DROP TRIGGER IF EXISTS trg_parcelas_relatorio_delete',
+        'DROP TRIGGER IF EXISTS trg_parcelas_relatorio_update',
+        'DROP TRIGGER IF EXISTS trg_oportunidades_relatorio_tipo_conta',
+        'DROP VIEW IF EXISTS dashboard_vendedor_mes_total',
+        'DROP VIEW IF EXISTS relatorio_mensal_total',
+    ] + [
+        passo
+        for prefixo in ('dashboard', 'arquivo')
+        for passo in (
+            f'DROP TABLE IF EXISTS {prefixo}_vendedor_mes',
+            f'''
+                CREATE TABLE {prefixo}_vendedor_mes (
+                    vendedor_id INTEGER NOT NULL,
+                    vendedor_sem_cadastro TEXT NOT NULL DEFAULT '',
+                    mes TEXT NOT NULL,
+                    total_parcelas INTEGER NOT NULL DEFAULT 0,
+                    parcelas_pagas INTEGER NOT NULL DEFAULT 0,
+                    total_comissoes_centavos INTEGER NOT NULL DEFAULT 0,
+                    comissoes_pagas_centavos INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (vendedor_id, vendedor_sem_cadastro, mes)
+                ) WITHOUT ROWID
+            ''',
+        )
+    ] + [
+        passo
+        for tabela in ('relatorio_mensal', 'arquivo_relatorio_mensal')
+        for passo in (
+            f'DROP TABLE IF EXISTS {tabela}',
+            f'''
+                CREATE TABLE {tabela} (
+                    mes TEXT NOT NULL,
+                    vendedor_id INTEGER NOT NULL,
+                    vendedor_sem_cadastro TEXT NOT NULL DEFAULT '',
+                    tipo_conta TEXT NOT NULL,
+                    comissao_paga_centavos INTEGER NOT NULL DEFAULT 0,
+                    comissao_pendente_centavos INTEGER NOT NULL DEFAULT 0,
+                    valor_recebido_centavos INTEGER NOT NULL DEFAULT 0,
+                    valor_pendente_centavos INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (mes, vendedor_id, vendedor_sem_cadastro, tipo_conta)
+                ) WITHOUT ROWID
+            ''',
+            # Relatório de um vendedor: faixa de meses dentro do vendedor_id
+            f'CREATE INDEX idx_{tabela}_vendedor_id ON {tabela} (vendedor_id, mes)',
+        )
+    ] + [
+        f'''
+            CREATE VIEW dashboard_vendedor_mes_total AS
+            SELECT vendedor_id, vendedor_sem_cadastro, mes, {VENDEDOR_MES_VALORES}
+            FROM dashboard_vendedor_mes
+            UNION ALL
+            SELECT vendedor_id, vendedor_sem_cadastro, mes, {VENDEDOR_MES_VALORES}
+            FROM arquivo_vendedor_mes
+        ''',
+        f'''
+            CREATE VIEW relatorio_mensal_total AS
+            SELECT mes, vendedor_id, vendedor_sem_cadastro, tipo_conta, {RELATORIO_VALORES}
+            FROM relatorio_mensal
+            UNION ALL
+            SELECT mes, vendedor_id, vendedor_sem_cadastro, tipo_conta, {RELATORIO_VALORES}
+            FROM arquivo_relatorio_mensal
+        ''',
+        f'''
+            CREATE TRIGGER trg_parcelas_agregados_insert
+            AFTER INSERT ON parcelas BEGIN
+                UPDATE dashboard_totais SET
+                    total_parcelas = total_parcelas + 1,
+                    parcelas_pagas = parcelas_pagas + (CASE WHEN NEW.comissao_paga = 1 THEN 1 ELSE 0 END),
+                    total_comissoes_centavos = total_comissoes_centavos + CAST(ROUND(NEW.comissao * 100) AS INTEGER),
+                    comissoes_pagas_centavos = comissoes_pagas_centavos
+                        + (CASE WHEN NEW.comissao_paga = 1 THEN CAST(ROUND(NEW.comissao * 100) AS INTEGER) ELSE 0 END)
+                WHERE id = 1;
+                {_vendedor_mes_parcela_sql('NEW', '')}
+            END
+        ''',
+        f'''
+            CREATE TRIGGER trg_parcelas_agregados_delete
+            AFTER DELETE ON parcelas BEGIN
+                UPDATE dashboard_totais SET
+                    total_parcelas = total_parcelas - 1,
+                    parcelas_pagas = parcelas_pagas - (CASE WHEN OLD.comissao_paga = 1 THEN 1 ELSE 0 END),
+                    total_comissoes_centavos = total_comissoes_centavos - CAST(ROUND(OLD.comissao * 100) AS INTEGER),
+                    comissoes_pagas_centavos = comissoes_pagas_centavos
+                        - (CASE WHEN OLD.comissao_paga = 1 THEN CAST(ROUND(OLD.comissao * 100) AS INTEGER) ELSE 0 END)
+                WHERE id = 1;
+                {_vendedor_mes_parcela_sql('OLD', '-')}
+                {VENDEDOR_MES_LIMPEZA_PARCELA}
+            END
+        ''',
+        f'''
+            CREATE TRIGGER trg_parcelas_agregados_update
+            AFTER UPDATE OF vendedor, vendedor_id, pagamento_comissao, comissao, comissao_paga ON parcelas BEGIN
+                UPDATE dashboard_totais SET
+                    parcelas_pagas = parcelas_pagas
+                        - (CASE WHEN OLD.comissao_paga = 1 THEN 1 ELSE 0 END)
+                        + (CASE WHEN NEW.comissao_paga = 1 THEN 1 ELSE 0 END),
+                    total_comissoes_centavos = total_comissoes_centavos
+                        - CAST(ROUND(OLD.comissao * 100) AS INTEGER)
+                        + CAST(ROUND(NEW.comissao * 100) AS INTEGER),
+                    comissoes_pagas_centavos = comissoes_pagas_centavos
+                        - (CASE WHEN OLD.comissao_paga = 1 THEN CAST(ROUND(OLD.comissao * 100) AS INTEGER) ELSE 0 END)
+                        + (CASE WHEN NEW.comissao_paga = 1 THEN CAST(ROUND(NEW.comissao * 100) AS INTEGER) ELSE 0 END)
+                WHERE id = 1;
+                {_vendedor_mes_parcela_sql('OLD', '-')}
+                {_vendedor_mes_parcela_sql('NEW', '')}
+                {VENDEDOR_MES_LIMPEZA_PARCELA}
+            END
+        ''',
+        f'''
+            CREATE TRIGGER trg_parcelas_relatorio_insert
+            AFTER INSERT ON parcelas BEGIN
+                {_relatorio_parcela_sql('NEW', '')}
+            END
+        ''',
+        f'''
+            CREATE TRIGGER trg_parcelas_relatorio_delete
+            AFTER DELETE ON parcelas BEGIN
+                {_relatorio_parcela_sql('OLD', '-')}
+                {_relatorio_limpeza_parcela_sql()}
+            END
+        ''',
+        f'''
+            CREATE TRIGGER trg_parcelas_relatorio_update
+            AFTER UPDATE OF vendedor, vendedor_id, oportunidade_id, vencimento, pagamento_comissao, valor, comissao,
+                comissao_paga, recebida_pelo_cliente ON parcelas BEGIN
+                {_relatorio_parcela_sql('OLD', '-')}
+                {_relatorio_parcela_sql('NEW', '')}
+                {_relatorio_limpeza_parcela_sql()}
+            END
+        ''',
+        f'''
+            CREATE TRIGGER trg_oportunidades_relatorio_tipo_conta
+            AFTER UPDATE OF tipo_conta ON oportunidades BEGIN
+                {_relatorio_oportunidade_sql('OLD', '-')}
+                {_relatorio_oportunidade_sql('NEW', '')}
+                {_relatorio_limpeza_sql('tipo_conta = OLD.tipo_conta')}
+            END
+        ''',
+        # Os triggers recriados voltam a ser pulados dentro do fechamento (migração 11)
+        lambda cur: _pular_triggers_no_fechamento(cur),
+        lambda cur: rebuild_dashboard_aggregates(cur),
+        lambda cur: rebuild_monthly_report(cur),
+        lambda cur: _reconstruir_agregados_arquivo(cur),
+        # Extratos e parcelas de um fechamento filtrados pelo vendedor_id
+        'CREATE INDEX IF NOT EXISTS idx_fechamento_parcelas_vendedor_id '
+        'ON fechamento_parcelas (fechamento_id, vendedor_id, vendedor, parcela_id)',
+        'CREATE INDEX IF NOT EXISTS idx_fechamento_vendedores_vendedor_id '
+        'ON fechamento_vendedores (vendedor_id, fechamento_id)',
+    ]),
+    (13, 'Parcelas de fechamentos não podem ser excluídas', [
+        # Tem linha só dentro da transação do arquivamento, que move (apaga e
+        # copia para o arquivo) parcelas quitadas, inclusive as já fechadas
+        'CREATE TABLE IF NOT EXISTS arquivamento_em_curso (lote INTEGER PRIMARY KEY)',
+        f'''
+            CREATE TRIGGER IF NOT EXISTS trg_parcelas_fechada_delete
+            BEFORE DELETE ON parcelas
+            WHEN EXISTS (SELECT 1 FROM fechamento_parcelas WHERE parcela_id = OLD.id)
+                AND NOT EXISTS (SELECT 1 FROM arquivamento_em_curso)
+            BEGIN
+                SELECT RAISE(ABORT, '{PARCELA_FECHADA_EXCLUSAO_ERRO}');
+            END
+        ''',
+    ]),
+]
+
+def _read_dashboard_aggregates(cur):
+    """Lê os agregados gravados: (totais, {(tabela, chave...): valores})"""
+    cur.execute('''
+        SELECT total_oportunidades, total_vendedores, total_parcelas, parcelas_pagas,
+               total_comissoes_centavos, comissoes_pagas_centavos
+        FROM dashboard_totais WHERE id = 1
+    ''')
+    totais = cur.fetchone()
+    buckets = {}
+    for tabela, chave, valores in (
+        ('dashboard_vendedor_mes', 'vendedor_id, vendedor_sem_cadastro, mes', VENDEDOR_MES_VALORES),
+        ('arquivo_vendedor_mes', 'vendedor_id, vendedor_sem_cadastro, mes', VENDEDOR_MES_VALORES),
+        ('relatorio_mensal', 'mes, vendedor_id, vendedor_sem_cadastro, tipo_conta', RELATORIO_VALORES),
+        ('arquivo_relatorio_mensal', 'mes, vendedor_id, vendedor_sem_cadastro, tipo_conta', RELATORIO_VALORES),
+    ):
+        cur.execute(f'SELECT {chave}, {valores} FROM {tabela}')
+        tamanho = chave.count(',') + 1
+        buckets.update({(tabela,) + tuple(row[:tamanho]): tuple(row[tamanho:]) for row in cur.fetchall()})
+    return (tuple(totais) if totais else None), buckets
+
+def rebuild_dashboard_aggregates(cur, chave=CHAVE_VENDEDOR_ID):
+    """Recalcula os agregados do dashboard do zero (sem commit)"""
+    cur.execute('DELETE FROM dashboard_vendedor_mes')
+    cur.execute(_vendedor_mes_sql('dashboard_vendedor_mes', 'FROM parcelas p', chave=chave))
+    cur.execute('''
+        INSERT OR REPLACE INTO dashboard_totais
+            (id, total_oportunidades, total_vendedores, total_parcelas, parcelas_pagas,
+             total_comissoes_centavos, comissoes_pagas_centavos)
+        SELECT 1,
+               (SELECT COUNT(*) FROM oportunidades),
+               (SELECT COUNT(*) FROM vendedores),
+               COUNT(*),
+               COALESCE(SUM(CASE WHEN comissao_paga = 1 THEN 1 ELSE 0 END), 0),
+               COALESCE(SUM(CAST(ROUND(comissao * 100) AS INTEGER)), 0),
+               COALESCE(SUM(CASE WHEN comissao_paga = 1 THEN CAST(ROUND(comissao * 100) AS INTEGER) ELSE 0 END), 0)
+        FROM parcelas
+    ''')
+
+def rebuild_monthly_report(cur, chave=CHAVE_VENDEDOR_ID):
+    """Recalcula relatorio_mensal a partir das parcelas (sem commit)"""
+    cur.execute('DELETE FROM relatorio_mensal')
+    cur.execute(_relatorio_agrupado_sql('relatorio_mensal', 'FROM parcelas p', chave=chave))
+
+def rebuild_archive_aggregates(cur):
+    """Recalcula os agregados do arquivo a partir de arquivo.parcelas (sem commit)"""
+    cur.execute('DELETE FROM arquivo_vendedor_mes')
+    cur.execute('DELETE FROM arquivo_relatorio_mensal')
+    for passo in _arquivo_agregados_sql('FROM arquivo.parcelas p', ''):
+        cur.execute(passo)
+
+def _reconstruir_agregados_arquivo(cur):
+    """Migração 12: recalcula os agregados do arquivo, se já houver parcelas arquivadas"""
+    if cur.execute('PRAGMA arquivo.table_info(parcelas)').fetchall():
+        rebuild_archive_aggregates(cur)
+
+def check_dashboard_aggregates(conn, corrigir=True):
+    """Recalcula os agregados e devolve as divergências encontradas.
+
+    Com corrigir=False o recálculo é desfeito e apenas o relatório é gerado.
+    """
+    def diverge(gravado, calculado):
+        if gravado is None or calculado is None:
+            return gravado != calculado
+        return any((a or 0) != (b or 0) for a, b in zip(gravado, calculado))
+
+    cur = conn.cursor()
+    try:
+        cur.execute('BEGIN IMMEDIATE')
+        totais_antes, buckets_antes = _read_dashboard_aggregates(cur)
+        rebuild_dashboard_aggregates(cur)
+        rebuild_monthly_report(cur)
+        rebuild_archive_aggregates(cur)
+        totais_depois, buckets_depois = _read_dashboard_aggregates(cur)
+
+        divergencias = []
+        if diverge(totais_antes, totais_depois):
+            divergencias.append(('totais', totais_antes, totais_depois))
+        for chave in sorted(set(buckets_antes) | set(buckets_depois)):
+            gravado, calculado = buckets_antes.get(chave), buckets_depois.get(chave)
+            if diverge(gravado, calculado):
+                divergencias.append((chave, gravado, calculado))
+
+        if corrigir:
+            conn.commit()
+        else:
+            conn.rollback()
+        return divergencias
+    except Exception:
+        conn.rollback()
+        raise
+
+@app.cli.command('verificar-agregados')
+@click.option('--somente-verificar', is_flag=True, help='Não grava os agregados recalculados')
+def verificar_agregados_command(somente_verificar):
+    """Recalcula os agregados do dashboard e informa divergências"""
+    conn = connect_db()
+    try:
+        divergencias = check_dashboard_aggregates(conn, corrigir=not somente_verificar)
+    finally:
+        conn.close()
+    if not divergencias:
+        click.echo('Agregados consistentes.')
+        return
+    for chave, gravado, calculado in divergencias:
+        click.echo(f'{chave}: gravado={gravado} calculado={calculado}')
+    acao = 'encontradas' if somente_verificar else 'corrigidas'
+    click.echo(f'{len(divergencias)} divergência(s) {acao}.')
+
+# Vínculo das linhas com o cadastro de vendedores (vendedor_id), pelo nome
+VINCULO_VENDEDOR_TABELAS = ('oportunidades', 'parcelas', 'arquivo.parcelas')
+
+def link_archived_parcelas(cur, condicao, params, vendedor_id_sql):
+    """Vincula as parcelas arquivadas de `condicao` (alias p) a `vendedor_id_sql` (sem commit).
+
+    Sem triggers no arquivo, a contribuição delas sai da chave sem cadastro e
+    entra na do vendedor nos agregados do arquivo. Devolve as linhas vinculadas.
+    """
+    cur.execute(f'SELECT p.id FROM arquivo.parcelas p WHERE {condicao}', params)
+    ids = [row[0] for row in cur.fetchall()]
+    if not ids:
+        return 0
+    params = {**params, 'ids': json.dumps(ids)}
+    selecao = 'p.id IN (SELECT value FROM json_each(:ids))'
+    for passo in _arquivo_agregados_sql(f'FROM arquivo.parcelas p WHERE {selecao}', '-'):
+        cur.execute(passo, params)
+    cur.execute(f'UPDATE arquivo.parcelas AS p SET vendedor_id = {vendedor_id_sql} WHERE {selecao}', params)
+    for passo in _arquivo_agregados_sql(f'FROM arquivo.parcelas p WHERE {selecao}', ''):
+        cur.execute(passo, params)
+    return len(ids)
+
+def link_vendedor_ids(cur, tabelas=VINCULO_VENDEDOR_TABELAS, chunk_size=VINCULO_CHUNK_SIZE,
+                      transacao_por_lote=False, agregados_arquivo=True):
+    """Preenche vendedor_id pelo nome nas linhas ainda sem vínculo, em faixas de chunk_size ids.
+
+    Nomes repetidos no cadastro ficam com o vendedor mais antigo (menor id).
+    Com transacao_por_lote, cada faixa é uma transação. Com agregados_arquivo,
+    as parcelas arquivadas vinculadas mudam de chave nos agregados do arquivo
+    (link_archived_parcelas). Devolve as linhas vinculadas por tabela.
+    """
+    vinculadas = {}
+    for tabela in tabelas:
+        cur.execute(f'SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM {tabela} WHERE vendedor_id IS NULL')
+        inicio, maximo = cur.fetchone()
+        total = 0
+        while inicio <= maximo:
+            if transacao_por_lote:
+                cur.execute('BEGIN IMMEDIATE')
+            try:
+                # +vendedor_id: percorre a faixa de ids, não as entradas nulas do índice de vendedor_id
+                condicao = '''
+                    t.id >= :inicio AND t.id < :fim AND +t.vendedor_id IS NULL
+                    AND EXISTS (SELECT 1 FROM vendedores WHERE nome = t.vendedor)
+                '''
+                faixa = {'inicio': inicio, 'fim': inicio + chunk_size}
+                vendedor_id_sql = '(SELECT MIN(id) FROM vendedores WHERE nome = {}.vendedor)'
+                if tabela == 'arquivo.parcelas' and agregados_arquivo:
+                    total += link_archived_parcelas(
+                        cur, condicao.replace('t.', 'p.'), faixa, vendedor_id_sql.format('p')
+                    )
+                else:
+                    cur.execute(f'''
+                        UPDATE {tabela} AS t SET vendedor_id = {vendedor_id_sql.format('t')} WHERE {condicao}
+                    ''', faixa)
+                    total += cur.rowcount
+                if transacao_por_lote:
+                    cur.connection.commit()
+            except Exception:
+                if transacao_por_lote:
+                    cur.connection.rollback()
+                raise
+            inicio += chunk_size
+        vinculadas[tabela] = total
+    return vinculadas
+
+def unlinked_vendedores(cur, tabelas=VINCULO_VENDEDOR_TABELAS):
+    """Nomes sem vendedor cadastrado e quantas linhas cada um tem: {tabela: [(nome, linhas)]}"""
+    return {
+        tabela: cur.execute(f'''
+            SELECT vendedor, COUNT(*) FROM {tabela} WHERE vendedor_id IS NULL
+            GROUP BY vendedor ORDER BY COUNT(*) DESC, vendedor
+        ''').fetchall()
+        for tabela in tabelas
+    }
+
+def format_link_report(vinculadas, sem_vinculo):
+    """Linhas de texto do relatório de vínculo (migração 10 e vincular-vendedores)"""
+    linhas = [f'{tabela}: {total} linha(s) vinculada(s)' for tabela, total in vinculadas.items()]
+    for tabela, nomes in sem_vinculo.items():
+        if nomes:
+            linhas.append(f'{tabela}: {sum(total for _, total in nomes)} linha(s) sem vendedor cadastrado')
+            linhas.extend(f'    {nome!r}: {total}' for nome, total in nomes)
+    return linhas
+
+def _migrar_vendedor_id(cur):
+    """Migração 10: coluna em arquivo.parcelas (se já existir, sem FK) e preenchimento pelo nome"""
+    tabelas = ['oportunidades', 'parcelas']
+    if cur.execute('PRAGMA arquivo.table_info(parcelas)').fetchall():
+        cur.execute('ALTER TABLE arquivo.parcelas ADD COLUMN vendedor_id INTEGER')
+        tabelas.append('arquivo.parcelas')
+    # Os agregados do arquivo ainda são por nome (até a migração 12): o vínculo não os altera
+    vinculadas = link_vendedor_ids(cur, tabelas, agregados_arquivo=False)
+    for linha in format_link_report(vinculadas, unlinked_vendedores(cur, tabelas)):
+        print(linha)
+
+@app.cli.command('vincular-vendedores')
+@click.option('--somente-relatorio', is_flag=True, help='Só lista as linhas sem vendedor cadastrado')
+def vincular_vendedores_command(somente_relatorio):
+    """Preenche vendedor_id pelo nome e lista os nomes sem vendedor cadastrado"""
+    conn = connect_db()
+    try:
+        cur = conn.cursor()
+        vinculadas = {} if somente_relatorio else link_vendedor_ids(cur, transacao_por_lote=True)
+        linhas = format_link_report(vinculadas, unlinked_vendedores(cur))
+    finally:
+        conn.close()
+    for linha in linhas:
+        click.echo(linha)
+    if len(linhas) == len(vinculadas):
+        click.echo('Todas as linhas têm vendedor cadastrado.')
+
+# Triggers por linha de UPDATE em parcelas que o fechamento de comissões
+# substitui por passos agrupados (veja close_commission_period)
+FECHAMENTO_TRIGGERS = (
+    'trg_parcelas_versao_update',
+    'trg_parcelas_alteracoes_update',
+    'trg_parcelas_agregados_update',
+    'trg_parcelas_relatorio_update',
+)
+
+def _pular_triggers_no_fechamento(cur):
+    """Migração 11: os triggers não disparam enquanto fechamento_em_curso tiver linha.
+
+    Recria cada trigger com o SQL gravado no banco, acrescentando o WHEN ao cabeçalho.
+    """
+    for nome in FECHAMENTO_TRIGGERS:
+        sql = cur.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (nome,)).fetchone()[0]
+        if 'fechamento_em_curso' in sql:
+            continue
+        sql, trocas = re.subn(
+            r'\bON parcelas\s+BEGIN\b', 'ON parcelas WHEN NOT EXISTS (SELECT 1 FROM fechamento_em_curso) BEGIN', sql,
+            count=1
+        )
+        if not trocas:
+            raise RuntimeError(f'Cabeçalho inesperado no trigger {nome}')
+        cur.execute(f'DROP TRIGGER {nome}')
+        cur.execute(sql)
+
+def run_migrations(conn):
+    """Aplica as migrações pendentes, cada uma em sua própria transação"""
+    versao = conn.execute('PRAGMA user_version').fetchone()[0]
+    for numero, descricao, passos in MIGRATIONS:
+        if numero <= versao:
+            continue
+        cur = conn.cursor()
+        try:
+            cur.execute('BEGIN')
+            for passo in passos:
+                if callable(passo):
+                    passo(cur)
+                else:
+                    cur.execute(passo)
+            cur.execute(f'PRAGMA user_version = {int(numero)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        print(f"Migração {numero} aplicada: {descricao}")
+        versao = numero
+    return versao
+
+def ensure_archive_schema(conn):
+    """Cria arquivo.parcelas com as colunas de parcelas e acrescenta as que faltarem.
+
+    Sem FOREIGN KEY (não cruza bancos) e sem AUTOINCREMENT: os ids vêm de parcelas.
+    """
+    colunas = conn.execute('PRAGMA main.table_info(parcelas)').fetchall()
+    existentes = {row['name'] for row in conn.execute('PRAGMA arquivo.table_info(parcelas)')}
+    
+    def definicao(coluna):
+        if coluna['pk']:
+            return f"{coluna['name']} INTEGER PRIMARY KEY"
+        texto = f"{coluna['name']} {coluna['type']}"
+        if coluna['notnull']:
+            texto += ' NOT NULL'
+        if coluna['dflt_value'] is not None:
+            texto += f" DEFAULT {coluna['dflt_value']}"
+        return texto
+    
+    if not existentes:
+        conn.execute(f"CREATE TABLE arquivo.parcelas ({', '.join(definicao(c) for c in colunas)})")
+    else:
+        for coluna in colunas:
+            if coluna['name'] not in existentes:
+                conn.execute(f'ALTER TABLE arquivo.parcelas ADD COLUMN {definicao(coluna)}')
+    # Os mesmos índices das listagens e da exclusão por oportunidade
+    conn.execute('CREATE INDEX IF NOT EXISTS arquivo.idx_parcelas_vencimento ON parcelas (vencimento)')
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS arquivo.idx_parcelas_vendedor_vencimento ON parcelas (vendedor, vencimento)'
+    )
+    conn.execute(
+        'CREATE INDEX IF NOT EXISTS arquivo.idx_parcelas_vendedor_id_vencimento ON parcelas (vendedor_id, vencimento)'
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS arquivo.idx_parcelas_oportunidade ON parcelas (oportunidade_id)')
+    conn.commit()
+
+def init_db():
+    """Inicializa as tabelas do banco de dados"""
+    try:
+        os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
+        conn = connect_db()
+    except Exception as e:
+        print(f"Erro ao conectar ao banco: {e}")
         return False
     
     try:
@@ -98,6 +1921,8 @@ def init_db():
         ''')
         
         conn.commit()
+        run_migrations(conn)
+        ensure_archive_schema(conn)
         return True
     except Exception as e:
         print(f"Erro ao inicializar banco: {e}")
@@ -108,8 +1933,9 @@ def init_db():
 # Inicializar banco na inicialização da aplicação
 init_db()
 
+@functools.lru_cache(maxsize=8192)
 def format_date_br(date_str):
-    """Converte data para formato brasileiro DD/MM/YYYY"""
+    """Converte data para formato brasileiro DD/MM/YYYY (memoizado: as datas se repetem muito)"""
     if not date_str:
         return ''
     try:
@@ -138,448 +1964,3101 @@ def parse_date_br(date_str):
     except:
         return None
 
-# Rota principal
-@app.route('/')
-def index():
-    return send_from_directory(app.static_folder, 'index.html')
-
-# Rota de login
-@app.route('/api/login', methods=['POST'])
-def login():
+def parse_date_param(value, nome):
+    """Converte filtro de data (DD/MM/YYYY ou ISO) validando o formato"""
+    iso = parse_date_br(value)
     try:
-        data = request.get_json()
-        email = data.get('email', '').lower().strip()
-        senha = data.get('senha', '')
-        
-        # Verificar usuários fixos primeiro
-        usuarios_fixos = {
-            'thiago@objetivasolucao.com.br': {
-                'senha': 'vendas123',
-                'nome': 'Thiago Teles Xavier',
-                'tipo': 'master'
-            },
-            'dalzia.reis@objetivasolucao.com.br': {
-                'senha': 'dalzia123',
-                'nome': 'Dalzia Reis',
-                'tipo': 'visualizador'
-            }
-        }
-        
-        if email in usuarios_fixos and usuarios_fixos[email]['senha'] == senha:
-            return jsonify({
-                'success': True,
-                'user': {
-                    'email': email,
-                    'nome': usuarios_fixos[email]['nome'],
-                    'tipo': usuarios_fixos[email]['tipo']
-                }
-            })
-        
-        # Verificar vendedores cadastrados
-        conn = get_db_connection()
-        if conn:
-            cur = conn.cursor()
-            cur.execute('SELECT * FROM vendedores WHERE email = ?', (email,))
-            vendedor = cur.fetchone()
-            conn.close()
-            
-            if vendedor and senha == 'vendas123':
-                return jsonify({
-                    'success': True,
-                    'user': {
-                        'email': email,
-                        'nome': vendedor['nome'],
-                        'tipo': 'vendedor'
-                    }
-                })
-        
-        return jsonify({'success': False, 'message': 'Email ou senha incorretos'}), 401
-        
-    except Exception as e:
-        return jsonify({'success': False, 'message': str(e)}), 500
+        return date.fromisoformat(iso).isoformat()
+    except (TypeError, ValueError):
+        raise ValueError(f'Data inválida para {nome}: {value}')
 
-# Rotas para vendedores
-@app.route('/api/vendedores', methods=['GET'])
-def get_vendedores():
-    try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Erro de conexão com banco'}), 500
-            
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM vendedores ORDER BY nome')
-        vendedores = cur.fetchall()
-        conn.close()
-        
-        result = []
-        for v in vendedores:
-            result.append({
-                'id': str(v['id']),
-                'nome': v['nome'],
-                'email': v['email'],
-                'telefone': v['telefone'] or '',
-                'dataAdmissao': format_date_br(v['data_admissao']),
-                'observacoes': v['observacoes'] or '',
-                'dataCadastro': format_date_br(v['data_cadastro'])
-            })
-        
-        return jsonify(result)
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+def parse_bool_param(value, nome):
+    """Converte filtro booleano da query string (None quando ausente)"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return value
+    valor = str(value).strip().lower()
+    if valor in ('1', 'true', 'sim'):
+        return True
+    if valor in ('0', 'false', 'nao', 'não'):
+        return False
+    raise ValueError(f'Valor inválido para {nome}: {value}')
 
-@app.route('/api/vendedores', methods=['POST'])
-def create_vendedor():
+def parse_int_param(value, nome):
+    """Converte filtro inteiro da query string"""
     try:
-        data = request.get_json()
-        
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Erro de conexão com banco'}), 500
-        
-        cur = conn.cursor()
-        data_admissao = parse_date_br(data.get('dataAdmissao', ''))
-        
-        cur.execute('''
-            INSERT INTO vendedores (nome, email, telefone, data_admissao, observacoes)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            data['nome'],
-            data['email'],
-            data.get('telefone', ''),
-            data_admissao,
-            data.get('observacoes', '')
-        ))
-        
-        vendedor_id = cur.lastrowid
-        conn.commit()
-        conn.close()
-        
-        return jsonify({
-            'id': str(vendedor_id),
-            'nome': data['nome'],
-            'email': data['email'],
-            'telefone': data.get('telefone', ''),
-            'dataAdmissao': format_date_br(data_admissao),
-            'observacoes': data.get('observacoes', ''),
-            'dataCadastro': format_date_br(datetime.now())
-        }), 201
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'Valor inválido para {nome}: {value}')
 
-@app.route('/api/vendedores/<int:vendedor_id>', methods=['DELETE'])
-def delete_vendedor(vendedor_id):
+def parse_page_size(value):
+    """Tamanho da página limitado a PAGE_SIZE_MAXIMO"""
+    if not value:
+        return PAGE_SIZE_PADRAO
+    limit = parse_int_param(value, 'limit')
+    if limit < 1:
+        raise ValueError('limit deve ser maior que zero')
+    return min(limit, PAGE_SIZE_MAXIMO)
+
+def encode_cursor(values):
+    """Gera cursor opaco a partir dos valores da chave de ordenação"""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor, size):
+    """Recupera os valores da chave de ordenação a partir do cursor"""
     try:
-        conn = get_db_connection()
-        if not conn:
-            return jsonify({'error': 'Erro de conexão com banco'}), 500
-        
-        cur = conn.cursor()
-        cur.execute('DELETE FROM vendedores WHERE id = ?', (vendedor_id,))
-        conn.commit()
-        conn.close()
-        
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('Cursor inválido')
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Cursor inválido')
+    return values
+
+def select_sql(table, conditions):
+    """SELECT * de `table`; com uma tupla de tabelas, UNION ALL das mesmas condições em cada uma.
+
+    Com ORDER BY no final o SQLite intercala as partes já ordenadas pelos
+    índices (MERGE), sem ordenar o resultado. Devolve (sql, repetições dos params).
+    """
+    tabelas = (table,) if isinstance(table, str) else table
+    partes = []
+    for tabela in tabelas:
+        sql = f'SELECT * FROM {tabela}'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        partes.append(sql)
+    return ' UNION ALL '.join(partes), len(tabelas)
+
+def fetch_page(cur, table, where, params, order, descending=False):
+    """Executa SELECT paginado por keyset sobre as colunas de ordenação.
+
+    Lê `cursor` e `limit` da query string e devolve (linhas, próximo cursor).
+    `table` pode ser uma tupla de tabelas com as mesmas colunas (veja select_sql).
+    """
+    conditions = list(where)
+    params = list(params)
+    limit = parse_page_size(request.args.get('limit'))
+    cursor = request.args.get('cursor')
+    if cursor:
+        comparacao = '<' if descending else '>'
+        conditions.append(f"({', '.join(order)}) {comparacao} ({', '.join('?' * len(order))})")
+        params.extend(decode_cursor(cursor, len(order)))
+
+    direcao = 'DESC' if descending else 'ASC'
+    sql, repeticoes = select_sql(table, conditions)
+    params = params * repeticoes
+    sql += ' ORDER BY ' + ', '.join(f'{coluna} {direcao}' for coluna in order)
+    sql += ' LIMIT ?'
+    params.append(limit + 1)
+
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([rows[-1][coluna] for coluna in order])
+    return rows, next_cursor
+
+def paginated_response(result, next_cursor):
+    """Resposta JSON da página com o cursor da próxima no cabeçalho"""
+    response = jsonify(result)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+def vendedor_filter(args, cur=None):
+    """(coluna, valor) do filtro de vendedor da query string, ou None.
+
+    vendedorId filtra pelo id; o nome é convertido no id pelo cadastro em
+    cache, para a consulta usar o índice de vendedor_id. Nomes fora do cadastro
+    (linhas sem vínculo) continuam comparados como texto.
+    """
+    if args.get('vendedorId'):
+        return 'vendedor_id', parse_int_param(args['vendedorId'], 'vendedorId')
+    if args.get('vendedor'):
+        vendedor_id = get_vendedor_index(cur or get_db_connection().cursor()).ids.get(args['vendedor'])
+        if vendedor_id is None:
+            return 'vendedor', args['vendedor']
+        return 'vendedor_id', vendedor_id
+    return None
+
+def agregado_vendedor_where(filtro):
+    """Condição de um filtro de vendedor_filter sobre os agregados por vendedor (migração 12)"""
+    if not filtro:
+        return [], []
+    coluna, valor = filtro
+    if coluna == 'vendedor_id':
+        return ['vendedor_id = ?'], [valor]
+    return ['vendedor_id = 0', 'vendedor_sem_cadastro = ?'], [valor]
+
+# Nome de exibição de uma linha agregada (alias a), pelo cadastro
+AGREGADO_VENDEDOR_NOME = 'COALESCE((SELECT nome FROM vendedores WHERE id = a.vendedor_id), a.vendedor_sem_cadastro)'
+
+def build_oportunidades_filters(args):
+    """Monta as condições WHERE de oportunidades a partir da query string"""
+    where, params = [], []
+    filtro = vendedor_filter(args)
+    if filtro:
+        where.append(f'{filtro[0]} = ?')
+        params.append(filtro[1])
+    if args.get('tipoConta'):
+        where.append('tipo_conta = ?')
+        params.append(args['tipoConta'])
+    for param, coluna, operador in (
+        ('dataFechamentoDe', 'data_fechamento', '>='),
+        ('dataFechamentoAte', 'data_fechamento', '<='),
+    ):
+        if args.get(param):
+            where.append(f'{coluna} {operador} ?')
+            params.append(parse_date_param(args[param], param))
+    return where, params
+
+def parcelas_tables(args):
+    """Tabelas lidas pelas listagens de parcelas: com incluirArquivadas=true, também arquivo.parcelas"""
+    if not parse_bool_param(args.get('incluirArquivadas'), 'incluirArquivadas'):
+        return 'parcelas'
+    # Arquivadas estão sempre recebidas e pagas: com esses filtros em false não há o que ler
+    # (e o arquivo seria varrido inteiro procurando)
+    for param in ('recebidaPeloCliente', 'comissaoPaga'):
+        if parse_bool_param(args.get(param), param) is False:
+            return 'parcelas'
+    return ('parcelas', 'arquivo.parcelas')
+
+def build_parcelas_filters(args):
+    """Monta as condições WHERE de parcelas a partir da query string"""
+    where, params = [], []
+    filtro = vendedor_filter(args)
+    if filtro:
+        where.append(f'{filtro[0]} = ?')
+        params.append(filtro[1])
+    if args.get('oportunidadeId'):
+        where.append('oportunidade_id = ?')
+        params.append(parse_int_param(args['oportunidadeId'], 'oportunidadeId'))
+    for param, coluna, operador in (
+        ('vencimentoDe', 'vencimento', '>='),
+        ('vencimentoAte', 'vencimento', '<='),
+        ('pagamentoComissaoDe', 'pagamento_comissao', '>='),
+        ('pagamentoComissaoAte', 'pagamento_comissao', '<='),
+    ):
+        if args.get(param):
+            where.append(f'{coluna} {operador} ?')
+            params.append(parse_date_param(args[param], param))
+    for param, coluna in (
+        ('primeiraMensalidade', 'primeira_mensalidade'),
+        ('recebidaPeloCliente', 'recebida_pelo_cliente'),
+        ('comissaoPaga', 'comissao_paga'),
+    ):
+        flag = parse_bool_param(args.get(param), param)
+        if flag is not None:
+            where.append(f'{coluna} = ?')
+            params.append(int(flag))
+    return where, params
+
+def _texto_ou_vazio(valor):
+    return valor or ''
+
+def _id_ou_vazio(valor):
+    return str(valor) if valor else ''
+
+# (chave na API, coluna, conversão) de cada tabela, na ordem de saída
+VENDEDOR_CAMPOS = (
+    ('id', 'id', str),
+    ('nome', 'nome', None),
+    ('email', 'email', None),
+    ('telefone', 'telefone', _texto_ou_vazio),
+    ('dataAdmissao', 'data_admissao', format_date_br),
+    ('observacoes', 'observacoes', _texto_ou_vazio),
+    ('dataCadastro', 'data_cadastro', format_date_br),
+)
+
+OPORTUNIDADE_CAMPOS = (
+    ('id', 'id', str),
+    ('cliente', 'cliente', None),
+    ('vendedor', 'vendedor', None),
+    ('vendedorId', 'vendedor_id', _id_ou_vazio),
+    ('tipoConta', 'tipo_conta', None),
+    ('mensalidade', 'mensalidade', None),
+    ('servicos', 'servicos', None),
+    ('valorTotal', 'valor_total', None),
+    ('valorLiquido', 'valor_liquido', None),
+    ('comissao', 'comissao', None),
+    ('dataFechamento', 'data_fechamento', format_date_br),
+    ('descricao', 'descricao', _texto_ou_vazio),
+    ('dataCadastro', 'data_cadastro', format_date_br),
+)
+
+PARCELA_CAMPOS = (
+    ('id', 'id', str),
+    ('oportunidadeId', 'oportunidade_id', _id_ou_vazio),
+    ('cliente', 'cliente', None),
+    ('vendedor', 'vendedor', None),
+    ('vendedorId', 'vendedor_id', _id_ou_vazio),
+    ('numero', 'numero', None),
+    ('valor', 'valor', None),
+    ('valorLiquido', 'valor_liquido', None),
+    ('vencimento', 'vencimento', format_date_br),
+    ('pagamentoComissao', 'pagamento_comissao', format_date_br),
+    ('comissao', 'comissao', None),
+    ('observacoes', 'observacoes', _texto_ou_vazio),
+    ('primeiraMensalidade', 'primeira_mensalidade', bool),
+    ('recebidaPeloCliente', 'recebida_pelo_cliente', bool),
+    ('comissaoPaga', 'comissao_paga', bool),
+    ('dataCadastro', 'data_cadastro', format_date_br),
+)
+
+def serialize_rows(rows, campos):
+    """Converte um resultado inteiro no formato da API.
+
+    As colunas são localizadas uma vez por resultado e cada conversão é
+    aplicada à coluna inteira; as linhas viram dicts só no final.
+    """
+    if not rows:
+        return []
+    posicoes = {coluna: i for i, coluna in enumerate(rows[0].keys())}
+    colunas = list(zip(*rows))
+    valores = []
+    for _, coluna, converter in campos:
+        dados = colunas[posicoes[coluna]]
+        valores.append(list(map(converter, dados)) if converter else dados)
+    chaves = [chave for chave, _, _ in campos]
+    return [dict(zip(chaves, linha)) for linha in zip(*valores)]
+
+def serialize_vendedor(v):
+    """Converte uma linha de vendedores no formato da API"""
+    return serialize_rows([v], VENDEDOR_CAMPOS)[0]
+
+def serialize_oportunidade(o):
+    """Converte uma linha de oportunidades no formato da API"""
+    return serialize_rows([o], OPORTUNIDADE_CAMPOS)[0]
+
+def serialize_parcela(p):
+    """Converte uma linha de parcelas no formato da API"""
+    return serialize_rows([p], PARCELA_CAMPOS)[0]
+
+def to_centavos(valor):
+    """Converte reais em centavos inteiros (meio centavo arredonda para longe do zero)"""
+    return int(math.copysign(math.floor(abs(valor) * 100 + 0.5), valor))
+
+def dividir_arredondando(numerador, divisor):
+    """Divisão inteira com arredondamento para longe do zero (igual ao SQL do recálculo)"""
+    quociente = (abs(numerador) + divisor // 2) // divisor
+    return quociente if numerador >= 0 else -quociente
+
+def calcular_comissao(valor, desconto_bp=DESCONTO_PADRAO_BP, comissao_bp=COMISSAO_PADRAO_BP):
+    """Valor líquido e comissão em centavos inteiros (padrão: 15% de desconto, 10% sobre o líquido)"""
+    liquido_centavos = dividir_arredondando(to_centavos(valor) * (10000 - desconto_bp), 10000)
+    comissao_centavos = dividir_arredondando(liquido_centavos * comissao_bp, 10000)
+    return liquido_centavos / 100, comissao_centavos / 100
+
+class CommissionRules:
+    """Regras de comissão em memória, indexadas por (vendedor, tipo de conta).
+
+    A regra mais específica vence (vendedor + tipo, só vendedor, só tipo,
+    geral) e, entre as vigentes na data de referência, a de início mais recente.
+    """
+
+    def __init__(self, versao, rows):
+        self.versao = versao
+        self._por_chave = {}
+        for row in sorted(rows, key=lambda r: (r['vigencia_inicio'], r['id']), reverse=True):
+            self._por_chave.setdefault((row['vendedor'], row['tipo_conta']), []).append(
+                (row['vigencia_inicio'], row['desconto_bp'], row['comissao_bp'])
+            )
+
+    def find(self, vendedor, tipo_conta, data_referencia):
+        """Pontos-base (desconto, comissão) da regra aplicável"""
+        for chave in ((vendedor, tipo_conta), (vendedor, None), (None, tipo_conta), (None, None)):
+            for vigencia, desconto_bp, comissao_bp in self._por_chave.get(chave, ()):
+                if vigencia <= data_referencia:
+                    return desconto_bp, comissao_bp
+        return DESCONTO_PADRAO_BP, COMISSAO_PADRAO_BP
+
+    def calcular(self, valor, vendedor, tipo_conta, data_referencia=None):
+        """(valor líquido, comissão) pela regra aplicável na data (padrão: hoje)"""
+        data_referencia = data_referencia or date.today().isoformat()
+        return calcular_comissao(valor, *self.find(vendedor, tipo_conta, data_referencia))
+
+_commission_rules = None
+_commission_rules_lock = threading.Lock()
+
+def get_commission_rules(cur):
+    """Regras em cache no processo, recarregadas quando regras_comissao muda"""
+    global _commission_rules
+    versao = read_data_versions(cur.connection, ('regras_comissao',))[0]
+    regras = _commission_rules
+    if regras is None or regras.versao != versao:
+        with _commission_rules_lock:
+            cur.execute('SELECT * FROM regras_comissao')
+            regras = _commission_rules = CommissionRules(versao, cur.fetchall())
+    return regras
+
+def tipo_conta_lookup(cur):
+    """Tipo de conta por oportunidade, memorizado durante uma operação em lote"""
+    tipos = {}
+    def lookup(oportunidade_id):
+        if oportunidade_id is None:
+            return None
+        if oportunidade_id not in tipos:
+            row = cur.execute(
+                'SELECT tipo_conta FROM oportunidades WHERE id = ?', (oportunidade_id,)
+            ).fetchone()
+            tipos[oportunidade_id] = row[0] if row else None
+        return tipos[oportunidade_id]
+    return lookup
+
+class VendedorIndex:
+    """Cadastro de vendedores em memória: id → nome, nome → id e email → id.
+
+    Nomes e emails repetidos resolvem para o vendedor mais antigo (menor id),
+    como no preenchimento de vendedor_id.
+    """
+
+    def __init__(self, versao, rows):
+        self.versao = versao
+        self.nomes, self.ids, self.logins = {}, {}, {}
+        for vendedor_id, nome, email in rows:
+            self.nomes[vendedor_id] = nome
+            self.ids.setdefault(nome, vendedor_id)
+            self.logins.setdefault(email, vendedor_id)
+
+_vendedor_index = None
+_vendedor_index_lock = threading.Lock()
+
+def get_vendedor_index(cur):
+    """Mapas em cache no processo, recarregados quando vendedores muda"""
+    global _vendedor_index
+    versao = read_data_versions(cur.connection, ('vendedores',))[0]
+    vendedores = _vendedor_index
+    if vendedores is None or vendedores.versao != versao:
+        with _vendedor_index_lock:
+            cur.execute('SELECT id, nome, email FROM vendedores ORDER BY id')
+            vendedores = _vendedor_index = VendedorIndex(versao, cur.fetchall())
+    return vendedores
+
+def resolve_vendedor(vendedores, data):
+    """(vendedor_id, nome) de um corpo de criação ou linha importada.
+
+    vendedorId tem precedência e o nome vem do cadastro; só com o nome, o id
+    é o do cadastro (None se o nome não estiver cadastrado).
+    """
+    if data.get('vendedorId') not in (None, ''):
+        vendedor_id = parse_int_param(data['vendedorId'], 'vendedorId')
+        if vendedor_id not in vendedores.nomes:
+            raise ValueError(f'Vendedor {vendedor_id} não encontrado')
+        return vendedor_id, vendedores.nomes[vendedor_id]
+    require_fields(data, ('vendedor',))
+    nome = str(data['vendedor'])
+    return vendedores.ids.get(nome), nome
+
+OPORTUNIDADES_INSERT_SQL = '''
+    INSERT INTO oportunidades (cliente, vendedor, vendedor_id, tipo_conta, mensalidade, servicos, 
+                             valor_total, valor_liquido, comissao, data_fechamento, descricao)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+PARCELAS_INSERT_SQL = '''
+    INSERT INTO parcelas (oportunidade_id, cliente, vendedor, vendedor_id, numero, valor, valor_liquido,
+                        vencimento, pagamento_comissao, comissao, observacoes, primeira_mensalidade,
+                        recebida_pelo_cliente, comissao_paga)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def parse_decimal(value, nome):
+    """Aceita número, '1234.56' ou formato brasileiro '1.234,56'"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        numero = float(value)
+    else:
+        texto = str(value or '').replace('R$', '').strip()
+        if ',' in texto:
+            texto = texto.replace('.', '').replace(',', '.')
+        try:
+            numero = float(texto)
+        except ValueError:
+            raise ValueError(f'Valor inválido para {nome}: {value}')
+    if not math.isfinite(numero):
+        raise ValueError(f'Valor inválido para {nome}: {value}')
+    return numero
+
+def parse_flag(value, nome):
+    """Booleano vindo de JSON (true/false) ou de CSV (sim/não, 1/0)"""
+    if isinstance(value, bool):
+        return value
+    if value is None:
+        return False
+    return bool(parse_bool_param(str(value), nome))
+
+def require_fields(data, campos):
+    """Garante que os campos obrigatórios estão preenchidos"""
+    for campo in campos:
+        if data.get(campo) in (None, ''):
+            raise ValueError(f'Campo obrigatório ausente: {campo}')
+
+def oportunidade_importer(cur):
+    """Validador de oportunidades importadas que devolve os valores do INSERT"""
+    regras = get_commission_rules(cur)
+    vendedores = get_vendedor_index(cur)
+    
+    def values(data):
+        require_fields(data, ('cliente', 'tipoConta', 'valorTotal'))
+        vendedor_id, vendedor = resolve_vendedor(vendedores, data)
+        valor_total = parse_decimal(data['valorTotal'], 'valorTotal')
+        data_fechamento = (
+            parse_date_param(data['dataFechamento'], 'dataFechamento') if data.get('dataFechamento') else None
+        )
+        valor_liquido, comissao = regras.calcular(
+            valor_total, vendedor, str(data['tipoConta']), data_fechamento
+        )
+        return (
+            str(data['cliente']),
+            vendedor,
+            vendedor_id,
+            str(data['tipoConta']),
+            parse_decimal(data.get('mensalidade') or 0, 'mensalidade'),
+            parse_decimal(data.get('servicos') or 0, 'servicos'),
+            valor_total,
+            valor_liquido,
+            comissao,
+            data_fechamento,
+            data.get('descricao') or ''
+        )
+    return values
+
+def parcela_importer(cur):
+    """Validador de parcelas importadas que devolve os valores do INSERT"""
+    regras = get_commission_rules(cur)
+    vendedores = get_vendedor_index(cur)
+    tipo_conta_de = tipo_conta_lookup(cur.connection.cursor())
+    
+    def values(data):
+        require_fields(data, ('cliente', 'numero', 'valor', 'vencimento', 'pagamentoComissao'))
+        vendedor_id, vendedor = resolve_vendedor(vendedores, data)
+        valor = parse_decimal(data['valor'], 'valor')
+        oportunidade_id = (
+            parse_int_param(data['oportunidadeId'], 'oportunidadeId') if data.get('oportunidadeId') else None
+        )
+        vencimento = parse_date_param(data['vencimento'], 'vencimento')
+        valor_liquido, comissao = regras.calcular(
+            valor, vendedor, tipo_conta_de(oportunidade_id), vencimento
+        )
+        return (
+            oportunidade_id,
+            str(data['cliente']),
+            vendedor,
+            vendedor_id,
+            str(data['numero']),
+            valor,
+            valor_liquido,
+            vencimento,
+            parse_date_param(data['pagamentoComissao'], 'pagamentoComissao'),
+            comissao,
+            data.get('observacoes') or '',
+            parse_flag(data.get('primeiraMensalidade'), 'primeiraMensalidade'),
+            parse_flag(data.get('recebidaPeloCliente'), 'recebidaPeloCliente'),
+            parse_flag(data.get('comissaoPaga'), 'comissaoPaga')
+        )
+    return values
+
+def iter_import_rows():
+    """Lê o upload (multipart `arquivo` ou corpo cru) em streaming.
+
+    Gera (número da linha, dict) ou (número da linha, ValueError) para linhas
+    que não puderam ser lidas. O formato vem de ?formato=csv|ndjson, do
+    Content-Type ou da extensão do arquivo.
+    """
+    arquivo = request.files.get('arquivo')
+    if arquivo:
+        stream, tipo, nome = arquivo.stream, arquivo.mimetype or '', arquivo.filename or ''
+    else:
+        stream, tipo, nome = request.stream, request.mimetype or '', ''
+
+    formato = (request.args.get('formato') or '').lower()
+    if not formato:
+        if 'ndjson' in tipo or 'jsonl' in tipo or nome.endswith(('.ndjson', '.jsonl')):
+            formato = 'ndjson'
+        elif 'csv' in tipo or nome.endswith('.csv'):
+            formato = 'csv'
+    if formato not in ('csv', 'ndjson'):
+        raise ValueError('Formato não suportado: informe formato=csv ou formato=ndjson')
+
+    texto = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if formato == 'ndjson':
+        for numero, linha in enumerate(texto, start=1):
+            if not linha.strip():
+                continue
+            try:
+                registro = json.loads(linha)
+            except ValueError:
+                yield numero, ValueError('JSON inválido')
+                continue
+            if not isinstance(registro, dict):
+                yield numero, ValueError('Cada linha deve ser um objeto JSON')
+                continue
+            yield numero, registro
+        return
+
+    # CSV exportado por planilhas brasileiras costuma usar ';'
+    cabecalho = texto.readline()
+    delimitador = ';' if cabecalho.count(';') > cabecalho.count(',') else ','
+    try:
+        campos = [campo.strip() for campo in next(csv.reader([cabecalho], delimiter=delimitador), [])]
+    except csv.Error as e:
+        yield 1, ValueError(f'CSV inválido: {e}')
+        return
+    reader = csv.DictReader(texto, fieldnames=campos, delimiter=delimitador)
+    while True:
+        try:
+            registro = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            # line_num ainda não conta a linha que falhou; o leitor segue na próxima
+            yield reader.line_num + 2, ValueError(f'CSV inválido: {e}')
+            continue
+        yield reader.line_num + 1, registro
+
+def run_import(cur, rows, values_fn, insert_sql, dry_run, ignorar_erros, validate_batch=None):
+    """Valida e insere as linhas em lotes com executemany (sem commit).
+
+    Com erros e sem ignorar_erros, para de gravar e só continua validando
+    para que o relatório cubra o arquivo inteiro.
+    """
+    total = importadas = total_erros = 0
+    erros = []
+    lote = []
+
+    def registrar_erro(numero, mensagem):
+        nonlocal total_erros
+        total_erros += 1
+        if len(erros) < IMPORT_MAX_ERROS:
+            erros.append({'linha': numero, 'erro': mensagem})
+
+    def gravar_lote():
+        nonlocal importadas
+        validos = lote
+        if validate_batch:
+            validos = []
+            for numero, valores, mensagem in validate_batch(cur, lote):
+                if mensagem:
+                    registrar_erro(numero, mensagem)
+                else:
+                    validos.append((numero, valores))
+        if not dry_run and (ignorar_erros or not total_erros):
+            cur.executemany(insert_sql, [valores for _, valores in validos])
+        importadas += len(validos)
+        lote.clear()
+
+    for numero, registro in rows:
+        total += 1
+        try:
+            if isinstance(registro, Exception):
+                raise registro
+            lote.append((numero, values_fn(registro)))
+        except ValueError as e:
+            registrar_erro(numero, str(e))
+        if len(lote) >= IMPORT_BATCH_SIZE:
+            gravar_lote()
+    if lote:
+        gravar_lote()
+
+    return {
+        'total': total,
+        'validas': importadas,
+        'totalErros': total_erros,
+        'erros': erros
+    }
+
+def validate_parcelas_oportunidades(cur, lote):
+    """Confere em uma consulta por lote se as oportunidades referenciadas existem"""
+    ids = sorted({valores[0] for _, valores in lote if valores[0] is not None})
+    existentes = set()
+    for inicio in range(0, len(ids), 500):
+        parte = ids[inicio:inicio + 500]
+        cur.execute(
+            f"SELECT id FROM oportunidades WHERE id IN ({', '.join('?' * len(parte))})", parte
+        )
+        existentes.update(row[0] for row in cur.fetchall())
+    for numero, valores in lote:
+        if valores[0] is not None and valores[0] not in existentes:
+            yield numero, valores, f'Oportunidade {valores[0]} não encontrada'
+        else:
+            yield numero, valores, None
+
+def add_months(data_base, meses, dia=None):
+    """Soma meses a uma data, limitando o dia ao último dia do mês"""
+    total = data_base.month - 1 + meses
+    ano, mes = data_base.year + total // 12, total % 12 + 1
+    return date(ano, mes, min(dia or data_base.day, calendar.monthrange(ano, mes)[1]))
+
+def build_schedule(oportunidade, params, regras):
+    """Calcula o cronograma de parcelas de uma oportunidade.
+
+    params: quantidade, primeiroVencimento, valorParcela (padrão: mensalidade
+    ou valor total dividido pela quantidade), mesesComissao (padrão 1) e
+    diaComissao (padrão: mesmo dia do vencimento). Devolve {ordem: colunas}.
+    """
+    if not isinstance(params, dict):
+        raise ValueError('parcelamento deve ser um objeto')
+    require_fields(params, ('quantidade', 'primeiroVencimento'))
+    quantidade = parse_int_param(params['quantidade'], 'quantidade')
+    if not 1 <= quantidade <= PARCELAMENTO_MAXIMO:
+        raise ValueError(f'quantidade deve estar entre 1 e {PARCELAMENTO_MAXIMO}')
+    primeiro_vencimento = date.fromisoformat(
+        parse_date_param(params['primeiroVencimento'], 'primeiroVencimento')
+    )
+    meses_comissao = parse_int_param(params.get('mesesComissao', 1), 'mesesComissao')
+    if meses_comissao < 0:
+        raise ValueError('mesesComissao não pode ser negativo')
+    dia_comissao = None
+    if params.get('diaComissao'):
+        dia_comissao = parse_int_param(params['diaComissao'], 'diaComissao')
+        if not 1 <= dia_comissao <= 31:
+            raise ValueError('diaComissao deve estar entre 1 e 31')
+
+    if params.get('valorParcela') not in (None, ''):
+        valor = parse_decimal(params['valorParcela'], 'valorParcela')
+    elif oportunidade['mensalidade']:
+        valor = oportunidade['mensalidade']
+    else:
+        valor = round(oportunidade['valor_total'] / quantidade, 2)
+
+    cronograma = {}
+    for ordem in range(1, quantidade + 1):
+        vencimento = add_months(primeiro_vencimento, ordem - 1)
+        valor_liquido, comissao = regras.calcular(
+            valor, oportunidade['vendedor'], oportunidade['tipo_conta'], vencimento.isoformat()
+        )
+        cronograma[ordem] = {
+            'cliente': oportunidade['cliente'],
+            'vendedor': oportunidade['vendedor'],
+            'vendedor_id': oportunidade['vendedor_id'],
+            'numero': f'{ordem}/{quantidade}',
+            'valor': valor,
+            'valor_liquido': valor_liquido,
+            'vencimento': vencimento.isoformat(),
+            'pagamento_comissao': add_months(vencimento, meses_comissao, dia_comissao).isoformat(),
+            'comissao': comissao,
+            'primeira_mensalidade': int(ordem == 1)
+        }
+    return cronograma
+
+# Número das parcelas geradas pelo cronograma: 'ordem/quantidade'
+_NUMERO_CRONOGRAMA = re.compile(r'^(\d+)/\d+$')
+
+def _ordem_parcela(numero):
+    """Ordem da parcela a partir do número no formato '3/12' (None se manual, como '3')"""
+    encontrado = _NUMERO_CRONOGRAMA.match(str(numero or '').strip())
+    return int(encontrado.group(1)) if encontrado else None
+
+def sync_schedule(cur, oportunidade_id, oportunidade, params):
+    """Aplica o cronograma às parcelas da oportunidade como diferença (sem commit).
+
+    Insere as ordens que faltam, atualiza só as que mudaram e remove as que
+    sobraram, preservando status já marcados. Parcelas recebidas ou com
+    comissão paga que saíram do cronograma são mantidas. Ordens já arquivadas
+    ou em um fechamento de comissão não são recriadas nem alteradas.
+    """
+    cronograma = build_schedule(oportunidade, params, get_commission_rules(cur))
+    colunas = list(next(iter(cronograma.values())))
+
+    cur.execute(
+        f"SELECT id, recebida_pelo_cliente, comissao_paga, {', '.join(colunas)}, "
+        'EXISTS (SELECT 1 FROM fechamento_parcelas f WHERE f.parcela_id = parcelas.id) AS fechada '
+        'FROM parcelas WHERE oportunidade_id = ? ORDER BY id',
+        (oportunidade_id,)
+    )
+    existentes = {}
+    for row in cur.fetchall():
+        ordem = _ordem_parcela(row['numero'])
+        if ordem is not None and ordem not in existentes:
+            existentes[ordem] = row
+    cur.execute('SELECT numero FROM arquivo.parcelas WHERE oportunidade_id = ?', (oportunidade_id,))
+    arquivadas = {_ordem_parcela(row['numero']) for row in cur.fetchall()} & set(cronograma)
+
+    inserir, atualizar, remover = [], [], []
+    fechadas = 0
+    for ordem, alvo in cronograma.items():
+        atual = existentes.get(ordem)
+        if ordem in arquivadas:
+            continue
+        if atual is None:
+            inserir.append((oportunidade_id, *alvo.values()))
+        elif atual['fechada']:
+            fechadas += 1
+        elif any(atual[coluna] != valor for coluna, valor in alvo.items()):
+            atualizar.append((*alvo.values(), atual['id']))
+
+    mantidas = 0
+    for ordem, atual in existentes.items():
+        if ordem in cronograma:
+            continue
+        if atual['recebida_pelo_cliente'] or atual['comissao_paga']:
+            mantidas += 1
+        else:
+            remover.append(atual['id'])
+
+    if inserir:
+        cur.executemany(
+            f"INSERT INTO parcelas (oportunidade_id, {', '.join(colunas)}) "
+            f"VALUES ({', '.join('?' * (len(colunas) + 1))})",
+            inserir
+        )
+    if atualizar:
+        cur.executemany(
+            f"UPDATE parcelas SET {', '.join(f'{coluna} = ?' for coluna in colunas)} WHERE id = ?",
+            atualizar
+        )
+    if remover:
+        cur.execute('DELETE FROM parcelas WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(remover),))
+
+    return {
+        'inseridas': len(inserir),
+        'atualizadas': len(atualizar),
+        'removidas': len(remover),
+        'mantidas': mantidas,
+        'arquivadas': len(arquivadas),
+        'fechadas': fechadas,
+        'inalteradas': len(cronograma) - len(inserir) - len(atualizar) - len(arquivadas) - fechadas
+    }
+
+class ResponseCache:
+    """Cache LRU em memória das respostas GET, compartilhado pelas threads do worker"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            entrada = self._entries.get(chave)
+            if entrada is not None:
+                self._entries.move_to_end(chave)
+            return entrada
+
+    def set(self, chave, entrada):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[chave] = entrada
+            self._entries.move_to_end(chave)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE)
+
+def accepts_gzip():
+    return request.accept_encodings['gzip'] > 0
+
+def set_gzip_body(response, comprimido):
+    """Troca o corpo pela versão gzip; o ETag passa a fraco (mesmo conteúdo, outros bytes)"""
+    response.set_data(comprimido)
+    response.headers['Content-Encoding'] = 'gzip'
+    etag, fraco = response.get_etag()
+    if etag and not fraco:
+        response.set_etag(etag, weak=True)
+
+@app.after_request
+def compress_json_response(response):
+    """gzip nas respostas JSON a partir de COMPRESS_MIN_SIZE bytes"""
+    if (response.status_code != 200 or response.is_streamed or response.mimetype != 'application/json'
+            or 'Content-Encoding' in response.headers):
+        return response
+    corpo = response.get_data()
+    if len(corpo) >= COMPRESS_MIN_SIZE:
+        response.vary.add('Accept-Encoding')
+        if accepts_gzip():
+            set_gzip_body(response, gzip.compress(corpo, COMPRESS_LEVEL))
+    return response
+
+def read_data_versions(conn, tabelas):
+    """Versões atuais das tabelas, mantidas pelos triggers da migração 3"""
+    cur = conn.cursor()
+    cur.execute('SELECT tabela, versao FROM versoes_dados')
+    versoes = dict(cur.fetchall())
+    return tuple(versoes.get(tabela, 0) for tabela in tabelas)
+
+def conditional_get(*tabelas):
+    """ETag pela versão das tabelas lidas pela rota.
+
+    If-None-Match igual ao ETag atual devolve 304 sem consultar as linhas;
+    respostas 200 ficam no response_cache (já com a versão gzip) até a
+    próxima escrita nas tabelas.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            conn = get_db_connection()
+            if not conn:
+                return view(*args, **kwargs)
+            
+            # O vendedor logado recebe só as próprias linhas: escopo faz parte da chave
+            chave = (request.path, request.query_string, vendedor_escopo(), read_data_versions(conn, tabelas))
+            etag = hashlib.sha1(repr(chave).encode('utf-8')).hexdigest()[:20]
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+            
+            entrada = response_cache.get(chave)
+            if entrada is None:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                corpo = response.get_data()
+                headers = {k: v for k, v in response.headers.items() if k == 'X-Next-Cursor'}
+                comprimido = gzip.compress(corpo, COMPRESS_LEVEL) if len(corpo) >= COMPRESS_MIN_SIZE else None
+                entrada = (corpo, headers, comprimido)
+                response_cache.set(chave, entrada)
+            
+            corpo, headers, comprimido = entrada
+            response = Response(corpo, mimetype='application/json', headers=headers)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            response.vary.add('Authorization')
+            if comprimido is not None:
+                response.vary.add('Accept-Encoding')
+                if accepts_gzip():
+                    set_gzip_body(response, comprimido)
+            return response
+        return wrapper
+    return decorator
+
+# Sessão: token assinado com a SECRET_KEY e validade, conferido sem consultar o banco
+SESSION_TOKEN_MAX_AGE = int(os.environ.get('SESSION_TOKEN_MAX_AGE', 12 * 3600))
+ROTAS_PUBLICAS = {'/api/login'}
+session_tokens = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='sessao')
+
+def issue_session_token(usuario):
+    """Token com email, nome e tipo do usuário, e o vendedorId do vendedor logado"""
+    return session_tokens.dumps({campo: usuario[campo] for campo in ('email', 'nome', 'tipo', 'vendedorId')
+                                 if campo in usuario})
+
+def read_session_token(token):
+    """Usuário do token, ou None se a assinatura for inválida ou estiver expirada.
+
+    Tokens de vendedor sem vendedorId (emitidos antes do escopo por id) também
+    são recusados: o vendedor entra de novo.
+    """
+    try:
+        usuario = session_tokens.loads(token, max_age=SESSION_TOKEN_MAX_AGE)
+    except BadSignature:
+        return None
+    if usuario.get('tipo') == 'vendedor' and not isinstance(usuario.get('vendedorId'), int):
+        return None
+    return usuario
+
+@app.before_request
+def authenticate_request():
+    """Exige o token nas rotas /api: Authorization: Bearer, ou ?token= (EventSource e downloads)"""
+    if request.method == 'OPTIONS' or not request.path.startswith('/api/') or request.path in ROTAS_PUBLICAS:
+        return None
+    autorizacao = request.headers.get('Authorization', '')
+    token = autorizacao[7:] if autorizacao.startswith('Bearer ') else request.args.get('token')
+    usuario = read_session_token(token) if token else None
+    if usuario is None:
+        return jsonify({'error': 'Sessão inválida ou expirada'}), 401
+    g.usuario = usuario
+
+def vendedor_escopo():
+    """Id do vendedor logado, que só enxerga as próprias linhas; None para os demais papéis.
+
+    O escopo é o id e não o nome: vendedores homônimos não veem as linhas um do outro.
+    """
+    usuario = g.get('usuario')
+    return usuario['vendedorId'] if usuario and usuario['tipo'] == 'vendedor' else None
+
+def scoped_args(args):
+    """Query string com o filtro de vendedor imposto pelo papel do usuário"""
+    vendedor_id = vendedor_escopo()
+    if vendedor_id is None:
+        return args
+    args = args.copy()
+    args['vendedorId'] = str(vendedor_id)
+    args.pop('vendedor', None)
+    return args
+
+def scoped_body(data):
+    """Corpo de criação com o vendedor imposto pelo papel do usuário"""
+    vendedor_id = vendedor_escopo()
+    if vendedor_id is None:
+        return data
+    data = dict(data)
+    data['vendedorId'] = vendedor_id
+    data.pop('vendedor', None)
+    return data
+
+def master_only(view):
+    """Restringe a rota ao usuário master"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        usuario = g.get('usuario')
+        if not usuario or usuario['tipo'] != 'master':
+            return jsonify({'error': 'Acesso restrito ao usuário master'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+def roles_allowed(*tipos):
+    """Restringe a rota aos papéis informados (master, vendedor, visualizador)"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            usuario = g.get('usuario')
+            if not usuario or usuario['tipo'] not in tipos:
+                return jsonify({'error': 'Operação não permitida para este usuário'}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Frontend: o CSS e o JS inline do index.html viram assets com hash do conteúdo,
+# pré-comprimidos e servidos com cache imutável; o HTML é revalidado por ETag
+ASSET_TIPOS = {'css': 'text/css; charset=utf-8', 'js': 'application/javascript; charset=utf-8'}
+ASSET_BLOCOS = (
+    (re.compile(r'<style>(.*?)</style>', re.S), 'css', '<link rel="stylesheet" href="/assets/{nome}">'),
+    (re.compile(r'<script>(.*?)</script>', re.S), 'js', '<script src="/assets/{nome}"></script>'),
+)
+ASSETS_MAX_AGE = 365 * 24 * 3600
+
+_frontend = None
+_frontend_lock = threading.Lock()
+
+def compress_variants(corpo):
+    """Corpo em cada Content-Encoding disponível: identity, gzip e br (se houver o brotli)"""
+    variantes = {'identity': corpo, 'gzip': gzip.compress(corpo, 9, mtime=0)}
+    if brotli is not None:
+        variantes['br'] = brotli.compress(corpo)
+    return variantes
+
+def build_frontend(caminho, mtime, assets):
+    """Separa os blocos inline do HTML em assets nomeados pelo hash do conteúdo"""
+    with open(caminho, encoding='utf-8') as arquivo:
+        html = arquivo.read()
+    
+    for padrao, extensao, tag in ASSET_BLOCOS:
+        def extrair(match, extensao=extensao, tag=tag):
+            conteudo = match.group(1).encode('utf-8')
+            nome = f'app.{hashlib.sha256(conteudo).hexdigest()[:16]}.{extensao}'
+            assets[nome] = (ASSET_TIPOS[extensao], compress_variants(conteudo))
+            return tag.format(nome=nome)
+        html = padrao.sub(extrair, html)
+    
+    corpo = html.encode('utf-8')
+    return {
+        'mtime': mtime,
+        'html': compress_variants(corpo),
+        'etag': hashlib.sha256(corpo).hexdigest()[:20],
+        'assets': assets,
+    }
+
+def get_frontend():
+    """HTML e assets do static/index.html, refeitos quando o arquivo muda"""
+    global _frontend
+    caminho = os.path.join(app.static_folder, 'index.html')
+    mtime = os.stat(caminho).st_mtime_ns
+    frontend = _frontend
+    if frontend is None or frontend['mtime'] != mtime:
+        with _frontend_lock:
+            frontend = _frontend
+            if frontend is None or frontend['mtime'] != mtime:
+                # Mantém os assets anteriores: páginas já abertas ainda podem pedi-los
+                assets = dict(frontend['assets']) if frontend else {}
+                frontend = _frontend = build_frontend(caminho, mtime, assets)
+    return frontend
+
+def encoded_response(variantes, mimetype):
+    """Resposta na melhor codificação aceita pelo cliente (Accept-Encoding)"""
+    encoding = request.accept_encodings.best_match(
+        [encoding for encoding in ('br', 'gzip') if encoding in variantes], default='identity'
+    )
+    response = Response(variantes[encoding], content_type=mimetype)
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+# Rota principal
+@app.route('/')
+def index():
+    frontend = get_frontend()
+    if request.if_none_match.contains_weak(frontend['etag']):
+        response = Response(status=304)
+    else:
+        response = encoded_response(frontend['html'], 'text/html; charset=utf-8')
+    response.set_etag(frontend['etag'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/assets/<nome>')
+def asset(nome):
+    entrada = get_frontend()['assets'].get(nome)
+    if entrada is None:
+        return jsonify({'error': 'Arquivo não encontrado'}), 404
+    mimetype, variantes = entrada
+    response = encoded_response(variantes, mimetype)
+    response.headers['Cache-Control'] = f'public, max-age={ASSETS_MAX_AGE}, immutable'
+    return response
+
+def get_vendedor_login(cur, email):
+    """(id, nome) do vendedor pelo email, do cadastro em cache (get_vendedor_index), ou None"""
+    vendedores = get_vendedor_index(cur)
+    vendedor_id = vendedores.logins.get(email)
+    return None if vendedor_id is None else (vendedor_id, vendedores.nomes[vendedor_id])
+
+# Rota de login
+@app.route('/api/login', methods=['POST'])
+def login():
+    try:
+        data = request.get_json()
+        email = data.get('email', '').lower().strip()
+        senha = data.get('senha', '')
+        
+        # Verificar usuários fixos primeiro
+        usuarios_fixos = {
+            'thiago@objetivasolucao.com.br': {
+                'senha': 'vendas123',
+                'nome': 'Thiago Teles Xavier',
+                'tipo': 'master'
+            },
+            'dalzia.reis@objetivasolucao.com.br': {
+                'senha': 'dalzia123',
+                'nome': 'Dalzia Reis',
+                'tipo': 'visualizador'
+            }
+        }
+        
+        if email in usuarios_fixos and usuarios_fixos[email]['senha'] == senha:
+            user = {
+                'email': email,
+                'nome': usuarios_fixos[email]['nome'],
+                'tipo': usuarios_fixos[email]['tipo']
+            }
+            return jsonify({'success': True, 'user': user, 'token': issue_session_token(user)})
+        
+        # Verificar vendedores cadastrados
+        conn = get_db_connection()
+        if conn:
+            vendedor = get_vendedor_login(conn.cursor(), email)
+            
+            if vendedor is not None and senha == 'vendas123':
+                user = {
+                    'email': email,
+                    'nome': vendedor[1],
+                    'tipo': 'vendedor',
+                    'vendedorId': vendedor[0]
+                }
+                return jsonify({'success': True, 'user': user, 'token': issue_session_token(user)})
+        
+        return jsonify({'success': False, 'message': 'Email ou senha incorretos'}), 401
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# Rotas para vendedores
+@app.route('/api/vendedores', methods=['GET'])
+@conditional_get('vendedores')
+def get_vendedores():
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Erro de conexão com banco'}), 500
+            
+        where, params = [], []
+        if vendedor_escopo() is not None:
+            where, params = ['id = ?'], [vendedor_escopo()]
+        
+        cur = conn.cursor()
+        vendedores, next_cursor = fetch_page(cur, 'vendedores', where, params, ['nome', 'id'])
+        
+        result = serialize_rows(vendedores, VENDEDOR_CAMPOS)
+        
+        return paginated_response(result, next_cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/vendedores', methods=['POST'])
+@master_only
+def create_vendedor():
+    try:
+        data = request.get_json()
+        
+        data_admissao = parse_date_br(data.get('dataAdmissao', ''))
+        
+        def inserir(cur):
+            nome_novo = data['nome'] not in get_vendedor_index(cur).ids
+            cur.execute('''
+                INSERT INTO vendedores (nome, email, telefone, data_admissao, observacoes)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (
+                data['nome'],
+                data['email'],
+                data.get('telefone', ''),
+                data_admissao,
+                data.get('observacoes', '')
+            ))
+            
+            vendedor_id = cur.lastrowid
+            # Linhas gravadas antes do cadastro, com este nome, passam a apontar para ele
+            if nome_novo:
+                for tabela in ('oportunidades', 'parcelas'):
+                    cur.execute(
+                        f'UPDATE {tabela} SET vendedor_id = ? WHERE vendedor = ? AND vendedor_id IS NULL',
+                        (vendedor_id, data['nome'])
+                    )
+                link_archived_parcelas(
+                    cur, 'p.vendedor = :nome AND p.vendedor_id IS NULL',
+                    {'nome': data['nome'], 'vendedor_id': vendedor_id}, ':vendedor_id'
+                )
+            return vendedor_id
+        
+        vendedor_id = run_write(inserir)
+        
+        return jsonify({
+            'id': str(vendedor_id),
+            'nome': data['nome'],
+            'email': data['email'],
+            'telefone': data.get('telefone', ''),
+            'dataAdmissao': format_date_br(data_admissao),
+            'observacoes': data.get('observacoes', ''),
+            'dataCadastro': format_date_br(datetime.now())
+        }), 201
+    except Exception as e:
+        return write_error_response(e)
+
+@app.route('/api/vendedores/<int:vendedor_id>', methods=['DELETE'])
+@master_only
+def delete_vendedor(vendedor_id):
+    try:
+        def excluir(cur):
+            # Oportunidades e parcelas (inclusive arquivadas) referenciam o vendedor pelo id
+            vinculado = any(
+                cur.execute(f'SELECT 1 FROM {tabela} WHERE vendedor_id = ? LIMIT 1', (vendedor_id,)).fetchone()
+                for tabela in VINCULO_VENDEDOR_TABELAS
+            )
+            if not vinculado:
+                cur.execute('DELETE FROM vendedores WHERE id = ?', (vendedor_id,))
+            return not vinculado
+        
+        if not run_write(excluir):
+            return jsonify({'error': 'Vendedor possui oportunidades ou parcelas e não pode ser excluído'}), 409
+        
+        return jsonify({'success': True})
+    except Exception as e:
+        return write_error_response(e)
+
+# Rotas para oportunidades
+@app.route('/api/oportunidades', methods=['GET'])
+@conditional_get('oportunidades')
+def get_oportunidades():
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Erro de conexão com banco'}), 500
+            
+        cur = conn.cursor()
+        where, params = build_oportunidades_filters(scoped_args(request.args))
+        oportunidades, next_cursor = fetch_page(
+            cur, 'oportunidades', where, params, ['data_cadastro', 'id'], descending=True
+        )
+        
+        result = serialize_rows(oportunidades, OPORTUNIDADE_CAMPOS)
+        
+        return paginated_response(result, next_cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/oportunidades', methods=['POST'])
+@roles_allowed('master', 'vendedor')
+def create_oportunidade():
+    try:
+        data = scoped_body(request.get_json())
+        
+        valor_total = float(data['valorTotal'])
+        data_fechamento = parse_date_br(data.get('dataFechamento', ''))
+        
+        def inserir(cur):
+            vendedor_id, vendedor = resolve_vendedor(get_vendedor_index(cur), data)
+            # Calcular valores pela regra de comissão vigente
+            valor_liquido, comissao = get_commission_rules(cur).calcular(
+                valor_total, vendedor, data['tipoConta'], data_fechamento
+            )
+            
+            cur.execute(OPORTUNIDADES_INSERT_SQL, (
+                data['cliente'],
+                vendedor,
+                vendedor_id,
+                data['tipoConta'],
+                float(data.get('mensalidade', 0)),
+                float(data.get('servicos', 0)),
+                valor_total,
+                valor_liquido,
+                comissao,
+                data_fechamento,
+                data.get('descricao', '')
+            ))
+            
+            oportunidade_id = cur.lastrowid
+            
+            # Cronograma de parcelas opcional, na mesma transação
+            parcelamento = None
+            if data.get('parcelamento'):
+                parcelamento = sync_schedule(cur, oportunidade_id, {
+                    'cliente': data['cliente'],
+                    'vendedor': vendedor,
+                    'vendedor_id': vendedor_id,
+                    'tipo_conta': data['tipoConta'],
+                    'mensalidade': float(data.get('mensalidade', 0)),
+                    'valor_total': valor_total
+                }, data['parcelamento'])
+            return oportunidade_id, vendedor_id, vendedor, valor_liquido, comissao, parcelamento
+        
+        oportunidade_id, vendedor_id, vendedor, valor_liquido, comissao, parcelamento = run_write(inserir)
+        
+        return jsonify({
+            'id': str(oportunidade_id),
+            'cliente': data['cliente'],
+            'vendedor': vendedor,
+            'vendedorId': _id_ou_vazio(vendedor_id),
+            'tipoConta': data['tipoConta'],
+            'mensalidade': float(data.get('mensalidade', 0)),
+            'servicos': float(data.get('servicos', 0)),
+            'valorTotal': valor_total,
+            'valorLiquido': valor_liquido,
+            'comissao': comissao,
+            'dataFechamento': format_date_br(data_fechamento),
+            'descricao': data.get('descricao', ''),
+            'dataCadastro': format_date_br(datetime.now()),
+            **({'parcelamento': parcelamento} if parcelamento else {})
+        }), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return write_error_response(e)
+
+@app.route('/api/oportunidades/<int:oportunidade_id>/parcelas', methods=['PUT'])
+@master_only
+def schedule_oportunidade_parcelas(oportunidade_id):
+    """Gera, estende ou recalcula o cronograma de parcelas da oportunidade"""
+    try:
+        data = request.get_json() or {}
+        
+        def sincronizar(cur):
+            cur.execute('SELECT * FROM oportunidades WHERE id = ?', (oportunidade_id,))
+            oportunidade = cur.fetchone()
+            return sync_schedule(cur, oportunidade_id, oportunidade, data) if oportunidade else None
+        
+        resultado = run_write(sincronizar)
+        if resultado is None:
+            return jsonify({'error': 'Oportunidade não encontrada'}), 404
+        
+        return jsonify({'success': True, **resultado})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return write_error_response(e)
+
+@app.route('/api/oportunidades/<int:oportunidade_id>', methods=['DELETE'])
+@master_only
+def delete_oportunidade(oportunidade_id):
+    try:
+        def excluir(cur):
+            # Deletar parcelas relacionadas primeiro (inclusive as arquivadas)
+            cur.execute('DELETE FROM parcelas WHERE oportunidade_id = ?', (oportunidade_id,))
+            delete_archived_parcelas(cur, oportunidade_id)
+            # Deletar oportunidade
+            cur.execute('DELETE FROM oportunidades WHERE id = ?', (oportunidade_id,))
+        
+        run_write(excluir)
+        
+        return jsonify({'success': True})
+    except Exception as e:
+        return write_error_response(e)
+
+# Rotas para parcelas
+@app.route('/api/parcelas', methods=['GET'])
+@conditional_get('parcelas')
+def get_parcelas():
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Erro de conexão com banco'}), 500
+            
+        cur = conn.cursor()
+        where, params = build_parcelas_filters(scoped_args(request.args))
+        parcelas, next_cursor = fetch_page(
+            cur, parcelas_tables(request.args), where, params, ['vencimento', 'id']
+        )
+        
+        result = serialize_rows(parcelas, PARCELA_CAMPOS)
+        
+        return paginated_response(result, next_cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/parcelas', methods=['POST'])
+def create_parcela():
+    try:
+        data = scoped_body(request.get_json())
+        
+        valor = float(data['valor'])
+        vencimento = parse_date_br(data.get('vencimento', ''))
+        pagamento_comissao = parse_date_br(data.get('pagamentoComissao', ''))
+        oportunidade_id = int(data['oportunidadeId']) if data.get('oportunidadeId') else None
+        
+        def inserir(cur):
+            vendedor_id, vendedor = resolve_vendedor(get_vendedor_index(cur), data)
+            # Calcular valores pela regra de comissão vigente
+            valor_liquido, comissao = get_commission_rules(cur).calcular(
+                valor, vendedor, tipo_conta_lookup(cur)(oportunidade_id), vencimento
+            )
+            
+            cur.execute(PARCELAS_INSERT_SQL, (
+                oportunidade_id,
+                data['cliente'],
+                vendedor,
+                vendedor_id,
+                data['numero'],
+                valor,
+                valor_liquido,
+                vencimento,
+                pagamento_comissao,
+                comissao,
+                data.get('observacoes', ''),
+                bool(data.get('primeiraMensalidade', False)),
+                bool(data.get('recebidaPeloCliente', False)),
+                bool(data.get('comissaoPaga', False))
+            ))
+            return cur.lastrowid, vendedor_id, vendedor, valor_liquido, comissao
+        
+        parcela_id, vendedor_id, vendedor, valor_liquido, comissao = run_write(inserir)
+        
+        return jsonify({
+            'id': str(parcela_id),
+            'oportunidadeId': data.get('oportunidadeId', ''),
+            'cliente': data['cliente'],
+            'vendedor': vendedor,
+            'vendedorId': _id_ou_vazio(vendedor_id),
+            'numero': data['numero'],
+            'valor': valor,
+            'valorLiquido': valor_liquido,
+            'vencimento': format_date_br(vencimento),
+            'pagamentoComissao': format_date_br(pagamento_comissao),
+            'comissao': comissao,
+            'observacoes': data.get('observacoes', ''),
+            'primeiraMensalidade': bool(data.get('primeiraMensalidade', False)),
+            'recebidaPeloCliente': bool(data.get('recebidaPeloCliente', False)),
+            'comissaoPaga': bool(data.get('comissaoPaga', False)),
+            'dataCadastro': format_date_br(datetime.now())
+        }), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return write_error_response(e)
+
+def status_updates(data):
+    """Cláusulas SET para os status presentes no corpo (atualização parcial)"""
+    campos, valores = [], []
+    for chave, coluna in (
+        ('recebidaPeloCliente', 'recebida_pelo_cliente'),
+        ('comissaoPaga', 'comissao_paga'),
+    ):
+        if chave in data:
+            campos.append(f'{coluna} = ?')
+            valores.append(int(parse_flag(data[chave], chave)))
+    if not campos:
+        raise ValueError('Informe recebidaPeloCliente e/ou comissaoPaga')
+    return campos, valores
+
+@app.route('/api/parcelas/<int:parcela_id>', methods=['PUT'])
+@roles_allowed('master', 'visualizador')
+def update_parcela(parcela_id):
+    try:
+        data = request.get_json()
+        
+        # Atualiza apenas os status enviados pelo cliente
+        campos, valores = status_updates(data)
+        
+        run_write(lambda cur: cur.execute(f'''
+            UPDATE parcelas 
+            SET {', '.join(campos)}
+            WHERE id = ?
+        ''', valores + [parcela_id]))
+        
+        return jsonify({'success': True})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return write_error_response(e)
+
+@app.route('/api/parcelas/status', methods=['PUT'])
+@roles_allowed('master', 'visualizador')
+def update_parcelas_status():
+    """Atualiza os status de várias parcelas em um único UPDATE.
+
+    Corpo: {"ids": [...]} ou {"filtro": {...}} (mesmos filtros de GET
+    /api/parcelas) e ao menos um de recebidaPeloCliente / comissaoPaga.
+    """
+    try:
+        data = request.get_json() or {}
+        campos, valores = status_updates(data)
+        
+        if data.get('ids'):
+            if not isinstance(data['ids'], list):
+                raise ValueError('ids deve ser uma lista')
+            ids = [parse_int_param(parcela_id, 'ids') for parcela_id in data['ids']]
+            where, params = ['id IN (SELECT value FROM json_each(?))'], [json.dumps(ids)]
+        elif data.get('filtro'):
+            if not isinstance(data['filtro'], dict):
+                raise ValueError('filtro deve ser um objeto')
+            where, params = build_parcelas_filters(data['filtro'])
+            if not where:
+                raise ValueError('Filtro sem condições: informe ids ou ao menos um filtro')
+        else:
+            raise ValueError('Informe ids ou filtro')
+        
+        # Só toca nas linhas cujo status realmente muda
+        where.append('(' + ' OR '.join(campo.replace('= ?', 'IS NOT ?') for campo in campos) + ')')
+        params.extend(valores)
+        
+        def atualizar(cur):
+            cur.execute(
+                f"UPDATE parcelas SET {', '.join(campos)} WHERE {' AND '.join(where)}",
+                valores + params
+            )
+            return cur.rowcount, read_dashboard_stats(cur)
+        
+        atualizadas, stats = run_write(atualizar)
+        
+        return jsonify({'success': True, 'atualizadas': atualizadas, 'stats': stats})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return write_error_response(e)
+
+@app.route('/api/parcelas/<int:parcela_id>', methods=['DELETE'])
+@master_only
+def delete_parcela(parcela_id):
+    try:
+        run_write(lambda cur: cur.execute('DELETE FROM parcelas WHERE id = ?', (parcela_id,)))
+        
+        return jsonify({'success': True})
+    except Exception as e:
+        return write_error_response(e)
+
+# Regras de comissão e recálculo em lote
+def _sql_dividir_arredondando(expressao, divisor):
+    """SQL equivalente a dividir_arredondando para operandos inteiros"""
+    metade = divisor // 2
+    return (
+        f'(CASE WHEN ({expressao}) >= 0 THEN (({expressao}) + {metade}) / {divisor} '
+        f'ELSE -((-({expressao}) + {metade}) / {divisor}) END)'
+    )
+
+def _recalculo_sql(tabela, valor, data_referencia, join, tipo_conta_ref, filtros):
+    """UPDATE set-based que reaplica as regras a uma faixa de ids da tabela"""
+    liquido = _sql_dividir_arredondando('valor_centavos * (10000 - desconto_bp)', 10000)
+    comissao = _sql_dividir_arredondando('liquido_centavos * comissao_bp', 10000)
+    return f'''
+        WITH base AS (
+            SELECT t.id, CAST(ROUND(t.{valor} * 100) AS INTEGER) AS valor_centavos,
+                   (SELECT r.id FROM regras_comissao r
+                    WHERE (r.vendedor IS NULL OR r.vendedor = t.vendedor)
+                      AND (r.tipo_conta IS NULL OR r.tipo_conta = {tipo_conta_ref})
+                      AND r.vigencia_inicio <= {data_referencia}
+                    ORDER BY (r.vendedor IS NOT NULL) * 2 + (r.tipo_conta IS NOT NULL) DESC,
+                             r.vigencia_inicio DESC, r.id DESC
+                    LIMIT 1) AS regra_id
+            FROM {tabela} t {join}
+            WHERE t.id >= ? AND t.id < ? {filtros}
+        ),
+        taxas AS (
+            SELECT b.id, b.valor_centavos,
+                   COALESCE(r.desconto_bp, {DESCONTO_PADRAO_BP}) AS desconto_bp,
+                   COALESCE(r.comissao_bp, {COMISSAO_PADRAO_BP}) AS comissao_bp
+            FROM base b LEFT JOIN regras_comissao r ON r.id = b.regra_id
+        ),
+        liquido AS (
+            SELECT id, comissao_bp, {liquido} AS liquido_centavos FROM taxas
+        ),
+        novo AS (
+            SELECT id, liquido_centavos / 100.0 AS valor_liquido, {comissao} / 100.0 AS comissao
+            FROM liquido
+        )
+        UPDATE {tabela} SET valor_liquido = novo.valor_liquido, comissao = novo.comissao
+        FROM novo
+        WHERE {tabela}.id = novo.id
+          AND ({tabela}.valor_liquido IS NOT novo.valor_liquido OR {tabela}.comissao IS NOT novo.comissao)
+    '''
+
+def recalcular_comissoes(conn, vendedor=None, tipo_conta=None, data_inicio=None,
+                         chunk_size=RECALCULO_CHUNK_SIZE, incluir_pagas=False):
+    """Reaplica as regras vigentes a parcelas e oportunidades.
+
+    Cada faixa de chunk_size ids é um UPDATE set-based em transação própria,
+    para não segurar o lock de escrita durante todo o recálculo. Parcelas com
+    comissão paga mantêm o valor pago, a menos que incluir_pagas; as que já
+    estão em um fechamento nunca mudam. Devolve quantas linhas mudaram em cada
+    tabela e quantas parcelas foram puladas por estarem pagas
+    (parcelasPagasIgnoradas, 0 com incluir_pagas) ou fechadas
+    (parcelasFechadasIgnoradas).
+    """
+    # Parcelas fora do recálculo: pagas (salvo incluir_pagas) ou congeladas em um fechamento
+    fechadas = 'EXISTS (SELECT 1 FROM fechamento_parcelas f WHERE f.parcela_id = t.id)'
+    protegidas = fechadas if incluir_pagas else f't.comissao_paga = 1 OR {fechadas}'
+    alvos = (
+        ('oportunidades', 'valor_total', 'COALESCE(t.data_fechamento, date(t.data_cadastro))',
+         '', 't.tipo_conta', ''),
+        ('parcelas', 'valor', 't.vencimento',
+         'LEFT JOIN oportunidades o ON o.id = t.oportunidade_id', 'o.tipo_conta', f' AND NOT ({protegidas})'),
+    )
+    resultado = {}
+    cur = conn.cursor()
+    for tabela, valor, data_referencia, join, tipo_conta_ref, protecao in alvos:
+        filtros, params = '', []
+        if vendedor:
+            filtros += ' AND t.vendedor = ?'
+            params.append(vendedor)
+        if tipo_conta:
+            filtros += f' AND {tipo_conta_ref} = ?'
+            params.append(tipo_conta)
+        if data_inicio:
+            filtros += f' AND {data_referencia} >= ?'
+            params.append(data_inicio)
+        if protecao:
+            cur.execute(
+                f'SELECT COUNT(*), COALESCE(SUM({fechadas}), 0) FROM {tabela} t {join} WHERE ({protegidas}) {filtros}',
+                params
+            )
+            ignoradas, ignoradas_fechadas = cur.fetchone()
+            resultado['parcelasPagasIgnoradas'] = ignoradas - ignoradas_fechadas
+            resultado['parcelasFechadasIgnoradas'] = ignoradas_fechadas
+        sql = _recalculo_sql(tabela, valor, data_referencia, join, tipo_conta_ref, filtros + protecao)
+        
+        cur.execute(f'SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM {tabela}')
+        inicio, maximo = cur.fetchone()
+        atualizadas = 0
+        while inicio <= maximo:
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                cur.execute(sql, [inicio, inicio + chunk_size] + params)
+                # rowcount não é preenchido para WITH ... UPDATE
+                atualizadas += cur.execute('SELECT changes()').fetchone()[0]
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            inicio += chunk_size
+        resultado[tabela] = atualizadas
+    return resultado
+
+@app.cli.command('recalcular-comissoes')
+@click.option('--vendedor', help='Somente as linhas deste vendedor')
+@click.option('--tipo-conta', help='Somente as linhas deste tipo de conta')
+@click.option('--desde', help='Somente linhas com data de referência a partir de (DD/MM/AAAA)')
+@click.option('--incluir-pagas', is_flag=True, help='Recalcula também parcelas com comissão paga (fora de fechamentos)')
+def recalcular_comissoes_command(vendedor, tipo_conta, desde, incluir_pagas):
+    """Reaplica as regras de comissão às linhas já gravadas"""
+    data_inicio = parse_date_param(desde, '--desde') if desde else None
+    conn = connect_db()
+    try:
+        resultado = recalcular_comissoes(conn, vendedor, tipo_conta, data_inicio, incluir_pagas=incluir_pagas)
+    finally:
+        conn.close()
+    pagas = resultado.pop('parcelasPagasIgnoradas')
+    fechadas = resultado.pop('parcelasFechadasIgnoradas')
+    for tabela, atualizadas in resultado.items():
+        click.echo(f'{tabela}: {atualizadas} linha(s) atualizada(s)')
+    if not incluir_pagas:
+        click.echo(f'parcelas com comissão paga mantidas: {pagas}')
+    click.echo(f'parcelas em fechamentos mantidas: {fechadas}')
+
+def serialize_regra(r):
+    """Converte uma linha de regras_comissao no formato da API"""
+    return {
+        'id': str(r['id']),
+        'vendedor': r['vendedor'] or '',
+        'tipoConta': r['tipo_conta'] or '',
+        'vigenciaInicio': format_date_br(r['vigencia_inicio']),
+        'desconto': r['desconto_bp'] / 100,
+        'comissao': r['comissao_bp'] / 100
+    }
+
+def parse_percentual(value, nome):
+    """Percentual (ex.: 15 ou '12,5') convertido em pontos-base"""
+    percentual = parse_decimal(value, nome)
+    if not 0 <= percentual <= 100:
+        raise ValueError(f'{nome} deve estar entre 0 e 100')
+    return int(round(percentual * 100))
+
+@app.route('/api/regras-comissao', methods=['GET'])
+def get_regras_comissao():
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Erro de conexão com banco'}), 500
+        
+        cur = conn.cursor()
+        cur.execute('''
+            SELECT * FROM regras_comissao
+            ORDER BY vendedor IS NOT NULL, vendedor, tipo_conta IS NOT NULL, tipo_conta, vigencia_inicio
+        ''')
+        return jsonify([serialize_regra(r) for r in cur.fetchall()])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/regras-comissao', methods=['POST'])
+@master_only
+def create_regra_comissao():
+    """Cadastra uma regra; com recalcular=true reaplica às linhas afetadas"""
+    try:
+        data = request.get_json() or {}
+        require_fields(data, ('vigenciaInicio', 'desconto', 'comissao'))
+        vendedor = data.get('vendedor') or None
+        tipo_conta = data.get('tipoConta') or None
+        vigencia_inicio = parse_date_param(data['vigenciaInicio'], 'vigenciaInicio')
+        desconto_bp = parse_percentual(data['desconto'], 'desconto')
+        comissao_bp = parse_percentual(data['comissao'], 'comissao')
+        recalcular = parse_flag(data.get('recalcular'), 'recalcular')
+        incluir_pagas = parse_flag(data.get('incluirPagas'), 'incluirPagas')
+        
+        regra_id = run_write(lambda cur: cur.execute('''
+            INSERT INTO regras_comissao (vendedor, tipo_conta, vigencia_inicio, desconto_bp, comissao_bp)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (vendedor, tipo_conta, vigencia_inicio, desconto_bp, comissao_bp)).lastrowid)
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Erro de conexão com banco'}), 500
+        
+        cur = conn.cursor()
+        cur.execute('SELECT * FROM regras_comissao WHERE id = ?', (regra_id,))
+        resposta = serialize_regra(cur.fetchone())
+        if recalcular:
+            resposta['recalculo'] = recalcular_comissoes(
+                conn, vendedor, tipo_conta, vigencia_inicio, incluir_pagas=incluir_pagas
+            )
+        
+        return jsonify(resposta), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return write_error_response(e)
+
+@app.route('/api/regras-comissao/<int:regra_id>', methods=['DELETE'])
+@master_only
+def delete_regra_comissao(regra_id):
+    try:
+        run_write(lambda cur: cur.execute('DELETE FROM regras_comissao WHERE id = ?', (regra_id,)))
+        
         return jsonify({'success': True})
+    except Exception as e:
+        return write_error_response(e)
+
+@app.route('/api/regras-comissao/recalcular', methods=['POST'])
+@master_only
+def recalcular_regras_comissao():
+    """Reaplica as regras; aceita vendedor, tipoConta, desde (data de referência) e incluirPagas"""
+    try:
+        data = request.get_json(silent=True) or {}
+        data_inicio = parse_date_param(data['desde'], 'desde') if data.get('desde') else None
+        
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Erro de conexão com banco'}), 500
+        
+        resultado = recalcular_comissoes(
+            conn, data.get('vendedor') or None, data.get('tipoConta') or None, data_inicio,
+            incluir_pagas=parse_flag(data.get('incluirPagas'), 'incluirPagas')
+        )
+        return jsonify({'success': True, **resultado})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return write_error_response(e)
+
+# Rotas de importação em lote (CSV ou NDJSON, uma única transação)
+def import_response(make_values, insert_sql, validate_batch=None):
+    """Executa a importação do upload atual e monta o relatório por linha"""
+    dry_run = parse_bool_param(request.args.get('dryRun'), 'dryRun') or False
+    ignorar_erros = parse_bool_param(request.args.get('ignorarErros'), 'ignorarErros') or False
+    rows = iter_import_rows()
+    
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({'error': 'Erro de conexão com banco'}), 500
+    
+    cur = conn.cursor()
+    cur.execute('BEGIN IMMEDIATE' if not dry_run else 'BEGIN')
+    try:
+        relatorio = run_import(
+            cur, rows, make_values(cur), insert_sql, dry_run, ignorar_erros, validate_batch
+        )
+        gravar = not dry_run and (ignorar_erros or not relatorio['totalErros'])
+        if gravar:
+            conn.commit()
+        else:
+            conn.rollback()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    relatorio['dryRun'] = dry_run
+    relatorio['importadas'] = relatorio['validas'] if gravar else 0
+    if gravar:
+        return jsonify(relatorio), 201
+    return jsonify(relatorio), 200 if dry_run else 400
+
+@app.route('/api/import/oportunidades', methods=['POST'])
+@master_only
+def import_oportunidades():
+    try:
+        return import_response(oportunidade_importer, OPORTUNIDADES_INSERT_SQL)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return write_error_response(e)
+
+@app.route('/api/import/parcelas', methods=['POST'])
+@master_only
+def import_parcelas():
+    try:
+        return import_response(
+            parcela_importer, PARCELAS_INSERT_SQL, validate_parcelas_oportunidades
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return write_error_response(e)
+
+# Rotas de exportação (CSV ou NDJSON em streaming)
+def format_csv_value(valor):
+    """Formata um valor para CSV no padrão brasileiro (decimal com vírgula)"""
+    if isinstance(valor, bool):
+        return 'sim' if valor else 'não'
+    if isinstance(valor, float):
+        return f'{valor:.2f}'.replace('.', ',')
+    if valor is None:
+        return ''
+    return str(valor)
+
+def export_response(nome, table, where, params, order, campos, descending=False):
+    """Resposta em streaming lendo o cursor em blocos de EXPORT_FETCH_SIZE.
+
+    O CSV usa ';' e as mesmas colunas da API, podendo ser reimportado.
+    """
+    formato = (request.args.get('formato') or 'csv').lower()
+    if formato not in ('csv', 'ndjson'):
+        raise ValueError('Formato não suportado: informe formato=csv ou formato=ndjson')
+    
+    direcao = 'DESC' if descending else 'ASC'
+    sql, repeticoes = select_sql(table, where)
+    params = list(params) * repeticoes
+    sql += ' ORDER BY ' + ', '.join(f'{coluna} {direcao}' for coluna in order)
+    
+    def blocos():
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError('Erro de conexão com banco')
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        while True:
+            rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            yield rows
+    
+    def gerar_ndjson():
+        for rows in blocos():
+            yield ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in serialize_rows(rows, campos))
+    
+    def gerar_csv():
+        yield '\ufeff'  # BOM para o Excel reconhecer UTF-8
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=';')
+        cabecalho = False
+        for rows in blocos():
+            for item in serialize_rows(rows, campos):
+                if not cabecalho:
+                    writer.writerow(item.keys())
+                    cabecalho = True
+                writer.writerow([format_csv_value(valor) for valor in item.values()])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    
+    if formato == 'ndjson':
+        gerador, mimetype = gerar_ndjson(), 'application/x-ndjson'
+    else:
+        gerador, mimetype = gerar_csv(), 'text/csv'
+    
+    response = Response(stream_with_context(gerador), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={nome}.{formato}'
+    return response
+
+@app.route('/api/export/oportunidades', methods=['GET'])
+def export_oportunidades():
+    try:
+        where, params = build_oportunidades_filters(scoped_args(request.args))
+        return export_response(
+            'oportunidades', 'oportunidades', where, params, ['data_cadastro', 'id'],
+            OPORTUNIDADE_CAMPOS, descending=True
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Rotas para oportunidades
-@app.route('/api/oportunidades', methods=['GET'])
-def get_oportunidades():
+@app.route('/api/export/parcelas', methods=['GET'])
+def export_parcelas():
+    try:
+        where, params = build_parcelas_filters(scoped_args(request.args))
+        return export_response(
+            'parcelas', parcelas_tables(request.args), where, params, ['vencimento', 'id'], PARCELA_CAMPOS
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Busca textual
+BUSCA_PAGE_SIZE = 50
+# Acima disso o bm25 de cada ocorrência fica caro (~2 µs por linha): ordena por id
+BUSCA_LIMITE_RELEVANCIA = 5000
+
+# (tipo, tabela FTS, tabela, colunas do vendedor por id e por nome, campos da API), na ordem de desempate
+BUSCA_FONTES = (
+    ('vendedores', 'busca_vendedores', 'vendedores', {'vendedor_id': 'id', 'vendedor': 'nome'}, VENDEDOR_CAMPOS),
+    ('oportunidades', 'busca_oportunidades', 'oportunidades', {'vendedor_id': 'vendedor_id', 'vendedor': 'vendedor'},
+     OPORTUNIDADE_CAMPOS),
+    ('parcelas', 'busca_parcelas', 'parcelas', {'vendedor_id': 'vendedor_id', 'vendedor': 'vendedor'},
+     PARCELA_CAMPOS),
+)
+
+def build_search_query(texto):
+    """Converte o texto digitado em consulta FTS5: todos os termos, cada um como prefixo"""
+    termos = re.findall(r'\w+', texto or '')
+    if not termos:
+        raise ValueError('Informe o termo de busca em q')
+    return ' '.join(f'"{termo}"*' for termo in termos)
+
+def search_source(cur, fonte, consulta, vendedor, cursor, limit, por_relevancia):
+    """Melhores resultados de uma tabela após o cursor: [(rank, ordem, id)].
+
+    `vendedor` é o (coluna, valor) de vendedor_filter. Sem relevância o rank
+    é 0 para todos e a ordem fica (tipo, id).
+    """
+    ordem, (tipo, fts, tabela, colunas_vendedor, _) = fonte
+    rank_sql = 'b.rank' if por_relevancia else '0'
+    sql = f'SELECT {rank_sql}, b.rowid FROM {fts} b'
+    where, params = [f'{fts} MATCH ?'], [consulta]
+    if vendedor:
+        sql += f' JOIN {tabela} t ON t.id = b.rowid'
+        where.append(f't.{colunas_vendedor[vendedor[0]]} = ?')
+        params.append(vendedor[1])
+    if cursor:
+        # Continua depois de (rank, ordem, id) do último item da página anterior
+        rank, ordem_cursor, ultimo_id = cursor
+        if ordem < ordem_cursor:
+            where.append(f'{rank_sql} > ?')
+            params.append(rank)
+        elif ordem == ordem_cursor:
+            where.append(f'({rank_sql} > ? OR ({rank_sql} = ? AND b.rowid > ?))')
+            params.extend([rank, rank, ultimo_id])
+        else:
+            where.append(f'{rank_sql} >= ?')
+            params.append(rank)
+    sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY b.rank, b.rowid' if por_relevancia else ' ORDER BY b.rowid'
+    sql += ' LIMIT ?'
+    params.append(limit)
+    cur.execute(sql, params)
+    return [(row[0], ordem, row[1]) for row in cur.fetchall()]
+
+@app.route('/api/search', methods=['GET'])
+@conditional_get('vendedores', 'oportunidades', 'parcelas')
+def search():
+    """Busca em vendedores, oportunidades e parcelas, ordenada por relevância (bm25).
+
+    Termos muito comuns (mais de BUSCA_LIMITE_RELEVANCIA ocorrências) são
+    listados por tipo e id, sem relevância.
+    """
     try:
         conn = get_db_connection()
         if not conn:
             return jsonify({'error': 'Erro de conexão com banco'}), 500
-            
+        
+        consulta = build_search_query(request.args.get('q'))
+        tipos = set(filter(None, (request.args.get('tipo') or '').split(',')))
+        fontes = [(ordem, fonte) for ordem, fonte in enumerate(BUSCA_FONTES) if not tipos or fonte[0] in tipos]
+        if not fontes:
+            raise ValueError('tipo deve ser vendedores, oportunidades e/ou parcelas')
+        limit = parse_page_size(request.args.get('limit') or str(BUSCA_PAGE_SIZE))
+        cursor = request.args.get('cursor')
+        vendedor = vendedor_filter(scoped_args(request.args))
+        
         cur = conn.cursor()
-        cur.execute('SELECT * FROM oportunidades ORDER BY data_cadastro DESC')
-        oportunidades = cur.fetchall()
-        conn.close()
+        if cursor:
+            # O modo de ordenação da primeira página vale para as seguintes
+            por_relevancia, *cursor = decode_cursor(cursor, 4)
+        else:
+            ocorrencias = 0
+            for _, (_, fts, _, _, _) in fontes:
+                cur.execute(f'SELECT count(*) FROM {fts} WHERE {fts} MATCH ?', (consulta,))
+                ocorrencias += cur.fetchone()[0]
+            por_relevancia = ocorrencias <= BUSCA_LIMITE_RELEVANCIA
+        
+        resultados = sorted(
+            resultado
+            for fonte in fontes
+            for resultado in search_source(cur, fonte, consulta, vendedor, cursor, limit + 1, por_relevancia)
+        )
+        next_cursor = None
+        if len(resultados) > limit:
+            resultados = resultados[:limit]
+            next_cursor = encode_cursor([por_relevancia] + list(resultados[-1]))
         
-        result = []
-        for o in oportunidades:
-            result.append({
-                'id': str(o['id']),
-                'cliente': o['cliente'],
-                'vendedor': o['vendedor'],
-                'tipoConta': o['tipo_conta'],
-                'mensalidade': o['mensalidade'],
-                'servicos': o['servicos'],
-                'valorTotal': o['valor_total'],
-                'valorLiquido': o['valor_liquido'],
-                'comissao': o['comissao'],
-                'dataFechamento': format_date_br(o['data_fechamento']),
-                'descricao': o['descricao'] or '',
-                'dataCadastro': format_date_br(o['data_cadastro'])
-            })
-        
-        return jsonify(result)
+        # Dados atuais dos registros encontrados, uma consulta por tabela
+        dados = {}
+        for ordem, (tipo, _, tabela, _, campos) in fontes:
+            ids = [registro_id for _, o, registro_id in resultados if o == ordem]
+            if ids:
+                cur.execute(f'SELECT * FROM {tabela} WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(ids),))
+                rows = cur.fetchall()
+                for row, item in zip(rows, serialize_rows(rows, campos)):
+                    dados[(ordem, row['id'])] = item
+        
+        result = [{
+            'tipo': BUSCA_FONTES[ordem][0],
+            'id': str(registro_id),
+            'relevancia': round(-rank, 6) if por_relevancia else None,
+            'dados': dados.get((ordem, registro_id))
+        } for rank, ordem, registro_id in resultados]
+        
+        return paginated_response(result, next_cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/oportunidades', methods=['POST'])
-def create_oportunidade():
+# Rota para estatísticas do dashboard
+def read_dashboard_stats(cur, filtro=None):
+    """Totais do dashboard, mantidos pelos triggers de oportunidades, vendedores e parcelas.
+
+    Com `filtro` (de vendedor_filter), os totais vêm dos agregados por vendedor
+    e mês. As parcelas arquivadas entram pelos agregados do arquivo.
+    """
+    if filtro is None:
+        cur.execute('''
+            SELECT t.total_oportunidades, t.total_vendedores,
+                   t.total_parcelas + a.total_parcelas AS total_parcelas,
+                   t.parcelas_pagas + a.parcelas_pagas AS parcelas_pagas,
+                   t.total_comissoes_centavos + a.total_comissoes_centavos AS total_comissoes_centavos,
+                   t.comissoes_pagas_centavos + a.comissoes_pagas_centavos AS comissoes_pagas_centavos
+            FROM dashboard_totais t, (
+                SELECT COALESCE(SUM(total_parcelas), 0) AS total_parcelas,
+                       COALESCE(SUM(parcelas_pagas), 0) AS parcelas_pagas,
+                       COALESCE(SUM(total_comissoes_centavos), 0) AS total_comissoes_centavos,
+                       COALESCE(SUM(comissoes_pagas_centavos), 0) AS comissoes_pagas_centavos
+                FROM arquivo_vendedor_mes
+            ) a
+            WHERE t.id = 1
+        ''')
+    else:
+        where, params = agregado_vendedor_where(filtro)
+        cur.execute(f'''
+            SELECT (SELECT COUNT(*) FROM oportunidades WHERE {filtro[0]} = ?) AS total_oportunidades,
+                   1 AS total_vendedores,
+                   COALESCE(SUM(total_parcelas), 0) AS total_parcelas,
+                   COALESCE(SUM(parcelas_pagas), 0) AS parcelas_pagas,
+                   COALESCE(SUM(total_comissoes_centavos), 0) AS total_comissoes_centavos,
+                   COALESCE(SUM(comissoes_pagas_centavos), 0) AS comissoes_pagas_centavos
+            FROM dashboard_vendedor_mes_total
+            WHERE {' AND '.join(where)}
+        ''', [filtro[1]] + params)
+    totais = cur.fetchone()
+    
+    total_comissoes = totais['total_comissoes_centavos'] if totais else 0
+    comissoes_pagas = totais['comissoes_pagas_centavos'] if totais else 0
+    
+    return {
+        'totalOportunidades': totais['total_oportunidades'] if totais else 0,
+        'totalVendedores': totais['total_vendedores'] if totais else 0,
+        'totalParcelas': totais['total_parcelas'] if totais else 0,
+        'parcelasPagas': totais['parcelas_pagas'] if totais else 0,
+        'totalComissoes': total_comissoes / 100,
+        'comissoesPagas': comissoes_pagas / 100,
+        'comissoesPendentes': (total_comissoes - comissoes_pagas) / 100
+    }
+
+@app.route('/api/dashboard/stats', methods=['GET'])
+@conditional_get('vendedores', 'oportunidades', 'parcelas')
+def get_dashboard_stats():
     try:
-        data = request.get_json()
-        
-        # Calcular valores com 15% de desconto
-        valor_total = float(data['valorTotal'])
-        valor_liquido = valor_total * 0.85  # 15% de desconto
-        comissao = valor_liquido * 0.10  # 10% de comissão sobre valor líquido
-        
         conn = get_db_connection()
         if not conn:
             return jsonify({'error': 'Erro de conexão com banco'}), 500
         
         cur = conn.cursor()
-        data_fechamento = parse_date_br(data.get('dataFechamento', ''))
-        
-        cur.execute('''
-            INSERT INTO oportunidades (cliente, vendedor, tipo_conta, mensalidade, servicos, 
-                                     valor_total, valor_liquido, comissao, data_fechamento, descricao)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            data['cliente'],
-            data['vendedor'],
-            data['tipoConta'],
-            float(data.get('mensalidade', 0)),
-            float(data.get('servicos', 0)),
-            valor_total,
-            valor_liquido,
-            comissao,
-            data_fechamento,
-            data.get('descricao', '')
-        ))
-        
-        oportunidade_id = cur.lastrowid
-        conn.commit()
-        conn.close()
-        
-        return jsonify({
-            'id': str(oportunidade_id),
-            'cliente': data['cliente'],
-            'vendedor': data['vendedor'],
-            'tipoConta': data['tipoConta'],
-            'mensalidade': float(data.get('mensalidade', 0)),
-            'servicos': float(data.get('servicos', 0)),
-            'valorTotal': valor_total,
-            'valorLiquido': valor_liquido,
-            'comissao': comissao,
-            'dataFechamento': format_date_br(data_fechamento),
-            'descricao': data.get('descricao', ''),
-            'dataCadastro': format_date_br(datetime.now())
-        }), 201
+        return jsonify(read_dashboard_stats(cur, vendedor_filter(scoped_args({}), cur)))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/oportunidades/<int:oportunidade_id>', methods=['DELETE'])
-def delete_oportunidade(oportunidade_id):
+def format_dashboard_bucket(row):
+    """Serializa uma linha agregada de dashboard_vendedor_mes"""
+    return {
+        'totalParcelas': row['total_parcelas'],
+        'parcelasPagas': row['parcelas_pagas'],
+        'totalComissoes': row['total_comissoes_centavos'] / 100,
+        'comissoesPagas': row['comissoes_pagas_centavos'] / 100,
+        'comissoesPendentes': (row['total_comissoes_centavos'] - row['comissoes_pagas_centavos']) / 100
+    }
+
+@app.route('/api/dashboard/vendedores', methods=['GET'])
+@conditional_get('parcelas', 'vendedores')
+def get_dashboard_vendedores():
     try:
         conn = get_db_connection()
         if not conn:
             return jsonify({'error': 'Erro de conexão com banco'}), 500
         
         cur = conn.cursor()
-        # Deletar parcelas relacionadas primeiro
-        cur.execute('DELETE FROM parcelas WHERE oportunidade_id = ?', (oportunidade_id,))
-        # Deletar oportunidade
-        cur.execute('DELETE FROM oportunidades WHERE id = ?', (oportunidade_id,))
-        conn.commit()
-        conn.close()
+        where, params = agregado_vendedor_where(vendedor_filter(scoped_args({}), cur))
         
-        return jsonify({'success': True})
+        # Agrupa pelo id; o nome vem do cadastro só para exibição
+        cur.execute(f'''
+            SELECT {AGREGADO_VENDEDOR_NOME} AS vendedor, a.*
+            FROM (
+                SELECT vendedor_id, vendedor_sem_cadastro, SUM(total_parcelas) AS total_parcelas,
+                       SUM(parcelas_pagas) AS parcelas_pagas,
+                       SUM(total_comissoes_centavos) AS total_comissoes_centavos,
+                       SUM(comissoes_pagas_centavos) AS comissoes_pagas_centavos
+                FROM dashboard_vendedor_mes_total
+                {'WHERE ' + ' AND '.join(where) if where else ''}
+                GROUP BY vendedor_id, vendedor_sem_cadastro
+            ) AS a
+            ORDER BY vendedor, a.vendedor_id
+        ''', params)
+        
+        return jsonify([
+            {'vendedor': row['vendedor'], 'vendedorId': _id_ou_vazio(row['vendedor_id']),
+             **format_dashboard_bucket(row)}
+            for row in cur.fetchall()
+        ])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Rotas para parcelas
-@app.route('/api/parcelas', methods=['GET'])
-def get_parcelas():
+@app.route('/api/dashboard/mensal', methods=['GET'])
+@conditional_get('parcelas', 'vendedores')
+def get_dashboard_mensal():
     try:
         conn = get_db_connection()
         if not conn:
             return jsonify({'error': 'Erro de conexão com banco'}), 500
-            
+        
         cur = conn.cursor()
-        cur.execute('SELECT * FROM parcelas ORDER BY vencimento')
-        parcelas = cur.fetchall()
-        conn.close()
+        where, params = agregado_vendedor_where(vendedor_filter(scoped_args(request.args), cur))
         
-        result = []
-        for p in parcelas:
-            result.append({
-                'id': str(p['id']),
-                'oportunidadeId': str(p['oportunidade_id']) if p['oportunidade_id'] else '',
-                'cliente': p['cliente'],
-                'vendedor': p['vendedor'],
-                'numero': p['numero'],
-                'valor': p['valor'],
-                'valorLiquido': p['valor_liquido'],
-                'vencimento': format_date_br(p['vencimento']),
-                'pagamentoComissao': format_date_br(p['pagamento_comissao']),
-                'comissao': p['comissao'],
-                'observacoes': p['observacoes'] or '',
-                'primeiraMensalidade': bool(p['primeira_mensalidade']),
-                'recebidaPeloCliente': bool(p['recebida_pelo_cliente']),
-                'comissaoPaga': bool(p['comissao_paga']),
-                'dataCadastro': format_date_br(p['data_cadastro'])
-            })
-        
-        return jsonify(result)
+        # Mês de pagamento da comissão
+        cur.execute(f'''
+            SELECT mes, SUM(total_parcelas) AS total_parcelas, SUM(parcelas_pagas) AS parcelas_pagas,
+                   SUM(total_comissoes_centavos) AS total_comissoes_centavos,
+                   SUM(comissoes_pagas_centavos) AS comissoes_pagas_centavos
+            FROM dashboard_vendedor_mes_total
+            {'WHERE ' + ' AND '.join(where) if where else ''}
+            GROUP BY mes
+            ORDER BY mes
+        ''', params)
+        
+        return jsonify([
+            {'mes': f"{row['mes'][5:7]}/{row['mes'][:4]}", **format_dashboard_bucket(row)}
+            for row in cur.fetchall()
+        ])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/parcelas', methods=['POST'])
-def create_parcela():
+# Relatório mensal (previsão de comissões e fluxo de recebimentos)
+RELATORIO_MESES_PADRAO = 24
+RELATORIO_MESES_MAXIMO = 120
+RELATORIO_COLUNAS = (
+    ('comissaoPaga', 'comissao_paga_centavos'),
+    ('comissaoPendente', 'comissao_pendente_centavos'),
+    ('valorRecebido', 'valor_recebido_centavos'),
+    ('valorPendente', 'valor_pendente_centavos'),
+)
+
+def parse_month_param(value, nome):
+    """Mês em MM/YYYY ou YYYY-MM; devolve a data do dia 1"""
+    texto = (value or '').strip()
+    try:
+        if '/' in texto:
+            mes, ano = texto.split('/')
+        else:
+            ano, mes = texto.split('-')
+        return date(int(ano), int(mes), 1)
+    except ValueError:
+        raise ValueError(f'Mês inválido para {nome}: {value} (use MM/AAAA)')
+
+@app.route('/api/relatorios/mensal', methods=['GET'])
+@conditional_get('parcelas', 'oportunidades', 'vendedores')
+def get_relatorio_mensal():
+    """Matrizes vendedor × mês lidas de relatorio_mensal.
+
+    Comissão paga/pendente pelo mês de pagamento_comissao e valor
+    recebido/pendente pelo mês de vencimento. Padrão: 12 meses antes e 11
+    depois do mês atual. Com incluirArquivadas=true soma também os agregados
+    das parcelas arquivadas.
+    """
     try:
-        data = request.get_json()
-        
-        # Calcular valores com 15% de desconto
-        valor = float(data['valor'])
-        valor_liquido = valor * 0.85  # 15% de desconto
-        comissao = valor_liquido * 0.10  # 10% de comissão sobre valor líquido
-        
         conn = get_db_connection()
         if not conn:
             return jsonify({'error': 'Erro de conexão com banco'}), 500
         
+        if request.args.get('mesDe'):
+            inicio = parse_month_param(request.args['mesDe'], 'mesDe')
+        else:
+            inicio = add_months(date.today().replace(day=1), -(RELATORIO_MESES_PADRAO // 2))
+        if request.args.get('mesAte'):
+            fim = parse_month_param(request.args['mesAte'], 'mesAte')
+        else:
+            fim = add_months(inicio, RELATORIO_MESES_PADRAO - 1)
+        quantidade = (fim.year - inicio.year) * 12 + fim.month - inicio.month + 1
+        if quantidade < 1:
+            raise ValueError('mesAte deve ser igual ou posterior a mesDe')
+        if quantidade > RELATORIO_MESES_MAXIMO:
+            raise ValueError(f'Período máximo de {RELATORIO_MESES_MAXIMO} meses')
+        meses = [add_months(inicio, i).strftime('%Y-%m') for i in range(quantidade)]
+        posicao = {mes: i for i, mes in enumerate(meses)}
+        por_tipo = parse_bool_param(request.args.get('porTipoConta'), 'porTipoConta')
+        arquivadas = parse_bool_param(request.args.get('incluirArquivadas'), 'incluirArquivadas')
+        
         cur = conn.cursor()
-        vencimento = parse_date_br(data.get('vencimento', ''))
-        pagamento_comissao = parse_date_br(data.get('pagamentoComissao', ''))
+        where, params = agregado_vendedor_where(vendedor_filter(scoped_args(request.args), cur))
+        where.append('mes BETWEEN ? AND ?')
+        params.extend([meses[0], meses[-1]])
+        if request.args.get('tipoConta'):
+            where.append('tipo_conta = ?')
+            params.append(request.args['tipoConta'])
+        grupo = ['vendedor_id', 'vendedor_sem_cadastro'] + (['tipo_conta'] if por_tipo else [])
         
-        cur.execute('''
-            INSERT INTO parcelas (oportunidade_id, cliente, vendedor, numero, valor, valor_liquido,
-                                vencimento, pagamento_comissao, comissao, observacoes, primeira_mensalidade,
-                                recebida_pelo_cliente, comissao_paga)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            int(data['oportunidadeId']) if data.get('oportunidadeId') else None,
-            data['cliente'],
-            data['vendedor'],
-            data['numero'],
-            valor,
-            valor_liquido,
-            vencimento,
-            pagamento_comissao,
-            comissao,
-            data.get('observacoes', ''),
-            bool(data.get('primeiraMensalidade', False)),
-            bool(data.get('recebidaPeloCliente', False)),
-            bool(data.get('comissaoPaga', False))
-        ))
+        # Agrupa pelo id; o nome vem do cadastro só para exibição e ordenação
+        cur.execute(f'''
+            SELECT {AGREGADO_VENDEDOR_NOME}, a.*
+            FROM (
+                SELECT {', '.join(grupo)}, mes, {', '.join(f'SUM({coluna})' for _, coluna in RELATORIO_COLUNAS)}
+                FROM {'relatorio_mensal_total' if arquivadas else 'relatorio_mensal'}
+                WHERE {' AND '.join(where)}
+                GROUP BY {', '.join(grupo)}, mes
+            ) AS a
+            ORDER BY 1, {', '.join('a.' + coluna for coluna in grupo)}
+        ''', params)
         
-        parcela_id = cur.lastrowid
-        conn.commit()
-        conn.close()
+        # Uma série por coluna, alinhada com `meses`
+        linhas = OrderedDict()
+        totais = [[0] * quantidade for _ in RELATORIO_COLUNAS]
+        # Linha: nome, colunas de `grupo`, mês e as somas
+        for row in cur.fetchall():
+            chave = tuple(row[:len(grupo) + 1])
+            series = linhas.get(chave)
+            if series is None:
+                series = linhas[chave] = [[0] * quantidade for _ in RELATORIO_COLUNAS]
+            i = posicao[row[len(grupo) + 1]]
+            for j, centavos in enumerate(row[len(grupo) + 2:]):
+                series[j][i] += centavos
+                totais[j][i] += centavos
+        
+        def formatar(series):
+            return {nome: [c / 100 for c in serie] for (nome, _), serie in zip(RELATORIO_COLUNAS, series)}
+        
+        vendedores = []
+        for chave, series in linhas.items():
+            item = {'vendedor': chave[0], 'vendedorId': _id_ou_vazio(chave[1])}
+            if por_tipo:
+                item['tipoConta'] = chave[3]
+            item.update(formatar(series))
+            item['totais'] = {nome: sum(serie) / 100 for (nome, _), serie in zip(RELATORIO_COLUNAS, series)}
+            vendedores.append(item)
         
         return jsonify({
-            'id': str(parcela_id),
-            'oportunidadeId': data.get('oportunidadeId', ''),
-            'cliente': data['cliente'],
-            'vendedor': data['vendedor'],
-            'numero': data['numero'],
-            'valor': valor,
-            'valorLiquido': valor_liquido,
-            'vencimento': format_date_br(vencimento),
-            'pagamentoComissao': format_date_br(pagamento_comissao),
-            'comissao': comissao,
-            'observacoes': data.get('observacoes', ''),
-            'primeiraMensalidade': bool(data.get('primeiraMensalidade', False)),
-            'recebidaPeloCliente': bool(data.get('recebidaPeloCliente', False)),
-            'comissaoPaga': bool(data.get('comissaoPaga', False)),
-            'dataCadastro': format_date_br(datetime.now())
-        }), 201
+            'meses': [f'{mes[5:7]}/{mes[:4]}' for mes in meses],
+            'vendedores': vendedores,
+            'totais': formatar(totais)
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/parcelas/<int:parcela_id>', methods=['PUT'])
-def update_parcela(parcela_id):
+# Fechamentos de comissão: paga as comissões pendentes de um período e guarda o extrato
+FECHAMENTO_COLUNAS_CENTAVOS = (
+    ('valor', 'valor_centavos'),
+    ('valorLiquido', 'valor_liquido_centavos'),
+    ('comissao', 'comissao_centavos'),
+)
+
+def _centavos_em_reais(centavos):
+    return (centavos or 0) / 100
+
+FECHAMENTO_CAMPOS = (
+    ('id', 'id', str),
+    ('pagamentoComissaoDe', 'periodo_inicio', format_date_br),
+    ('pagamentoComissaoAte', 'periodo_fim', format_date_br),
+    ('criadoPor', 'criado_por', _texto_ou_vazio),
+    ('dataCriacao', 'criado_em', format_date_br),
+    ('totalVendedores', 'total_vendedores', None),
+    ('totalParcelas', 'total_parcelas', None),
+) + tuple((chave, coluna, _centavos_em_reais) for chave, coluna in FECHAMENTO_COLUNAS_CENTAVOS)
+
+FECHAMENTO_VENDEDOR_CAMPOS = (
+    ('vendedor', 'vendedor', None),
+    ('vendedorId', 'vendedor_id', _id_ou_vazio),
+    ('totalParcelas', 'total_parcelas', None),
+) + tuple((chave, coluna, _centavos_em_reais) for chave, coluna in FECHAMENTO_COLUNAS_CENTAVOS)
+
+FECHAMENTO_PARCELA_CAMPOS = (
+    ('fechamentoId', 'fechamento_id', str),
+    ('parcelaId', 'parcela_id', str),
+    ('oportunidadeId', 'oportunidade_id', _id_ou_vazio),
+    ('cliente', 'cliente', None),
+    ('vendedor', 'vendedor', None),
+    ('vendedorId', 'vendedor_id', _id_ou_vazio),
+    ('numero', 'numero', None),
+    ('vencimento', 'vencimento', format_date_br),
+    ('pagamentoComissao', 'pagamento_comissao', format_date_br),
+) + tuple((chave, coluna, _centavos_em_reais) for chave, coluna in FECHAMENTO_COLUNAS_CENTAVOS)
+
+def close_commission_period(conn, inicio, fim, usuario=None):
+    """Fecha as comissões pendentes com pagamento_comissao entre `inicio` e `fim`.
+
+    Numa única transação: copia as parcelas pendentes ainda fora de qualquer
+    fechamento para fechamento_parcelas, soma o extrato de cada vendedor com
+    GROUP BY e marca as parcelas como pagas. Os triggers por linha ficam
+    desligados (fechamento_em_curso) e os agregados, a versão e o changelog são
+    atualizados em passos agrupados, como no arquivamento. Devolve (id, criado); sem parcelas
+    pendentes nada é gravado e o id é o do último fechamento do mesmo período
+    (None se não houver), de modo que repetir o fechamento não paga duas vezes.
+    """
+    periodo = {'inicio': inicio, 'fim': fim}
+    cur = conn.cursor()
+    cur.execute('BEGIN IMMEDIATE')
     try:
-        data = request.get_json()
+        condicao = '''
+            p.comissao_paga = 0 AND p.pagamento_comissao BETWEEN :inicio AND :fim
+            AND NOT EXISTS (SELECT 1 FROM fechamento_parcelas f WHERE f.parcela_id = p.id)
+        '''
+        cur.execute(f'SELECT EXISTS (SELECT 1 FROM parcelas p WHERE {condicao})', periodo)
+        if not cur.fetchone()[0]:
+            cur.execute('''
+                SELECT id FROM fechamentos WHERE periodo_inicio = :inicio AND periodo_fim = :fim
+                ORDER BY id DESC LIMIT 1
+            ''', periodo)
+            row = cur.fetchone()
+            conn.rollback()
+            return (row[0] if row else None), False
+        
+        cur.execute(
+            'INSERT INTO fechamentos (periodo_inicio, periodo_fim, criado_por) VALUES (:inicio, :fim, :usuario)',
+            {**periodo, 'usuario': usuario}
+        )
+        fechamento = {'fechamento_id': cur.lastrowid}
+        cur.execute(f'''
+            INSERT INTO fechamento_parcelas (
+                fechamento_id, vendedor, parcela_id, vendedor_id, oportunidade_id, cliente, numero,
+                vencimento, pagamento_comissao, valor_centavos, valor_liquido_centavos, comissao_centavos
+            )
+            SELECT :fechamento_id, p.vendedor, p.id, p.vendedor_id, p.oportunidade_id, p.cliente, p.numero,
+                   p.vencimento, p.pagamento_comissao, CAST(ROUND(p.valor * 100) AS INTEGER),
+                   CAST(ROUND(p.valor_liquido * 100) AS INTEGER), CAST(ROUND(p.comissao * 100) AS INTEGER)
+            FROM parcelas p
+            WHERE {condicao}
+        ''', {**periodo, **fechamento})
+        cur.execute('''
+            INSERT INTO fechamento_vendedores (
+                fechamento_id, vendedor, vendedor_id, total_parcelas,
+                valor_centavos, valor_liquido_centavos, comissao_centavos
+            )
+            SELECT fechamento_id, vendedor, vendedor_id, COUNT(*),
+                   SUM(valor_centavos), SUM(valor_liquido_centavos), SUM(comissao_centavos)
+            FROM fechamento_parcelas
+            WHERE fechamento_id = :fechamento_id
+            GROUP BY vendedor_id, vendedor
+        ''', fechamento)
+        cur.execute('INSERT INTO fechamento_em_curso (fechamento_id) VALUES (:fechamento_id)', fechamento)
+        selecao = 'SELECT parcela_id FROM fechamento_parcelas WHERE fechamento_id = :fechamento_id'
+        cur.execute(f'UPDATE parcelas SET comissao_paga = 1 WHERE id IN ({selecao})', fechamento)
+        # Pagar só move a comissão de pendente para paga no mês de pagamento_comissao:
+        # os deltas saem da cópia em fechamento_parcelas, agrupados
+        vendedor = ', '.join(_chave_vendedor_sql('f'))
+        cur.execute(f'''
+            INSERT INTO dashboard_vendedor_mes
+                (vendedor_id, vendedor_sem_cadastro, mes, total_parcelas, parcelas_pagas,
+                 total_comissoes_centavos, comissoes_pagas_centavos)
+            SELECT {vendedor}, substr(f.pagamento_comissao, 1, 7), 0, COUNT(*), 0, SUM(f.comissao_centavos)
+            FROM fechamento_parcelas f
+            WHERE f.fechamento_id = :fechamento_id
+            GROUP BY {vendedor}, substr(f.pagamento_comissao, 1, 7)
+            ON CONFLICT (vendedor_id, vendedor_sem_cadastro, mes) DO UPDATE SET
+                parcelas_pagas = parcelas_pagas + excluded.parcelas_pagas,
+                comissoes_pagas_centavos = comissoes_pagas_centavos + excluded.comissoes_pagas_centavos
+        ''', fechamento)
+        cur.execute(f'''
+            INSERT INTO relatorio_mensal (
+                mes, vendedor_id, vendedor_sem_cadastro, tipo_conta, comissao_paga_centavos,
+                comissao_pendente_centavos, valor_recebido_centavos, valor_pendente_centavos
+            )
+            SELECT substr(f.pagamento_comissao, 1, 7), {vendedor}, COALESCE(o.tipo_conta, ''),
+                   SUM(f.comissao_centavos), -SUM(f.comissao_centavos), 0, 0
+            FROM fechamento_parcelas f
+            LEFT JOIN oportunidades o ON o.id = f.oportunidade_id
+            WHERE f.fechamento_id = :fechamento_id
+            GROUP BY substr(f.pagamento_comissao, 1, 7), {vendedor}, COALESCE(o.tipo_conta, '')
+            HAVING SUM(f.comissao_centavos) != 0
+            {RELATORIO_UPSERT_SQL}
+        ''', fechamento)
+        cur.execute('''
+            UPDATE dashboard_totais SET
+                parcelas_pagas = parcelas_pagas + t.total_parcelas,
+                comissoes_pagas_centavos = comissoes_pagas_centavos + t.comissao_centavos
+            FROM (
+                SELECT SUM(total_parcelas) AS total_parcelas, SUM(comissao_centavos) AS comissao_centavos
+                FROM fechamento_vendedores WHERE fechamento_id = :fechamento_id
+            ) AS t
+            WHERE id = 1
+        ''', fechamento)
+        cur.execute("UPDATE versoes_dados SET versao = versao + 1 WHERE tabela = 'parcelas'")
+        cur.execute(f'''
+            INSERT INTO alteracoes (tabela, operacao, registro_id)
+            SELECT 'parcelas', 'update', parcela_id FROM ({selecao})
+        ''', fechamento)
+        cur.execute('DELETE FROM fechamento_em_curso')
+        conn.commit()
+        return fechamento['fechamento_id'], True
+    except Exception:
+        conn.rollback()
+        raise
+
+def fechamento_periodo(data):
+    """(início, fim) do fechamento: mes (MM/AAAA) ou pagamentoComissaoDe e pagamentoComissaoAte"""
+    if data.get('mes'):
+        inicio = parse_month_param(data['mes'], 'mes')
+        fim = add_months(inicio, 1) - timedelta(days=1)
+        return inicio.isoformat(), fim.isoformat()
+    require_fields(data, ('pagamentoComissaoDe', 'pagamentoComissaoAte'))
+    inicio = parse_date_param(data['pagamentoComissaoDe'], 'pagamentoComissaoDe')
+    fim = parse_date_param(data['pagamentoComissaoAte'], 'pagamentoComissaoAte')
+    if fim < inicio:
+        raise ValueError('pagamentoComissaoAte deve ser igual ou posterior a pagamentoComissaoDe')
+    return inicio, fim
+
+def fechamento_vendedor_where(cur, args, alias=''):
+    """Condição de vendedor (vendedorId, vendedor ou o escopo do usuário) sobre as tabelas do fechamento"""
+    filtro = vendedor_filter(scoped_args(args), cur)
+    if not filtro:
+        return [], []
+    return [f'{alias}{filtro[0]} = ?'], [filtro[1]]
+
+def read_fechamentos(cur, where, params):
+    """Fechamentos com os totais somados dos extratos que atendem a `where`, do mais recente ao mais antigo"""
+    cur.execute(f'''
+        SELECT f.id, f.periodo_inicio, f.periodo_fim, f.criado_por, f.criado_em,
+               COUNT(*) AS total_vendedores, SUM(v.total_parcelas) AS total_parcelas,
+               {', '.join(f'SUM(v.{coluna}) AS {coluna}' for _, coluna in FECHAMENTO_COLUNAS_CENTAVOS)}
+        FROM fechamentos f
+        JOIN fechamento_vendedores v ON v.fechamento_id = f.id
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        GROUP BY f.id
+        ORDER BY f.id DESC
+    ''', params)
+    return serialize_rows(cur.fetchall(), FECHAMENTO_CAMPOS)
+
+def read_fechamento(cur, fechamento_id, args):
+    """Fechamento com o extrato de cada vendedor, ou None (inexistente ou fora do escopo)"""
+    where, params = fechamento_vendedor_where(cur, args, 'v.')
+    where, params = ['v.fechamento_id = ?'] + where, [fechamento_id] + params
+    fechamentos = read_fechamentos(cur, where, params)
+    if not fechamentos:
+        return None
+    cur.execute(f'''
+        SELECT * FROM fechamento_vendedores v WHERE {' AND '.join(where)} ORDER BY vendedor
+    ''', params)
+    fechamento = fechamentos[0]
+    fechamento['vendedores'] = serialize_rows(cur.fetchall(), FECHAMENTO_VENDEDOR_CAMPOS)
+    return fechamento
+
+@app.route('/api/fechamentos', methods=['POST'])
+@master_only
+def create_fechamento():
+    """Fecha o período: {"mes": "MM/AAAA"} ou {"pagamentoComissaoDe", "pagamentoComissaoAte"}.
+
+    201 com o fechamento criado; 200 com o último fechamento do mesmo período
+    quando não há mais comissões pendentes nele (repetir é seguro); 409 se não
+    há nada a fechar.
+    """
+    try:
+        inicio, fim = fechamento_periodo(request.get_json(silent=True) or {})
         
         conn = get_db_connection()
         if not conn:
             return jsonify({'error': 'Erro de conexão com banco'}), 500
         
-        cur = conn.cursor()
-        cur.execute('''
-            UPDATE parcelas 
-            SET recebida_pelo_cliente = ?, comissao_paga = ?
-            WHERE id = ?
-        ''', (
-            bool(data.get('recebidaPeloCliente', False)),
-            bool(data.get('comissaoPaga', False)),
-            parcela_id
-        ))
+        fechamento_id, criado = close_commission_period(conn, inicio, fim, g.usuario['email'])
+        if fechamento_id is None:
+            return jsonify({'error': 'Nenhuma comissão pendente no período'}), 409
+        return jsonify(read_fechamento(conn.cursor(), fechamento_id, {})), 201 if criado else 200
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return write_error_response(e)
+
+@app.route('/api/fechamentos', methods=['GET'])
+@conditional_get('fechamentos')
+def get_fechamentos():
+    """Fechamentos com os totais; vendedor e vendedorId restringem os totais aos extratos do vendedor"""
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Erro de conexão com banco'}), 500
         
-        conn.commit()
-        conn.close()
+        cur = conn.cursor()
+        where, params = fechamento_vendedor_where(cur, request.args, 'v.')
+        # Fechamentos cujo período cruza o informado
+        for param, coluna, operador in (
+            ('pagamentoComissaoDe', 'f.periodo_fim', '>='),
+            ('pagamentoComissaoAte', 'f.periodo_inicio', '<='),
+        ):
+            if request.args.get(param):
+                where.append(f'{coluna} {operador} ?')
+                params.append(parse_date_param(request.args[param], param))
+        return jsonify(read_fechamentos(cur, where, params))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/fechamentos/<int:fechamento_id>', methods=['GET'])
+@conditional_get('fechamentos')
+def get_fechamento(fechamento_id):
+    """Fechamento com o extrato (parcelas, valor, líquido e comissão) de cada vendedor"""
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({'error': 'Erro de conexão com banco'}), 500
         
-        return jsonify({'success': True})
+        fechamento = read_fechamento(conn.cursor(), fechamento_id, request.args)
+        if fechamento is None:
+            return jsonify({'error': 'Fechamento não encontrado'}), 404
+        return jsonify(fechamento)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/parcelas/<int:parcela_id>', methods=['DELETE'])
-def delete_parcela(parcela_id):
+def fechamento_parcelas_where(cur, fechamento_id, args):
+    """Condições das parcelas de um fechamento; None se ele não existe"""
+    cur.execute('SELECT 1 FROM fechamentos WHERE id = ?', (fechamento_id,))
+    if cur.fetchone() is None:
+        return None
+    where, params = fechamento_vendedor_where(cur, args)
+    return ['fechamento_id = ?'] + where, [fechamento_id] + params
+
+@app.route('/api/fechamentos/<int:fechamento_id>/parcelas', methods=['GET'])
+@conditional_get('fechamentos')
+def get_fechamento_parcelas(fechamento_id):
+    """Parcelas do fechamento por vendedor, paginadas"""
     try:
         conn = get_db_connection()
         if not conn:
             return jsonify({'error': 'Erro de conexão com banco'}), 500
         
         cur = conn.cursor()
-        cur.execute('DELETE FROM parcelas WHERE id = ?', (parcela_id,))
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'success': True})
+        filtros = fechamento_parcelas_where(cur, fechamento_id, request.args)
+        if filtros is None:
+            return jsonify({'error': 'Fechamento não encontrado'}), 404
+        rows, next_cursor = fetch_page(cur, 'fechamento_parcelas', *filtros, ['vendedor', 'parcela_id'])
+        return paginated_response(serialize_rows(rows, FECHAMENTO_PARCELA_CAMPOS), next_cursor)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Rota para estatísticas do dashboard
-@app.route('/api/dashboard/stats', methods=['GET'])
-def get_dashboard_stats():
+@app.route('/api/export/fechamentos/<int:fechamento_id>', methods=['GET'])
+def export_fechamento(fechamento_id):
+    """Parcelas do fechamento em CSV ou NDJSON, agrupadas por vendedor"""
+    try:
+        filtros = fechamento_parcelas_where(get_db_connection().cursor(), fechamento_id, request.args)
+        if filtros is None:
+            return jsonify({'error': 'Fechamento não encontrado'}), 404
+        return export_response(
+            f'fechamento-{fechamento_id}', 'fechamento_parcelas', *filtros, ['vendedor', 'parcela_id'],
+            FECHAMENTO_PARCELA_CAMPOS
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.cli.command('fechar-comissoes')
+@click.option('--mes', help='Mês do pagamento da comissão (MM/AAAA)')
+@click.option('--de', 'inicio', help='Pagamento da comissão a partir de (DD/MM/AAAA)')
+@click.option('--ate', 'fim', help='Pagamento da comissão até (DD/MM/AAAA)')
+def fechar_comissoes_command(mes, inicio, fim):
+    """Paga as comissões pendentes do período e grava o extrato por vendedor"""
+    periodo = fechamento_periodo({'mes': mes, 'pagamentoComissaoDe': inicio, 'pagamentoComissaoAte': fim})
+    conn = connect_db()
+    try:
+        fechamento_id, criado = close_commission_period(conn, *periodo, 'cli')
+        if fechamento_id is None:
+            click.echo('Nenhuma comissão pendente no período.')
+            return
+        fechamento = read_fechamento(conn.cursor(), fechamento_id, {})
+    finally:
+        conn.close()
+    click.echo(
+        f"Fechamento {fechamento['id']} ({'criado' if criado else 'já existente'}): "
+        f"{fechamento['totalParcelas']} parcela(s) de {fechamento['totalVendedores']} vendedor(es), "
+        f"comissão R$ {fechamento['comissao']:.2f}"
+    )
+
+# Feed de alterações em tempo real (Server-Sent Events)
+CHANGE_FEED_CAMPOS = {
+    'vendedores': VENDEDOR_CAMPOS,
+    'oportunidades': OPORTUNIDADE_CAMPOS,
+    'parcelas': PARCELA_CAMPOS,
+}
+
+def read_changes(cur, ultimo_id, vendedor_id=None):
+    """Próximo lote do changelog após ultimo_id: (eventos, último id lido).
+
+    Mantém só a alteração mais recente de cada registro no lote e busca os
+    valores atuais em uma consulta por tabela. Com `vendedor_id`, registros de
+    outros vendedores (comparados pelo id) chegam sem dados, para o cliente removê-los.
+    """
+    cur.execute(
+        'SELECT id, tabela, operacao, registro_id FROM alteracoes WHERE id > ? ORDER BY id LIMIT ?',
+        (ultimo_id, SSE_BATCH_SIZE)
+    )
+    linhas = cur.fetchall()
+    if not linhas:
+        return [], ultimo_id
+    
+    recentes = {}
+    for linha in linhas:
+        recentes[(linha['tabela'], linha['registro_id'])] = linha
+    
+    valores = {}
+    for tabela, campos in CHANGE_FEED_CAMPOS.items():
+        ids = [registro_id for (t, registro_id), linha in recentes.items()
+               if t == tabela and linha['operacao'] != 'delete']
+        if ids:
+            cur.execute(
+                f'SELECT * FROM {tabela} WHERE id IN (SELECT value FROM json_each(?))', (json.dumps(ids),)
+            )
+            rows = cur.fetchall()
+            for row, item in zip(rows, serialize_rows(rows, campos)):
+                valores[(tabela, row['id'])] = item
+    
+    eventos = []
+    for linha in sorted(recentes.values(), key=lambda l: l['id']):
+        chave = (linha['tabela'], linha['registro_id'])
+        dados = valores.get(chave)
+        # Registro removido depois desta alteração: o delete chega em um lote seguinte
+        if linha['operacao'] != 'delete' and dados is None:
+            continue
+        if vendedor_id is not None and dados is not None:
+            dono = dados['id'] if linha['tabela'] == 'vendedores' else dados['vendedorId']
+            if dono != str(vendedor_id):
+                dados = None
+        eventos.append((linha['id'], {
+            'tabela': linha['tabela'],
+            'operacao': linha['operacao'],
+            'id': str(linha['registro_id']),
+            'dados': dados
+        }))
+    return eventos, linhas[-1]['id']
+
+def format_sse(evento, dados, event_id=None):
+    """Mensagem no formato text/event-stream"""
+    mensagem = f'id: {event_id}\n' if event_id is not None else ''
+    return mensagem + f'event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n'
+
+# Conexões SSE abertas neste processo (limite SSE_MAX_STREAMS)
+_sse_streams = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+@app.route('/api/events', methods=['GET'])
+def change_events():
+    """Envia as alterações de vendedores, oportunidades e parcelas e os totais do dashboard.
+
+    Retoma a partir do Last-Event-ID (ou ?lastEventId=); se o id já saiu do
+    changelog, envia `reset` para o cliente recarregar tudo. Com SSE_MAX_STREAMS
+    conexões abertas responde 503 com Retry-After.
+    """
     try:
         conn = get_db_connection()
         if not conn:
             return jsonify({'error': 'Erro de conexão com banco'}), 500
         
         cur = conn.cursor()
+        cur.execute('SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM alteracoes')
+        minimo, maximo = cur.fetchone()
+        ultimo = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+        ultimo_id = parse_int_param(ultimo, 'Last-Event-ID') if ultimo else maximo
+        reset = bool(ultimo and minimo and ultimo_id < minimo - 1)
+        if reset or ultimo_id > maximo:
+            ultimo_id = maximo
+        vendedor_id = vendedor_escopo()
+        filtro = vendedor_filter(scoped_args({}), cur)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    if not _sse_streams.acquire(blocking=False):
+        response = jsonify({'error': 'Muitas conexões de atualização em tempo real, tente novamente'})
+        response.headers['Retry-After'] = str(SSE_RETRY_AFTER)
+        return response, 503
+    
+    def gerar():
+        nonlocal ultimo_id
+        cur = get_db_connection().cursor()
+        yield 'retry: 3000\n\n'
+        yield format_sse('reset' if reset else 'ready', {}, ultimo_id)
         
-        # Total de oportunidades
-        cur.execute('SELECT COUNT(*) as total FROM oportunidades')
-        total_oportunidades = cur.fetchone()['total']
-        
-        # Total de vendedores
-        cur.execute('SELECT COUNT(*) as total FROM vendedores')
-        total_vendedores = cur.fetchone()['total']
-        
-        # Total de parcelas
-        cur.execute('SELECT COUNT(*) as total FROM parcelas')
-        total_parcelas = cur.fetchone()['total']
-        
-        # Parcelas pagas
-        cur.execute('SELECT COUNT(*) as total FROM parcelas WHERE comissao_paga = 1')
-        parcelas_pagas = cur.fetchone()['total']
+        inicio = ultimo_envio = time.monotonic()
+        while time.monotonic() - inicio < SSE_MAX_DURATION:
+            eventos, ultimo_id_lido = read_changes(cur, ultimo_id, vendedor_id)
+            for event_id, evento in eventos:
+                yield format_sse('change', evento, event_id)
+            if ultimo_id_lido != ultimo_id:
+                ultimo_id = ultimo_id_lido
+                yield format_sse('dashboard', read_dashboard_stats(cur, filtro), ultimo_id)
+                ultimo_envio = time.monotonic()
+                continue
+            if time.monotonic() - ultimo_envio >= SSE_HEARTBEAT:
+                yield ': heartbeat\n\n'
+                ultimo_envio = time.monotonic()
+            time.sleep(SSE_POLL_INTERVAL)
+    
+    response = Response(stream_with_context(gerar()), mimetype='text/event-stream')
+    # Liberada quando o servidor fecha a resposta, mesmo que o stream nem tenha começado
+    response.call_on_close(_sse_streams.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Arquivamento de parcelas quitadas
+def archive_parcelas(horizonte_dias=None, lote=None):
+    """Move para arquivo.parcelas as parcelas quitadas anteriores ao horizonte.
+
+    Quitadas: recebidas pelo cliente e com comissão paga, com vencimento e
+    pagamento da comissão há mais de `horizonte_dias` dias. Cada lote é uma
+    transação: copia as linhas, soma a contribuição delas nos agregados do
+    arquivo e as apaga de parcelas (os triggers as tiram dos agregados quentes),
+    de modo que os totais do dashboard não mudam.
+    """
+    horizonte_dias = ARCHIVE_AFTER_DAYS if horizonte_dias is None else horizonte_dias
+    lote = lote or ARCHIVE_BATCH_SIZE
+    corte = (date.today() - timedelta(days=horizonte_dias)).isoformat()
+    condicao = '''
+        recebida_pelo_cliente = 1 AND comissao_paga = 1
+        AND vencimento < :corte AND pagamento_comissao < :corte
+    '''
+    selecao = 'SELECT value FROM json_each(:ids)'
+    
+    inicio = time.monotonic()
+    movidas = lotes = ultimo_id = 0
+    conn = connect_db()
+    try:
+        cur = conn.cursor()
+        colunas = ', '.join(row['name'] for row in cur.execute('PRAGMA main.table_info(parcelas)').fetchall())
+        while True:
+            # Candidatas lidas fora da transação de escrita; conferidas de novo dentro dela
+            cur.execute(
+                f'SELECT id FROM parcelas WHERE id > :ultimo AND {condicao} ORDER BY id LIMIT :lote',
+                {'ultimo': ultimo_id, 'corte': corte, 'lote': lote}
+            )
+            candidatas = [row[0] for row in cur.fetchall()]
+            if not candidatas:
+                break
+            ultimo_id = candidatas[-1]
+            
+            cur.execute('BEGIN IMMEDIATE')
+            cur.execute(
+                f'SELECT id FROM parcelas WHERE id IN ({selecao}) AND {condicao}',
+                {'ids': json.dumps(candidatas), 'corte': corte}
+            )
+            ids = {'ids': json.dumps([row[0] for row in cur.fetchall()])}
+            cur.execute(
+                f'INSERT OR REPLACE INTO arquivo.parcelas ({colunas}) '
+                f'SELECT {colunas} FROM parcelas WHERE id IN ({selecao})', ids
+            )
+            movidas_lote = cur.rowcount
+            for passo in _arquivo_agregados_sql(f'FROM parcelas p WHERE p.id IN ({selecao})', ''):
+                cur.execute(passo, ids)
+            # Parcelas fechadas também são movidas: o trigger da migração 13 as libera neste lote
+            cur.execute('INSERT INTO arquivamento_em_curso (lote) VALUES (?)', (lotes,))
+            cur.execute(f'DELETE FROM parcelas WHERE id IN ({selecao})', ids)
+            cur.execute('DELETE FROM arquivamento_em_curso')
+            conn.commit()
+            movidas += movidas_lote
+            lotes += 1
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    return {
+        'corte': format_date_br(corte),
+        'movidas': movidas,
+        'lotes': lotes,
+        'duracaoSegundos': round(time.monotonic() - inicio, 3),
+    }
+
+def delete_archived_parcelas(cur, oportunidade_id):
+    """Apaga as parcelas arquivadas da oportunidade e as tira dos agregados do arquivo (sem commit).
+
+    O trigger de parcelas fechadas não alcança o banco anexado; a mesma regra é
+    conferida aqui.
+    """
+    parametros = {'oportunidade_id': oportunidade_id}
+    cur.execute('''
+        SELECT 1 FROM arquivo.parcelas p JOIN fechamento_parcelas f ON f.parcela_id = p.id
+        WHERE p.oportunidade_id = :oportunidade_id LIMIT 1
+    ''', parametros)
+    if cur.fetchone():
+        raise sqlite3.IntegrityError(PARCELA_FECHADA_EXCLUSAO_ERRO)
+    for passo in _arquivo_agregados_sql('FROM arquivo.parcelas p WHERE p.oportunidade_id = :oportunidade_id', '-'):
+        cur.execute(passo, parametros)
+    cur.execute('DELETE FROM arquivo.parcelas WHERE oportunidade_id = :oportunidade_id', parametros)
+
+@app.cli.command('arquivar')
+@click.option('--horizonte-dias', type=int, help='Idade mínima em dias (padrão: ARCHIVE_AFTER_DAYS)')
+@click.option('--lote', type=int, help='Parcelas por transação (padrão: ARCHIVE_BATCH_SIZE)')
+def arquivar_command(horizonte_dias, lote):
+    """Move as parcelas quitadas antigas para o banco de arquivo"""
+    resultado = archive_parcelas(horizonte_dias, lote)
+    click.echo(
+        f"{resultado['movidas']} parcela(s) anteriores a {resultado['corte']} arquivadas "
+        f"em {resultado['lotes']} lote(s), {resultado['duracaoSegundos']}s"
+    )
+
+# Backups e manutenção
+def backup_files(diretorio):
+    """Backups existentes em `diretorio`, do mais recente para o mais antigo"""
+    prefixo = os.path.splitext(os.path.basename(DATABASE_PATH))[0] + '-'
+    try:
+        nomes = [
+            nome for nome in os.listdir(diretorio)
+            if nome.startswith(prefixo) and nome.endswith('.db') and not nome.endswith('-arquivo.db')
+        ]
+    except FileNotFoundError:
+        return []
+    return sorted((os.path.join(diretorio, nome) for nome in nomes), reverse=True)
+
+def archive_backup_path(caminho):
+    """Backup do banco de arquivo que acompanha o backup `caminho`"""
+    return caminho[:-len('.db')] + '-arquivo.db'
+
+def backup_database(diretorio=None, paginas=None, pausa=None, manter=None):
+    """Backup online em `diretorio`/<banco>-AAAAMMDD-HHMMSS.db, verificado com integrity_check.
+
+    A cópia lê um snapshot fixo (transação de leitura aberta durante todo o
+    backup): no modo WAL os escritores não esperam e a cópia não recomeça a
+    cada escrita. `paginas` por passo e `pausa` (s) entre passos limitam o I/O.
+    O banco de parcelas arquivadas vai do mesmo snapshot para
+    <banco>-AAAAMMDD-HHMMSS-arquivo.db. Mantém os `manter` backups mais recentes.
+    """
+    diretorio = diretorio or BACKUP_DIR
+    paginas = paginas or BACKUP_PAGES_PER_STEP
+    pausa = BACKUP_STEP_PAUSE / 1000 if pausa is None else pausa
+    manter = BACKUP_KEEP if manter is None else manter
+    os.makedirs(diretorio, exist_ok=True)
+    
+    base = os.path.splitext(os.path.basename(DATABASE_PATH))[0]
+    caminho = os.path.join(diretorio, f"{base}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db")
+    destinos = {'main': caminho, 'arquivo': archive_backup_path(caminho)}
+    passos = 0
+    
+    def progresso(status, restantes, total):
+        nonlocal passos
+        passos += 1
+        if restantes and pausa:
+            time.sleep(pausa)
+    
+    inicio = time.monotonic()
+    origem = connect_db()
+    try:
+        origem.isolation_level = None
+        origem.execute('BEGIN')
+        for schema in destinos:
+            origem.execute(f'SELECT COUNT(*) FROM {schema}.sqlite_master').fetchone()
+        for schema, destino_caminho in destinos.items():
+            destino = sqlite3.connect(destino_caminho + '.parcial')
+            try:
+                origem.backup(destino, pages=paginas, progress=progresso, name=schema)
+            finally:
+                destino.close()
+        origem.execute('COMMIT')
+        duracao_copia = time.monotonic() - inicio
         
-        # Valor total de comissões
-        cur.execute('SELECT SUM(comissao) as total FROM parcelas')
-        total_comissoes = cur.fetchone()['total'] or 0
+        for destino_caminho in destinos.values():
+            destino = sqlite3.connect(destino_caminho + '.parcial')
+            try:
+                integridade = destino.execute('PRAGMA integrity_check').fetchone()[0]
+            finally:
+                destino.close()
+            if integridade != 'ok':
+                raise RuntimeError(f'Backup falhou no integrity_check ({os.path.basename(destino_caminho)}): {integridade}')
+    except Exception:
+        for destino_caminho in destinos.values():
+            if os.path.exists(destino_caminho + '.parcial'):
+                os.remove(destino_caminho + '.parcial')
+        raise
+    finally:
+        origem.close()
+    for destino_caminho in destinos.values():
+        os.replace(destino_caminho + '.parcial', destino_caminho)
+    
+    removidos = backup_files(diretorio)[manter:] if manter > 0 else []
+    for antigo in removidos:
+        os.remove(antigo)
+        if os.path.exists(archive_backup_path(antigo)):
+            os.remove(archive_backup_path(antigo))
+    
+    return {
+        'arquivo': caminho,
+        'tamanhoBytes': os.path.getsize(caminho),
+        'arquivoTamanhoBytes': os.path.getsize(destinos['arquivo']),
+        'passos': passos,
+        'duracaoCopiaSegundos': round(duracao_copia, 3),
+        'duracaoSegundos': round(time.monotonic() - inicio, 3),
+        'removidos': [os.path.basename(antigo) for antigo in removidos],
+    }
+
+def run_maintenance(checkpoint='PASSIVE', vacuum_paginas=None):
+    """ANALYZE, PRAGMA optimize, VACUUM incremental e checkpoint do WAL.
+
+    O checkpoint PASSIVE não espera leitores nem bloqueia escritores. O VACUUM
+    incremental só atua com auto_vacuum=INCREMENTAL (veja `flask manutencao
+    --vacuum-completo`).
+    """
+    if checkpoint not in ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'):
+        raise ValueError('checkpoint deve ser PASSIVE, FULL, RESTART ou TRUNCATE')
+    vacuum_paginas = MAINTENANCE_VACUUM_PAGES if vacuum_paginas is None else vacuum_paginas
+    resultado = {}
+    inicio = time.monotonic()
+    conn = connect_db()
+    try:
+        conn.isolation_level = None
+        # ANALYZE completo (com analysis_limit as estatísticas de colunas de poucos
+        # valores, como comissao_paga, saem distorcidas e o planejador erra o
+        # índice), um índice por vez: cada um segura o lock de escrita pouco tempo
+        indices = [
+            f'{schema}."{row[0]}"'
+            for schema in ('main', 'arquivo')
+            for row in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'index'").fetchall()
+        ]
+        for indice in indices:
+            conn.execute(f'ANALYZE {indice}')
+            time.sleep(0.1)  # brecha para os escritores que esperam o lock
+        conn.execute('PRAGMA optimize')
         
-        # Comissões pagas
-        cur.execute('SELECT SUM(comissao) as total FROM parcelas WHERE comissao_paga = 1')
-        comissoes_pagas = cur.fetchone()['total'] or 0
+        livres = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            # executescript roda o PRAGMA até o fim (execute libera uma página por passo)
+            conn.executescript(f'PRAGMA incremental_vacuum({vacuum_paginas})')
+            liberadas = livres - conn.execute('PRAGMA freelist_count').fetchone()[0]
+            resultado['vacuum'] = {'paginasLivres': livres, 'paginasLiberadas': liberadas}
+        else:
+            resultado['vacuum'] = {'paginasLivres': livres, 'paginasLiberadas': 0, 'ignorado': 'auto_vacuum != INCREMENTAL'}
         
+        # Por último, para levar ao arquivo principal também as páginas do VACUUM
+        ocupado, paginas_wal, copiadas = conn.execute(f'PRAGMA wal_checkpoint({checkpoint})').fetchone()
+        resultado['checkpoint'] = {
+            'modo': checkpoint, 'ocupado': bool(ocupado), 'paginasWal': paginas_wal, 'paginasCopiadas': copiadas
+        }
+    finally:
         conn.close()
-        
-        return jsonify({
-            'totalOportunidades': total_oportunidades,
-            'totalVendedores': total_vendedores,
-            'totalParcelas': total_parcelas,
-            'parcelasPagas': parcelas_pagas,
-            'totalComissoes': round(total_comissoes, 2),
-            'comissoesPagas': round(comissoes_pagas, 2),
-            'comissoesPendentes': round(total_comissoes - comissoes_pagas, 2)
+    resultado['duracaoSegundos'] = round(time.monotonic() - inicio, 3)
+    return resultado
+
+def convert_incremental_vacuum():
+    """Ativa auto_vacuum=INCREMENTAL com um VACUUM completo (bloqueia escritas até terminar)"""
+    conn = connect_db()
+    try:
+        conn.isolation_level = None
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+
+class MaintenanceScheduler:
+    """Executa backup e manutenção, agendados ou sob demanda, um de cada vez.
+
+    Entre processos (vários workers), um lock de arquivo em BACKUP_DIR evita
+    execuções simultâneas. O último resultado de cada tarefa fica em `status`.
+    """
+    TAREFAS = {
+        'backup': (backup_database, BACKUP_INTERVAL_HOURS),
+        'manutencao': (run_maintenance, MAINTENANCE_INTERVAL_HOURS),
+        'arquivamento': (archive_parcelas, ARCHIVE_INTERVAL_HOURS),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.status = {tarefa: None for tarefa in self.TAREFAS}
+        self.em_execucao = None
+        self.pid = None
+
+    def _marcador(self, tarefa):
+        return os.path.join(BACKUP_DIR, f'.ultima-{tarefa}')
+
+    def executar(self, tarefa):
+        """Roda a tarefa agora; devolve o resultado ou None se outra estiver em execução"""
+        funcao, _ = self.TAREFAS[tarefa]
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            os.makedirs(BACKUP_DIR, exist_ok=True)
+            with open(os.path.join(BACKUP_DIR, '.manutencao.lock'), 'w') as trava:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        return None
+                self.em_execucao = tarefa
+                inicio = datetime.now().isoformat(timespec='seconds')
+                try:
+                    resultado = {'inicio': inicio, 'sucesso': True, **funcao()}
+                except Exception as e:
+                    resultado = {'inicio': inicio, 'sucesso': False, 'erro': str(e)}
+                    app.logger.error(f'Falha em {tarefa}: {e}')
+                with open(self._marcador(tarefa), 'w') as marcador:
+                    json.dump(resultado, marcador)
+                self.status[tarefa] = resultado
+                return resultado
+        finally:
+            self.em_execucao = None
+            self.lock.release()
+
+    def em_segundo_plano(self, tarefa):
+        """Dispara a tarefa em uma thread; False se já houver uma em execução"""
+        if self.lock.locked():
+            return False
+        threading.Thread(target=self.executar, args=(tarefa,), name=f'manutencao-{tarefa}', daemon=True).start()
+        return True
+
+    def pendentes(self):
+        """Tarefas agendadas cujo intervalo já passou desde a última execução (de qualquer processo)"""
+        agora = time.time()
+        vencidas = []
+        for tarefa, (_, intervalo) in self.TAREFAS.items():
+            if intervalo <= 0:
+                continue
+            try:
+                ultima = os.path.getmtime(self._marcador(tarefa))
+            except OSError:
+                ultima = 0
+            if agora - ultima >= intervalo * 3600:
+                vencidas.append(tarefa)
+        return vencidas
+
+    def iniciar(self):
+        """Inicia a thread de agendamento (uma por processo)"""
+        if self.pid == os.getpid():
+            return
+        self.pid = os.getpid()
+        if all(intervalo <= 0 for _, intervalo in self.TAREFAS.values()):
+            return
+        threading.Thread(target=self._agendar, name='manutencao-agendada', daemon=True).start()
+
+    def _agendar(self):
+        while True:
+            for tarefa in self.pendentes():
+                self.executar(tarefa)
+            time.sleep(60)
+
+maintenance = MaintenanceScheduler()
+
+@app.before_request
+def start_maintenance_scheduler():
+    maintenance.iniciar()
+
+@app.cli.command('backup')
+@click.option('--diretorio', help='Destino (padrão: BACKUP_DIR)')
+@click.option('--paginas', type=int, help='Páginas copiadas por passo')
+@click.option('--manter', type=int, help='Quantidade de backups mantidos')
+def backup_command(diretorio, paginas, manter):
+    """Backup online do banco, verificado com integrity_check"""
+    resultado = backup_database(diretorio, paginas, manter=manter)
+    click.echo(
+        f"{resultado['arquivo']}: {resultado['tamanhoBytes'] / 1024 / 1024:.1f} MiB em "
+        f"{resultado['duracaoSegundos']}s ({resultado['passos']} passos)"
+    )
+    for nome in resultado['removidos']:
+        click.echo(f'Removido: {nome}')
+
+@app.cli.command('manutencao')
+@click.option('--checkpoint', default='PASSIVE', type=click.Choice(['PASSIVE', 'FULL', 'RESTART', 'TRUNCATE']))
+@click.option('--vacuum-completo', is_flag=True, help='Ativa auto_vacuum=INCREMENTAL com VACUUM (bloqueia escritas)')
+def manutencao_command(checkpoint, vacuum_completo):
+    """ANALYZE, PRAGMA optimize, VACUUM incremental e checkpoint do WAL"""
+    if vacuum_completo:
+        convert_incremental_vacuum()
+        click.echo('auto_vacuum=INCREMENTAL ativado.')
+    click.echo(json.dumps(run_maintenance(checkpoint), ensure_ascii=False, indent=2))
+
+@app.route('/api/admin/manutencao', methods=['GET'])
+@master_only
+def get_manutencao():
+    """Backups existentes e o último resultado de cada tarefa"""
+    backups = []
+    for caminho in backup_files(BACKUP_DIR):
+        backups.append({
+            'arquivo': os.path.basename(caminho),
+            'tamanhoBytes': os.path.getsize(caminho),
+            'arquivoTamanhoBytes': (
+                os.path.getsize(archive_backup_path(caminho)) if os.path.exists(archive_backup_path(caminho)) else None
+            ),
+            'data': datetime.fromtimestamp(os.path.getmtime(caminho)).strftime('%d/%m/%Y %H:%M')
         })
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return jsonify({
+        'emExecucao': maintenance.em_execucao,
+        'ultimos': maintenance.status,
+        'backups': backups
+    })
+
+@app.route('/api/admin/manutencao', methods=['POST'])
+@master_only
+def post_manutencao():
+    """Dispara uma tarefa em segundo plano: {"tarefa": "backup" | "manutencao" | "arquivamento"}"""
+    tarefa = (request.get_json(silent=True) or {}).get('tarefa')
+    if tarefa not in MaintenanceScheduler.TAREFAS:
+        return jsonify({'error': 'tarefa deve ser backup, manutencao ou arquivamento'}), 400
+    if not maintenance.em_segundo_plano(tarefa):
+        return jsonify({'error': 'Já existe uma tarefa de manutenção em execução'}), 409
+    return jsonify({'success': True, 'tarefa': tarefa}), 202
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas do processo no formato de exposição do Prometheus"""
+    if not METRICS_ENABLED:
+        return jsonify({'error': 'Métricas desativadas'}), 404
+    with _metrics_lock:
+        linhas = [linha for metrica in METRICAS for linha in metrica.render()]
+    return Response('\n'.join(linhas) + '\n', mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
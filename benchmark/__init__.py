@@ -0,0 +1,5 @@
+"""Benchmarks reprodutíveis do sistema de comissões.
+
+- `python -m benchmark.gerador`: cria um banco sintético com volumes realistas
+- `python -m benchmark.executor`: mede as rotas e compara com um baseline
+"""
@@ -0,0 +1,120 @@
+"""Duração do backup online e impacto na latência de escrita.
+
+Um escritor grava uma parcela a cada --intervalo ms (UPDATE + commit, com os
+triggers do app) enquanto mede a latência de cada commit: primeiro sem nada
+rodando (base), depois durante backup_database() e durante run_maintenance().
+O backup vai para um diretório temporário e é descartado.
+
+Uso:
+    python -m benchmark.backup --banco benchmark/dados/comissoes.db
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from benchmark.executor import resumir
+from benchmark.gerador import BANCO_PADRAO, carregar_app
+
+class Escritor(threading.Thread):
+    """Grava continuamente, guardando a latência de cada commit por fase"""
+
+    def __init__(self, app, intervalo, semente):
+        super().__init__(daemon=True)
+        self.app = app
+        conn = app.connect_db()
+        self.ids = [linha[0] for linha in conn.execute('SELECT id FROM parcelas')]
+        conn.close()
+        self.intervalo = intervalo
+        self.rng = random.Random(semente)
+        self.fase = None
+        self.latencias = {}
+        self.erros = {}
+        self.parar = threading.Event()
+
+    def run(self):
+        conn = self.app.connect_db()
+        while not self.parar.is_set():
+            fase = self.fase
+            inicio = time.perf_counter()
+            try:
+                conn.execute(
+                    'UPDATE parcelas SET comissao_paga = 1 - comissao_paga WHERE id = ?',
+                    (self.rng.choice(self.ids),)
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                self.erros[fase] = self.erros.get(fase, 0) + 1
+            decorrido = time.perf_counter() - inicio
+            if fase:
+                self.latencias.setdefault(fase, []).append(decorrido)
+            self.parar.wait(max(0.0, self.intervalo - decorrido))
+        conn.close()
+
+    def medir(self, fase, tarefa):
+        """Executa `tarefa` com o escritor na fase `fase`; devolve (resultado, duração)"""
+        self.fase = fase
+        inicio = time.perf_counter()
+        resultado = tarefa()
+        duracao = time.perf_counter() - inicio
+        self.fase = None
+        return resultado, duracao
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Mede o backup online e seu impacto nas escritas')
+    parser.add_argument('--banco', default=BANCO_PADRAO, help='Banco gerado por benchmark.gerador')
+    parser.add_argument('--paginas', type=int, help='Páginas por passo do backup (padrão: BACKUP_PAGES_PER_STEP)')
+    parser.add_argument('--pausa', type=float, help='Pausa entre passos, em ms (padrão: BACKUP_STEP_PAUSE)')
+    parser.add_argument('--intervalo', type=float, default=5, help='Intervalo entre escritas, em ms')
+    parser.add_argument('--base', type=float, default=10, help='Segundos de medição sem backup')
+    parser.add_argument('--sem-manutencao', action='store_true', help='Não mede run_maintenance()')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--salvar', help='Grava os resultados em JSON')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.banco):
+        parser.error(f'{args.banco} não existe: gere-o com python -m benchmark.gerador')
+
+    app = carregar_app(args.banco)
+    tamanho_mb = os.path.getsize(args.banco) / 1024 / 1024
+    escritor = Escritor(app, args.intervalo / 1000, args.semente)
+    escritor.start()
+    fases = {}
+    with tempfile.TemporaryDirectory() as diretorio:
+        _, fases['base'] = escritor.medir('base', lambda: time.sleep(args.base))
+        pausa = None if args.pausa is None else args.pausa / 1000
+        backup, fases['backup'] = escritor.medir(
+            'backup', lambda: app.backup_database(diretorio, args.paginas, pausa, manter=1)
+        )
+        if not args.sem_manutencao:
+            _, fases['manutencao'] = escritor.medir('manutencao', app.run_maintenance)
+    escritor.parar.set()
+    escritor.join()
+
+    print(f"Banco: {args.banco} ({tamanho_mb:.0f} MiB)")
+    print(f"Backup: {backup['duracaoSegundos']:.1f}s ({backup['duracaoCopiaSegundos']:.1f}s de cópia, "
+          f"{backup['passos']} passos, {tamanho_mb / backup['duracaoSegundos']:.0f} MiB/s com integrity_check)")
+    print(f"{'fase':11} {'duração s':>9} {'escritas':>8} {'erros':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'máx ms':>8}")
+    resultados = []
+    for fase, duracao in fases.items():
+        latencias = escritor.latencias.get(fase, [])
+        r = resumir(latencias, duracao, escritor.erros.get(fase, 0))
+        r['max_ms'] = round(max(latencias, default=0) * 1000, 3)
+        resultados.append({'fase': fase, 'duracao_s': round(duracao, 3), **r})
+        print(f"{fase:11} {duracao:>9.1f} {r['requisicoes']:>8} {r['erros']:>6} {r['p50_ms']:>8.2f} "
+              f"{r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['max_ms']:>8.2f}")
+
+    if args.salvar:
+        with open(args.salvar, 'w') as arquivo:
+            json.dump({'banco_mib': round(tamanho_mb, 1), 'backup': backup, 'fases': resultados},
+                      arquivo, indent=2, ensure_ascii=False)
+        print(f'Resultados gravados em {args.salvar}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""Vazão de escrita com e sem a fila de escrita (WRITE_QUEUE_ENABLED).
+
+Para cada modo e quantidade de clientes concorrentes, inicia um gunicorn sobre
+uma cópia nova do banco e dispara --requisicoes escritas, alternando
+POST /api/parcelas e PUT /api/parcelas/<id>. Respostas 503 (banco ocupado) e
+500 contam como erro.
+
+Uso:
+    python -m benchmark.escritas --banco benchmark/dados/comissoes.db --clientes 1 8 32
+"""
+import argparse
+import http.client
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmark.executor import Contexto, iniciar_gunicorn, login_http, porta_livre, resumir
+from benchmark.gerador import BANCO_PADRAO
+
+MODOS = {
+    'direto': {'WRITE_QUEUE_ENABLED': '0'},
+    'fila': {'WRITE_QUEUE_ENABLED': '1'},
+}
+
+def escrita(ctx, i):
+    """(método, url, corpo) da i-ésima escrita"""
+    if i % 2 == 0:
+        return 'POST', '/api/parcelas', {
+            'cliente': 'Cliente Benchmark', 'vendedor': ctx.escolher(ctx.vendedores), 'numero': '1',
+            'valor': 150.0, 'vencimento': '10/01/2025', 'pagamentoComissao': '10/02/2025'
+        }
+    return 'PUT', f'/api/parcelas/{ctx.escolher(ctx.parcelas)}', {'comissaoPaga': i % 4 == 1}
+
+def medir(banco_origem, modo, clientes, requisicoes, workers, threads, semente):
+    with tempfile.TemporaryDirectory() as diretorio:
+        banco = os.path.join(diretorio, 'comissoes.db')
+        shutil.copyfile(banco_origem, banco)
+        ctx = Contexto(banco, semente)
+        porta = porta_livre()
+        processo = iniciar_gunicorn(banco, porta, workers, threads, MODOS[modo])
+        try:
+            token = login_http(porta, {'email': 'thiago@objetivasolucao.com.br', 'senha': 'vendas123'})
+            headers = {'Authorization': f'Bearer {token}', 'Content-Type': 'application/json'}
+            locais = threading.local()
+            status = Counter()
+
+            def chamar(i):
+                if not hasattr(locais, 'conexao'):
+                    locais.conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=60)
+                metodo, url, corpo = escrita(ctx, i)
+                inicio = time.perf_counter()
+                try:
+                    locais.conexao.request(metodo, url, body=json.dumps(corpo).encode(), headers=headers)
+                    resposta = locais.conexao.getresponse()
+                    resposta.read()
+                    codigo = resposta.status
+                except (OSError, http.client.HTTPException):
+                    locais.conexao.close()
+                    del locais.conexao
+                    codigo = 'conexão'
+                status[codigo] += 1
+                return time.perf_counter() - inicio, codigo in (200, 201)
+
+            with ThreadPoolExecutor(max_workers=clientes) as executor:
+                inicio = time.perf_counter()
+                medidas = list(executor.map(chamar, range(requisicoes)))
+                duracao = time.perf_counter() - inicio
+        finally:
+            processo.terminate()
+            processo.wait(timeout=30)
+    resultado = resumir([decorrido for decorrido, _ in medidas], duracao, sum(not ok for _, ok in medidas))
+    resultado['status'] = {str(codigo): quantidade for codigo, quantidade in sorted(status.items(), key=str)}
+    return resultado
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Mede a vazão de escrita com e sem a fila de escrita')
+    parser.add_argument('--banco', default=BANCO_PADRAO, help='Banco gerado por benchmark.gerador')
+    parser.add_argument('--clientes', type=int, nargs='+', default=[1, 8, 32], help='Clientes concorrentes')
+    parser.add_argument('--requisicoes', type=int, default=2000, help='Escritas por rodada')
+    parser.add_argument('--modo', choices=sorted(MODOS), action='append', help='Padrão: direto e fila')
+    parser.add_argument('--workers', type=int, default=1, help='Workers do gunicorn')
+    parser.add_argument('--threads', type=int, default=32, help='Threads por worker do gunicorn')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--salvar', help='Grava os resultados em JSON')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.banco):
+        parser.error(f'{args.banco} não existe: gere-o com python -m benchmark.gerador')
+
+    resultados = []
+    print(f"{'modo':8} {'clientes':>8} {'req':>6} {'erros':>6} {'p50 ms':>9} {'p95 ms':>9} {'req/s':>9}  status")
+    for modo in args.modo or ['direto', 'fila']:
+        for clientes in args.clientes:
+            r = medir(args.banco, modo, clientes, args.requisicoes, args.workers, args.threads, args.semente)
+            resultados.append({'modo': modo, 'clientes': clientes, **r})
+            print(f"{modo:8} {clientes:>8} {r['requisicoes']:>6} {r['erros']:>6} {r['p50_ms']:>9.2f} "
+                  f"{r['p95_ms']:>9.2f} {r['vazao_rps']:>9.1f}  {r['status']}")
+
+    if args.salvar:
+        with open(args.salvar, 'w') as arquivo:
+            json.dump({'workers': args.workers, 'threads': args.threads, 'resultados': resultados},
+                      arquivo, indent=2, ensure_ascii=False)
+        print(f'Resultados gravados em {args.salvar}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,376 @@
+"""Executor dos benchmarks: latência (p50/p95/p99), vazão e pico de memória.
+
+Cada cenário chama uma rota da API. Por padrão os cenários rodam em processo
+pelo test client do Flask; com --gunicorn um servidor real é iniciado e
+--clientes threads disparam as requisições em paralelo.
+
+O banco informado é copiado para um diretório temporário antes da execução,
+então as escritas dos cenários não alteram o banco gerado e as rodadas são
+comparáveis entre si.
+
+Uso:
+    python -m benchmark.executor --banco benchmark/dados/comissoes.db --salvar-baseline baseline.json
+    python -m benchmark.executor --banco benchmark/dados/comissoes.db --baseline baseline.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from benchmark.gerador import BANCO_PADRAO
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EMAIL_MASTER = 'thiago@objetivasolucao.com.br'
+
+class Cenario:
+    """Uma rota medida: método, URL e corpo são gerados a cada chamada.
+
+    `usuario` escolhe o token de sessão enviado ('master', 'vendedor' ou None).
+    """
+
+    def __init__(self, nome, metodo, url, corpo=None, status=(200,), usuario='master'):
+        self.nome = nome
+        self.metodo = metodo
+        self.url = url
+        self.corpo = corpo
+        self.status = status
+        self.usuario = usuario
+
+class Contexto:
+    """Estado compartilhado entre os cenários (amostras do banco e ids criados)"""
+
+    def __init__(self, banco, semente):
+        self.rng = random.Random(semente)
+        self.lock = threading.Lock()
+        self.criadas = []
+        self.tokens = {}
+        conn = sqlite3.connect(banco)
+        try:
+            self.vendedores = [row[0] for row in conn.execute('SELECT nome FROM vendedores')]
+            self.vendedor_ids = [row[0] for row in conn.execute('SELECT id FROM vendedores')]
+            self.emails = [row[0] for row in conn.execute('SELECT email FROM vendedores')]
+            self.parcelas = [row[0] for row in conn.execute('SELECT id FROM parcelas ORDER BY random() LIMIT 1000')]
+        finally:
+            conn.close()
+        if not self.vendedores or not self.parcelas:
+            raise SystemExit('Banco sem dados: gere-o com python -m benchmark.gerador')
+
+    def autenticar(self, login):
+        """Obtém os tokens dos cenários; login(corpo) devolve o token da resposta"""
+        # O primeiro vendedor é o de maior volume (distribuição Zipf do gerador)
+        self.tokens = {
+            'master': login({'email': EMAIL_MASTER, 'senha': 'vendas123'}),
+            'vendedor': login({'email': self.emails[0], 'senha': 'vendas123'}),
+        }
+
+    def cabecalhos(self, cenario):
+        token = self.tokens.get(cenario.usuario)
+        return {'Authorization': f'Bearer {token}'} if token else {}
+
+    def escolher(self, valores):
+        with self.lock:
+            return self.rng.choice(valores)
+
+    def registrar_criada(self, resposta):
+        with self.lock:
+            self.criadas.append(resposta['id'])
+
+    def proxima_criada(self):
+        with self.lock:
+            return self.criadas.pop() if self.criadas else None
+
+def cenarios_padrao():
+    """Rotas medidas, na ordem de execução (criações antes de alterar/excluir)"""
+    return [
+        Cenario('login master', 'POST', lambda ctx: '/api/login', lambda ctx: {
+            'email': EMAIL_MASTER, 'senha': 'vendas123'
+        }, usuario=None),
+        Cenario('login vendedor', 'POST', lambda ctx: '/api/login', lambda ctx: {
+            'email': ctx.escolher(ctx.emails), 'senha': 'vendas123'
+        }, usuario=None),
+        Cenario('listar vendedores', 'GET', lambda ctx: '/api/vendedores'),
+        Cenario('listar oportunidades', 'GET', lambda ctx: '/api/oportunidades'),
+        Cenario('listar parcelas', 'GET', lambda ctx: '/api/parcelas'),
+        Cenario('listar parcelas do vendedor', 'GET',
+                lambda ctx: f"/api/parcelas?vendedor={quote(ctx.escolher(ctx.vendedores))}"),
+        Cenario('listar parcelas por vendedorId', 'GET',
+                lambda ctx: f"/api/parcelas?vendedorId={ctx.escolher(ctx.vendedor_ids)}"),
+        Cenario('listar parcelas como vendedor', 'GET', lambda ctx: '/api/parcelas', usuario='vendedor'),
+        Cenario('dashboard stats como vendedor', 'GET', lambda ctx: '/api/dashboard/stats', usuario='vendedor'),
+        Cenario('dashboard stats', 'GET', lambda ctx: '/api/dashboard/stats'),
+        Cenario('dashboard vendedores', 'GET', lambda ctx: '/api/dashboard/vendedores'),
+        Cenario('criar parcela', 'POST', lambda ctx: '/api/parcelas', lambda ctx: {
+            'cliente': 'Cliente Benchmark', 'vendedor': ctx.escolher(ctx.vendedores), 'numero': '1',
+            'valor': round(ctx.rng.uniform(100, 2000), 2), 'vencimento': '10/01/2025',
+            'pagamentoComissao': '10/02/2025'
+        }, status=(201,)),
+        Cenario('atualizar parcela', 'PUT', lambda ctx: f'/api/parcelas/{ctx.escolher(ctx.parcelas)}',
+                lambda ctx: {'comissaoPaga': ctx.rng.random() < 0.5}),
+        Cenario('excluir parcela', 'DELETE', lambda ctx: f'/api/parcelas/{ctx.proxima_criada()}'),
+    ]
+
+def percentil(valores, p):
+    """Percentil por interpolação linear (valores ordenados)"""
+    if not valores:
+        return 0.0
+    posicao = (len(valores) - 1) * p / 100
+    inferior = int(posicao)
+    superior = min(inferior + 1, len(valores) - 1)
+    return valores[inferior] + (valores[superior] - valores[inferior]) * (posicao - inferior)
+
+def resumir(latencias, duracao, erros):
+    latencias = sorted(latencias)
+    return {
+        'requisicoes': len(latencias),
+        'erros': erros,
+        'p50_ms': round(percentil(latencias, 50) * 1000, 3),
+        'p95_ms': round(percentil(latencias, 95) * 1000, 3),
+        'p99_ms': round(percentil(latencias, 99) * 1000, 3),
+        'vazao_rps': round(len(latencias) / duracao, 1) if duracao else 0.0,
+    }
+
+def pico_rss_kib(pids):
+    """Soma do VmHWM (pico de RSS) dos processos, em KiB; None fora do Linux"""
+    total = 0
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as status:
+                for linha in status:
+                    if linha.startswith('VmHWM:'):
+                        total += int(linha.split()[1])
+        except OSError:
+            return None
+    return total
+
+# Execução em processo (test client do Flask)
+def executar_test_client(banco, cenarios, ctx, iteracoes, aquecimento):
+    os.environ['DATABASE_PATH'] = banco
+    sys.path.insert(0, RAIZ)
+    import app
+    cliente = app.app.test_client()
+    ctx.autenticar(lambda corpo: cliente.post('/api/login', json=corpo).get_json()['token'])
+
+    def chamar(cenario):
+        corpo = cenario.corpo(ctx) if cenario.corpo else None
+        inicio = time.perf_counter()
+        resposta = cliente.open(cenario.url(ctx), method=cenario.metodo, json=corpo, headers=ctx.cabecalhos(cenario))
+        decorrido = time.perf_counter() - inicio
+        if cenario.nome == 'criar parcela' and resposta.status_code == 201:
+            ctx.registrar_criada(resposta.get_json())
+        return decorrido, resposta.status_code in cenario.status
+
+    resultados = {}
+    for cenario in cenarios:
+        for _ in range(aquecimento if cenario.metodo == 'GET' else 0):
+            chamar(cenario)
+        latencias, erros = [], 0
+        inicio = time.perf_counter()
+        for _ in range(iteracoes):
+            decorrido, ok = chamar(cenario)
+            latencias.append(decorrido)
+            erros += not ok
+        resultados[cenario.nome] = resumir(latencias, time.perf_counter() - inicio, erros)
+    # ru_maxrss: KiB no Linux, bytes no macOS
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return resultados, pico // 1024 if sys.platform == 'darwin' else pico
+
+# Execução contra um gunicorn real com clientes concorrentes
+def porta_livre():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def iniciar_gunicorn(banco, porta, workers, threads, env=None):
+    env = dict(os.environ, DATABASE_PATH=banco, **(env or {}))
+    processo = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{porta}', '--workers', str(workers),
+         '--worker-class', 'gthread', '--threads', str(threads), '--log-level', 'warning', 'app:app'],
+        cwd=RAIZ, env=env
+    )
+    limite = time.monotonic() + 30
+    while time.monotonic() < limite:
+        try:
+            conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=1)
+            conexao.request('GET', '/')
+            if conexao.getresponse().status == 200:
+                return processo
+        except OSError:
+            time.sleep(0.2)
+        if processo.poll() is not None:
+            raise SystemExit('gunicorn encerrou durante a inicialização')
+    processo.terminate()
+    raise SystemExit('gunicorn não respondeu em 30s')
+
+def login_http(porta, corpo):
+    """Token de sessão obtido em POST /api/login"""
+    conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=60)
+    try:
+        conexao.request('POST', '/api/login', body=json.dumps(corpo).encode(),
+                        headers={'Content-Type': 'application/json'})
+        return json.loads(conexao.getresponse().read())['token']
+    finally:
+        conexao.close()
+
+def pids_do_servidor(processo):
+    pids = [processo.pid]
+    try:
+        with open(f'/proc/{processo.pid}/task/{processo.pid}/children') as filhos:
+            pids.extend(int(pid) for pid in filhos.read().split())
+    except OSError:
+        pass
+    return pids
+
+def executar_gunicorn(banco, cenarios, ctx, iteracoes, aquecimento, clientes, workers, threads):
+    porta = porta_livre()
+    processo = iniciar_gunicorn(banco, porta, workers, threads)
+    locais = threading.local()
+
+    def chamar(cenario):
+        if not hasattr(locais, 'conexao'):
+            locais.conexao = http.client.HTTPConnection('127.0.0.1', porta, timeout=60)
+        corpo = cenario.corpo(ctx) if cenario.corpo else None
+        dados = json.dumps(corpo).encode() if corpo is not None else None
+        headers = ctx.cabecalhos(cenario)
+        if dados:
+            headers['Content-Type'] = 'application/json'
+        inicio = time.perf_counter()
+        try:
+            locais.conexao.request(cenario.metodo, cenario.url(ctx), body=dados, headers=headers)
+            resposta = locais.conexao.getresponse()
+            conteudo = resposta.read()
+        except (OSError, http.client.HTTPException):
+            locais.conexao.close()
+            del locais.conexao
+            return time.perf_counter() - inicio, False
+        decorrido = time.perf_counter() - inicio
+        if cenario.nome == 'criar parcela' and resposta.status == 201:
+            ctx.registrar_criada(json.loads(conteudo))
+        return decorrido, resposta.status in cenario.status
+
+    try:
+        ctx.autenticar(lambda corpo: login_http(porta, corpo))
+        resultados = {}
+        with ThreadPoolExecutor(max_workers=clientes) as executor:
+            for cenario in cenarios:
+                if cenario.metodo == 'GET':
+                    list(executor.map(lambda _: chamar(cenario), range(aquecimento)))
+                inicio = time.perf_counter()
+                medidas = list(executor.map(lambda _: chamar(cenario), range(iteracoes)))
+                duracao = time.perf_counter() - inicio
+                resultados[cenario.nome] = resumir(
+                    [decorrido for decorrido, _ in medidas], duracao, sum(not ok for _, ok in medidas)
+                )
+        return resultados, pico_rss_kib(pids_do_servidor(processo))
+    finally:
+        processo.terminate()
+        processo.wait(timeout=30)
+
+# Baseline
+def comparar(resultados, baseline, tolerancia):
+    """Lista as regressões em relação ao baseline (p95, vazão, pico de RSS e erros)"""
+    regressoes = []
+    for nome, base in baseline['cenarios'].items():
+        atual = resultados['cenarios'].get(nome)
+        if atual is None:
+            continue
+        if atual['p95_ms'] > base['p95_ms'] * (1 + tolerancia):
+            regressoes.append(f"{nome}: p95 {atual['p95_ms']}ms > {base['p95_ms']}ms")
+        if atual['vazao_rps'] < base['vazao_rps'] * (1 - tolerancia):
+            regressoes.append(f"{nome}: vazão {atual['vazao_rps']} < {base['vazao_rps']} req/s")
+        if atual['erros'] > base['erros']:
+            regressoes.append(f"{nome}: {atual['erros']} erro(s), baseline {base['erros']}")
+    pico, pico_base = resultados.get('pico_rss_kib'), baseline.get('pico_rss_kib')
+    if pico and pico_base and pico > pico_base * (1 + tolerancia):
+        regressoes.append(f'pico de RSS {pico} KiB > {pico_base} KiB')
+    return regressoes
+
+def imprimir(resultados):
+    print(f"{'cenário':32} {'req':>6} {'erros':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'req/s':>9}")
+    for nome, r in resultados['cenarios'].items():
+        print(f"{nome:32} {r['requisicoes']:>6} {r['erros']:>6} {r['p50_ms']:>9.2f} "
+              f"{r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['vazao_rps']:>9.1f}")
+    if resultados.get('pico_rss_kib'):
+        print(f"pico de RSS: {resultados['pico_rss_kib'] / 1024:.1f} MiB")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Mede as rotas da API')
+    parser.add_argument('--banco', default=BANCO_PADRAO, help='Banco gerado por benchmark.gerador')
+    parser.add_argument('--iteracoes', type=int, default=200, help='Requisições por cenário')
+    parser.add_argument('--aquecimento', type=int, default=10, help='Requisições GET descartadas')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--cenario', action='append', help='Executa só os cenários informados')
+    parser.add_argument('--gunicorn', action='store_true', help='Mede um servidor gunicorn real')
+    parser.add_argument('--clientes', type=int, default=8, help='Clientes concorrentes (--gunicorn)')
+    parser.add_argument('--workers', type=int, default=2, help='Workers do gunicorn')
+    parser.add_argument('--threads', type=int, default=4, help='Threads por worker do gunicorn')
+    parser.add_argument('--sem-cache', action='store_true', help='Desativa o cache de respostas GET')
+    parser.add_argument('--baseline', help='JSON de uma execução anterior para comparar')
+    parser.add_argument('--tolerancia', type=float, default=0.2, help='Piora aceita antes de falhar (0.2 = 20%%)')
+    parser.add_argument('--salvar-baseline', help='Grava os resultados em JSON')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.banco):
+        parser.error(f'{args.banco} não existe: gere-o com python -m benchmark.gerador')
+
+    if args.sem_cache:
+        os.environ['RESPONSE_CACHE_SIZE'] = '0'
+
+    cenarios = cenarios_padrao()
+    if args.cenario:
+        cenarios = [c for c in cenarios if c.nome in args.cenario]
+        if not cenarios:
+            parser.error('Nenhum cenário encontrado')
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        banco = os.path.join(diretorio, 'comissoes.db')
+        shutil.copyfile(args.banco, banco)
+        ctx = Contexto(banco, args.semente)
+        if args.gunicorn:
+            cenarios_medidos, pico = executar_gunicorn(
+                banco, cenarios, ctx, args.iteracoes, args.aquecimento, args.clientes, args.workers, args.threads
+            )
+        else:
+            cenarios_medidos, pico = executar_test_client(banco, cenarios, ctx, args.iteracoes, args.aquecimento)
+
+    resultados = {
+        'modo': 'gunicorn' if args.gunicorn else 'test_client',
+        'iteracoes': args.iteracoes,
+        'cache': not args.sem_cache,
+        'cenarios': cenarios_medidos,
+        'pico_rss_kib': pico,
+    }
+    imprimir(resultados)
+
+    if args.salvar_baseline:
+        with open(args.salvar_baseline, 'w') as arquivo:
+            json.dump(resultados, arquivo, indent=2, ensure_ascii=False)
+        print(f'Resultados gravados em {args.salvar_baseline}')
+
+    if args.baseline:
+        with open(args.baseline) as arquivo:
+            baseline = json.load(arquivo)
+        if baseline.get('modo') != resultados['modo']:
+            parser.error(f"Baseline medido em modo {baseline.get('modo')}, execução em {resultados['modo']}")
+        regressoes = comparar(resultados, baseline, args.tolerancia)
+        if regressoes:
+            print(f'\nREGRESSÃO (tolerância {args.tolerancia:.0%}):')
+            for regressao in regressoes:
+                print(f'  - {regressao}')
+            return 1
+        print(f'\nSem regressões em relação a {args.baseline} (tolerância {args.tolerancia:.0%}).')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""Duração do fechamento de comissões (close_commission_period).
+
+O fechamento é definitivo, então roda sobre uma cópia do banco. O período vai
+do primeiro mês com comissões pendentes até juntar --parcelas parcelas; depois
+repete o mesmo fechamento (que não deve gravar nada) e confere os agregados.
+
+Uso:
+    python -m benchmark.fechamento --banco benchmark/dados/comissoes.db --parcelas 100000
+"""
+import argparse
+import calendar
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmark.gerador import BANCO_PADRAO, carregar_app
+
+def escolher_periodo(conn, parcelas):
+    """(início, fim, parcelas, vendedores) cobrindo meses inteiros até somar `parcelas` pendentes"""
+    meses = conn.execute('''
+        SELECT substr(pagamento_comissao, 1, 7) AS mes, COUNT(*) FROM parcelas
+        WHERE comissao_paga = 0 AND pagamento_comissao != ''
+        GROUP BY mes ORDER BY mes
+    ''').fetchall()
+    if not meses:
+        return None
+    total = 0
+    for mes, quantidade in meses:
+        total += quantidade
+        if total >= parcelas:
+            break
+    inicio = f'{meses[0][0]}-01'
+    fim = f'{mes}-{calendar.monthrange(int(mes[:4]), int(mes[5:]))[1]:02d}'
+    vendedores = conn.execute('''
+        SELECT COUNT(DISTINCT vendedor) FROM parcelas
+        WHERE comissao_paga = 0 AND pagamento_comissao BETWEEN ? AND ?
+    ''', (inicio, fim)).fetchone()[0]
+    return inicio, fim, total, vendedores
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Mede o fechamento de comissões de um período')
+    parser.add_argument('--banco', default=BANCO_PADRAO, help='Banco gerado por benchmark.gerador')
+    parser.add_argument('--parcelas', type=int, default=100000, help='Parcelas pendentes no período fechado')
+    parser.add_argument('--salvar', help='Grava os resultados em JSON')
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.banco):
+        parser.error(f'{args.banco} não existe: gere-o com python -m benchmark.gerador')
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        banco = os.path.join(diretorio, 'comissoes.db')
+        shutil.copyfile(args.banco, banco)
+        app = carregar_app(banco)
+        conn = app.connect_db()
+        try:
+            periodo = escolher_periodo(conn, args.parcelas)
+            if periodo is None:
+                print('Nenhuma comissão pendente no banco.')
+                return 1
+            inicio, fim, parcelas, vendedores = periodo
+
+            medidas = {}
+            for rodada in ('fechamento', 'repeticao'):
+                t0 = time.perf_counter()
+                fechamento_id, criado = app.close_commission_period(conn, inicio, fim, 'benchmark')
+                medidas[rodada] = {'duracao_s': round(time.perf_counter() - t0, 3), 'criado': criado}
+            with app.app.app_context():
+                fechamento = app.read_fechamento(conn.cursor(), fechamento_id, {})
+            divergencias = app.check_dashboard_aggregates(conn, corrigir=False)
+        finally:
+            conn.close()
+
+    print(f"Período: {inicio} a {fim} ({parcelas} parcelas pendentes, {vendedores} vendedores)")
+    print(f"Fechamento {fechamento['id']}: {fechamento['totalParcelas']} parcelas, "
+          f"{fechamento['totalVendedores']} extratos, comissão R$ {fechamento['comissao']:.2f}")
+    for rodada, medida in medidas.items():
+        print(f"{rodada:11} {medida['duracao_s']:>8.3f}s  {'gravou' if medida['criado'] else 'nada gravado'}")
+    print('Agregados conferidos.' if not divergencias else f'{len(divergencias)} divergência(s) nos agregados!')
+
+    if args.salvar:
+        with open(args.salvar, 'w') as arquivo:
+            json.dump({
+                'periodo': [inicio, fim], 'parcelas': parcelas, 'vendedores': vendedores,
+                'rodadas': medidas, 'divergencias': len(divergencias)
+            }, arquivo, indent=2, ensure_ascii=False)
+        print(f'Resultados gravados em {args.salvar}')
+    return 0 if not divergencias else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+"""Gerador de dados sintéticos com semente fixa.
+
+Cria um banco com o mesmo schema da aplicação (tabelas, migrações, triggers
+e agregados) e o preenche com vendedores, oportunidades e parcelas. A
+distribuição de vendas entre vendedores é enviesada (Zipf): poucos vendedores
+concentram a maior parte das oportunidades, como em produção.
+
+Uso:
+    python -m benchmark.gerador --banco benchmark/dados/comissoes.db \\
+        --vendedores 200 --oportunidades 50000 --parcelas 600000 --semente 42
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+BANCO_PADRAO = os.path.join(os.path.dirname(__file__), 'dados', 'comissoes.db')
+# Data de referência fixa para o resultado não depender do dia da execução
+DATA_REFERENCIA = date(2025, 1, 1)
+LOTE = 5000
+
+NOMES = ['Ana', 'Bruno', 'Carla', 'Diego', 'Elaine', 'Fábio', 'Gabriela', 'Heitor', 'Isabela', 'João',
+         'Karina', 'Lucas', 'Marina', 'Nicolas', 'Olívia', 'Paulo', 'Renata', 'Sérgio', 'Tatiane', 'Vítor']
+SOBRENOMES = ['Silva', 'Souza', 'Oliveira', 'Santos', 'Pereira', 'Lima', 'Carvalho', 'Ferreira',
+              'Rodrigues', 'Almeida', 'Costa', 'Gomes', 'Martins', 'Araújo', 'Ribeiro']
+EMPRESAS = ['Comércio', 'Distribuidora', 'Indústria', 'Serviços', 'Tecnologia', 'Transportes',
+            'Construtora', 'Clínica', 'Restaurante', 'Escritório']
+TIPOS_CONTA = ['Mensal', 'Trimestral', 'Anual', 'Avulsa']
+PESOS_TIPOS_CONTA = [70, 10, 15, 5]
+
+def carregar_app(banco):
+    """Importa o app apontando para `banco` (o import cria schema e migrações)"""
+    os.environ['DATABASE_PATH'] = os.path.abspath(banco)
+    import app
+    return app
+
+def pesos_zipf(quantidade, expoente=1.1):
+    return [1 / (posicao + 1) ** expoente for posicao in range(quantidade)]
+
+def gerar_vendedores(rng, quantidade):
+    vendedores = []
+    for i in range(quantidade):
+        nome = f'{rng.choice(NOMES)} {rng.choice(SOBRENOMES)} {i + 1:04d}'
+        admissao = DATA_REFERENCIA - timedelta(days=rng.randint(30, 3650))
+        vendedores.append((
+            nome, f'vendedor{i + 1:04d}@exemplo.com.br', f'(11) 9{rng.randint(1000, 9999)}-{rng.randint(1000, 9999)}',
+            admissao.isoformat(), '', admissao.isoformat()
+        ))
+    return vendedores
+
+def gerar(app, rng, total_vendedores, total_oportunidades, total_parcelas):
+    """Preenche o banco e devolve as contagens inseridas"""
+    conn = app.connect_db()
+    cur = conn.cursor()
+    try:
+        cur.execute('BEGIN')
+        vendedores = gerar_vendedores(rng, total_vendedores)
+        cur.executemany(
+            'INSERT INTO vendedores (nome, email, telefone, data_admissao, observacoes, data_cadastro) '
+            'VALUES (?, ?, ?, ?, ?, ?)', vendedores
+        )
+        nomes = [v[0] for v in vendedores]
+        # Nomes repetidos ficam com o vendedor mais antigo, como no preenchimento do app
+        ids = dict(cur.execute('SELECT nome, MIN(id) FROM vendedores GROUP BY nome').fetchall())
+        pesos = pesos_zipf(len(nomes))
+
+        # Parcelas divididas igualmente entre as oportunidades
+        por_oportunidade, sobra = divmod(total_parcelas, max(total_oportunidades, 1))
+        inseridas = 0
+        oportunidades, parcelas = [], []
+        for oportunidade_id in range(1, total_oportunidades + 1):
+            vendedor = rng.choices(nomes, pesos)[0]
+            tipo_conta = rng.choices(TIPOS_CONTA, PESOS_TIPOS_CONTA)[0]
+            mensalidade = round(rng.lognormvariate(6, 0.6), 2)
+            servicos = round(rng.choice([0, 0, 0, rng.uniform(100, 3000)]), 2)
+            valor_total = round(mensalidade * 12 + servicos, 2)
+            valor_liquido, comissao = app.calcular_comissao(valor_total)
+            fechamento = DATA_REFERENCIA - timedelta(days=rng.randint(0, 3 * 365))
+            cliente = f'{rng.choice(EMPRESAS)} {rng.choice(SOBRENOMES)} {oportunidade_id}'
+            oportunidades.append((
+                cliente, vendedor, ids[vendedor], tipo_conta, mensalidade, servicos, valor_total,
+                valor_liquido, comissao, fechamento.isoformat(), '', fechamento.isoformat()
+            ))
+
+            quantidade = por_oportunidade + (oportunidade_id <= sobra)
+            inseridas += quantidade
+            valor_liquido_parcela, comissao_parcela = app.calcular_comissao(mensalidade)
+            for numero in range(1, quantidade + 1):
+                vencimento = app.add_months(fechamento, numero)
+                pagamento = app.add_months(vencimento, 1).replace(day=10)
+                vencida = vencimento < DATA_REFERENCIA
+                recebida = vencida and rng.random() < 0.92
+                parcelas.append((
+                    oportunidade_id, cliente, vendedor, ids[vendedor], str(numero), mensalidade,
+                    valor_liquido_parcela, vencimento.isoformat(), pagamento.isoformat(),
+                    comissao_parcela, '', int(numero == 1), int(recebida),
+                    int(recebida and pagamento < DATA_REFERENCIA), fechamento.isoformat()
+                ))
+
+            if len(parcelas) >= LOTE or oportunidade_id == total_oportunidades:
+                cur.executemany(
+                    'INSERT INTO oportunidades (cliente, vendedor, vendedor_id, tipo_conta, mensalidade, servicos, '
+                    'valor_total, valor_liquido, comissao, data_fechamento, descricao, data_cadastro) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', oportunidades
+                )
+                cur.executemany(
+                    'INSERT INTO parcelas (oportunidade_id, cliente, vendedor, vendedor_id, numero, valor, '
+                    'valor_liquido, vencimento, pagamento_comissao, comissao, observacoes, primeira_mensalidade, '
+                    'recebida_pelo_cliente, comissao_paga, data_cadastro) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', parcelas
+                )
+                oportunidades, parcelas = [], []
+        conn.commit()
+
+        cur.execute('ANALYZE')
+        cur.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        return {
+            'vendedores': total_vendedores,
+            'oportunidades': total_oportunidades,
+            'parcelas': inseridas,
+        }
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Gera um banco sintético para benchmarks')
+    parser.add_argument('--banco', default=BANCO_PADRAO, help='Arquivo SQLite de destino')
+    parser.add_argument('--vendedores', type=int, default=200)
+    parser.add_argument('--oportunidades', type=int, default=50000)
+    parser.add_argument('--parcelas', type=int, default=600000)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--sobrescrever', action='store_true', help='Apaga o banco de destino se existir')
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.banco):
+        if not args.sobrescrever:
+            parser.error(f'{args.banco} já existe (use --sobrescrever)')
+        for sufixo in ('', '-wal', '-shm'):
+            if os.path.exists(args.banco + sufixo):
+                os.remove(args.banco + sufixo)
+
+    inicio = time.perf_counter()
+    app = carregar_app(args.banco)
+    contagens = gerar(app, random.Random(args.semente), args.vendedores, args.oportunidades, args.parcelas)
+    print(
+        f"{contagens['vendedores']} vendedores, {contagens['oportunidades']} oportunidades e "
+        f"{contagens['parcelas']} parcelas gerados em {time.perf_counter() - inicio:.1f}s ({args.banco})"
+    )
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Confere que as respostas com orjson são idênticas às do json padrão.
+
+Compara, byte a byte, o corpo de FastJSONProvider.response com o de
+DefaultJSONProvider.response para valores fixos (floats nos limites da notação
+científica, texto não ASCII, caracteres fora do BMP, datas) e para documentos
+aleatórios com semente fixa. Sai com código 1 na primeira divergência.
+
+Uso:
+    python -m benchmark.json_saida [--aleatorios 2000]
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import uuid
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from flask.json.provider import DefaultJSONProvider
+
+from benchmark.gerador import carregar_app
+
+CASOS = {
+    'floats': [
+        0.0, -0.0, 0.1, 1.5, 42.5, 1e-4, 1e-5, 0.00001, 1.23e-7, 1e15, 1e16, 1e17, 123456789.123,
+        9007199254740993.0, 1.7976931348623157e308, 5e-324, -2.5e-10, 10.0 / 3,
+        math.inf, -math.inf, math.nan,
+    ],
+    'inteiros': [0, -1, 2 ** 53, 2 ** 63 - 1, 2 ** 64, -2 ** 63, 10 ** 30, True, False, None],
+    'nao_ascii': [
+        'São Paulo', 'comissão à vista', 'ñ ü ß æ', '€ 1.000,00', '\x7f\x80\x9f\xa0\xff', '  ',
+        '\x00\x01\x1f "aspas" \\barra\\ /', '﻿BOM', '中文', '퟿￿',
+    ],
+    'fora_do_bmp': ['😀', 'a😀b', '𝄞 clave', '\U00010000', '\U0010ffff', '👍🏽 família 👨‍👩‍👧'],
+    'datas': [
+        date(2025, 1, 31), datetime(2025, 3, 10, 14, 5, 9), datetime(2025, 3, 10, 14, 5, 9, 123456),
+        datetime(2025, 3, 10, 14, 5, 9, tzinfo=timezone.utc),
+    ],
+    'outros': [Decimal('12.50'), Decimal('1E+3'), uuid.UUID(int=7)],
+    'documentos': [
+        {'b': 1, 'a': [1, 2, {'d': 'ç', 'c': 0.1}], 'ç': 'chave não ASCII'},
+        {'vendedor': 'João 😀', 'valor': 1e-5, 'vencimento': date(2025, 2, 10)},
+        [{'id': str(i), 'comissao': i / 7} for i in range(50)],
+        {}, [], '', {'': ''},
+    ],
+}
+
+def valor_aleatorio(rng, profundidade=0):
+    tipo = rng.randrange(9 if profundidade < 3 else 6)
+    if tipo == 0:
+        return rng.choice([0.0, rng.uniform(-1e6, 1e6), rng.uniform(-1, 1) * 10 ** rng.randint(-12, 20)])
+    if tipo == 1:
+        return rng.randint(-2 ** 70, 2 ** 70) if rng.random() < 0.1 else rng.randint(-10 ** 6, 10 ** 6)
+    if tipo == 2:
+        return ''.join(
+            chr(rng.choice([rng.randint(0x20, 0x7e), rng.randint(0, 0x10ffff)])) for _ in range(rng.randint(0, 8))
+        )
+    if tipo == 3:
+        return rng.choice([True, False, None])
+    if tipo == 4:
+        return date(rng.randint(1990, 2040), rng.randint(1, 12), rng.randint(1, 28))
+    if tipo == 5:
+        return round(rng.uniform(0, 10000), 2)
+    if tipo == 6:
+        return [valor_aleatorio(rng, profundidade + 1) for _ in range(rng.randint(0, 5))]
+    return {f'k{rng.randint(0, 20)}': valor_aleatorio(rng, profundidade + 1) for _ in range(rng.randint(0, 5))}
+
+def sem_substitutos(valor):
+    """Troca substitutos isolados (inválidos em UTF-8) por '?' para o caso ser serializável"""
+    if isinstance(valor, str):
+        return ''.join('?' if 0xd800 <= ord(c) <= 0xdfff else c for c in valor)
+    if isinstance(valor, list):
+        return [sem_substitutos(v) for v in valor]
+    if isinstance(valor, dict):
+        return {k: sem_substitutos(v) for k, v in valor.items()}
+    return valor
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compara a saída JSON com e sem orjson')
+    parser.add_argument('--aleatorios', type=int, default=2000, help='Documentos aleatórios além dos fixos')
+    parser.add_argument('--semente', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        modulo = carregar_app(os.path.join(diretorio, 'comissoes.db'))
+    if modulo.orjson is None:
+        print('orjson não instalado: as respostas já usam o json padrão.')
+        return 0
+    rapido, padrao = modulo.app.json, DefaultJSONProvider(modulo.app)
+
+    casos = [(f'{grupo}[{i}]', valor) for grupo, valores in CASOS.items() for i, valor in enumerate(valores)]
+    casos += [(f'{grupo}', valores) for grupo, valores in CASOS.items()]
+    rng = random.Random(args.semente)
+    casos += [(f'aleatorio[{i}]', sem_substitutos(valor_aleatorio(rng))) for i in range(args.aleatorios)]
+
+    rapidos = 0
+    with modulo.app.app_context():
+        for nome, valor in casos:
+            esperado = padrao.response(valor).get_data()
+            obtido = rapido.response(valor).get_data()
+            if obtido != esperado:
+                print(f'Divergência em {nome}:\n  json   {esperado[:200]!r}\n  orjson {obtido[:200]!r}')
+                return 1
+            rapidos += rapido.dumps_fast(valor) is not None
+    print(f'{len(casos)} casos idênticos ({rapidos} pelo orjson, {len(casos) - rapidos} pelo json padrão).')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,29 @@
+"""Fixtures dos testes: o app importado sobre um banco temporário.
+
+O app lê DATABASE_PATH no import; o banco é criado (com todas as migrações) e
+preenchido pelo gerador dos benchmarks uma vez por sessão.
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    os.environ['METRICS_ENABLED'] = '1'
+    from benchmark.gerador import carregar_app, gerar
+    app = carregar_app(str(tmp_path_factory.mktemp('banco') / 'comissoes.db'))
+    gerar(app, random.Random(42), 20, 300, 3000)
+    return app
+
+@pytest.fixture(scope='session')
+def client(app_module):
+    return app_module.app.test_client()
+
+@pytest.fixture(scope='session')
+def master_headers(client):
+    resposta = client.post('/api/login', json={'email': 'thiago@objetivasolucao.com.br', 'senha': 'vendas123'})
+    return {'Authorization': 'Bearer ' + resposta.get_json()['token']}
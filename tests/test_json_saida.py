@@ -0,0 +1,61 @@
+"""FastJSONProvider (orjson) gera o mesmo corpo, byte a byte, que o provider padrão."""
+import random
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from flask.json.provider import DefaultJSONProvider
+
+from benchmark.json_saida import CASOS, sem_substitutos, valor_aleatorio
+
+REPRESENTATIVOS = [
+    Decimal('12.50'), Decimal('0.1'), Decimal('1E+3'),
+    date(2025, 1, 31), datetime(2025, 3, 10, 14, 5, 9),
+    None, [None, None], {'observacoes': None, 'vendedorId': ''},
+    'São Paulo', 'comissão à vista', '€ 1.000,00', '中文', '😀', '\x00\x1f "aspas" \\barra\\',
+    {'vendedor': 'João Conceição', 'valor': Decimal('1500.00'), 'vencimento': date(2025, 2, 10),
+     'comissao': 127.5, 'observacoes': None},
+]
+
+@pytest.fixture
+def providers(app_module):
+    if app_module.orjson is None:
+        pytest.skip('orjson não instalado: as respostas já usam o json padrão')
+    with app_module.app.app_context():
+        yield app_module.app.json, DefaultJSONProvider(app_module.app)
+
+def casos():
+    fixos = [(f'{grupo}[{i}]', valor) for grupo, valores in CASOS.items() for i, valor in enumerate(valores)]
+    fixos += [(grupo, valores) for grupo, valores in CASOS.items()]
+    rng = random.Random(42)
+    aleatorios = [(f'aleatorio[{i}]', sem_substitutos(valor_aleatorio(rng))) for i in range(500)]
+    return fixos + aleatorios
+
+@pytest.mark.parametrize('valor', REPRESENTATIVOS, ids=repr)
+def test_representativos_identicos(providers, valor):
+    rapido, padrao = providers
+    assert rapido.response(valor).get_data() == padrao.response(valor).get_data()
+
+def test_casos_do_benchmark_identicos(providers):
+    rapido, padrao = providers
+    for nome, valor in casos():
+        assert rapido.response(valor).get_data() == padrao.response(valor).get_data(), nome
+
+@pytest.mark.parametrize('url', [
+    '/api/parcelas?limit=500',
+    '/api/oportunidades?limit=200',
+    '/api/vendedores',
+    '/api/dashboard/stats',
+    '/api/dashboard/vendedores',
+    '/api/relatorios/mensal?mesDe=01/2024&mesAte=12/2025',
+])
+def test_respostas_das_rotas_identicas(app_module, client, master_headers, monkeypatch, url):
+    if app_module.orjson is None:
+        pytest.skip('orjson não instalado: as respostas já usam o json padrão')
+    # Sem o cache de respostas, cada requisição serializa de novo
+    monkeypatch.setattr(app_module, 'response_cache', app_module.ResponseCache(0))
+    rapido = client.get(url, headers=master_headers)
+    monkeypatch.setattr(app_module.app, 'json', DefaultJSONProvider(app_module.app))
+    padrao = client.get(url, headers=master_headers)
+    assert rapido.status_code == padrao.status_code == 200
+    assert rapido.get_data() == padrao.get_data()
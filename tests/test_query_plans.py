@@ -0,0 +1,75 @@
+"""Os caminhos quentes usam os índices das migrações, sem varrer parcelas.
+
+Captura os SELECTs que cada rota executa (pelo log de consultas lentas, com o
+limite zerado) e confere o EXPLAIN QUERY PLAN de cada um.
+"""
+import pytest
+
+@pytest.fixture
+def planos(app_module, client, master_headers, monkeypatch):
+    """planos(url) -> [(sql, linhas do EXPLAIN QUERY PLAN)] dos SELECTs da rota"""
+    def executar(url):
+        capturados = []
+        monkeypatch.setattr(app_module, 'SLOW_QUERY_MS', -1)
+        monkeypatch.setattr(app_module, 'log_slow_query', lambda conn, sql, params, duracao:
+                            capturados.append((sql, params)))
+        resposta = client.get(url, headers=master_headers)
+        monkeypatch.undo()
+        assert resposta.status_code == 200, resposta.get_data(as_text=True)
+        conn = app_module.connect_db()
+        try:
+            return [
+                (sql, [linha[3] for linha in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)])
+                for sql, params in capturados
+                if params is not None and sql.lstrip()[:6].upper() in ('SELECT', 'WITH')
+            ]
+        finally:
+            conn.close()
+    return executar
+
+def acessos(plano, tabela):
+    """Linhas do plano que leem `tabela` (SCAN = varredura, SEARCH = por índice)"""
+    return [linha for linha in plano if linha.split()[1:2] == [tabela]]
+
+def consultas_de(planos, tabela):
+    return [(sql, plano) for sql, plano in planos if acessos(plano, tabela)]
+
+@pytest.mark.parametrize('url, indice, ordenado', [
+    ('/api/parcelas?vendedorId=3', 'idx_parcelas_vendedor_id_vencimento', True),
+    ('/api/parcelas?vendedorId=3&comissaoPaga=false', 'idx_parcelas_vendedor_id_vencimento', True),
+    ('/api/parcelas?vendedorId=3&vencimentoDe=01/03/2025&vencimentoAte=31/03/2025',
+     'idx_parcelas_vendedor_id_vencimento', True),
+    ('/api/parcelas?comissaoPaga=false&pagamentoComissaoDe=01/03/2025&pagamentoComissaoAte=31/03/2025',
+     'idx_parcelas_comissao_paga_pagamento', False),
+    ('/api/parcelas?pagamentoComissaoDe=01/03/2025&pagamentoComissaoAte=31/03/2025',
+     'idx_parcelas_comissao_paga_pagamento', False),
+])
+def test_parcelas_por_vendedor_status_e_mes_usam_indice(planos, url, indice, ordenado):
+    consultas = consultas_de(planos(url), 'parcelas')
+    assert consultas
+    for sql, plano in consultas:
+        assert all(linha.startswith('SEARCH ') and indice in linha
+                   for linha in acessos(plano, 'parcelas')), (sql, plano)
+        if ordenado:
+            # A ordem (vencimento, id) vem do próprio índice
+            assert 'USE TEMP B-TREE FOR ORDER BY' not in plano, (sql, plano)
+
+@pytest.mark.parametrize('url', [
+    '/api/dashboard/stats',
+    '/api/dashboard/vendedores',
+    '/api/dashboard/mensal',
+    '/api/relatorios/mensal?mesDe=01/2025&mesAte=06/2025',
+])
+def test_dashboard_le_agregados_e_nao_parcelas(planos, url):
+    for sql, plano in planos(url):
+        assert not acessos(plano, 'parcelas'), (sql, plano)
+
+@pytest.mark.parametrize('url, tabela', [
+    ('/api/dashboard/mensal?vendedorId=3', 'dashboard_vendedor_mes'),
+    ('/api/relatorios/mensal?mesDe=01/2025&mesAte=06/2025&vendedorId=3', 'relatorio_mensal'),
+])
+def test_dashboard_por_vendedor_usa_indice(planos, url, tabela):
+    consultas = consultas_de(planos(url), tabela)
+    assert consultas
+    for sql, plano in consultas:
+        assert all(linha.startswith('SEARCH ') for linha in acessos(plano, tabela)), (sql, plano)